@@ -13,6 +13,7 @@ setup(
     author_email="shawn@psymphonic.com",
     license='MIT',
     install_requires=['requests', 'simplejson'],
+    extras_require={'layout': ['numpy'], 'analytics': ['numpy', 'scipy']},
     classifiers=[
         'Development Status :: 4 - Beta',
         'License :: OSI Approved :: MIT License',
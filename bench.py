@@ -0,0 +1,356 @@
+__author__ = 'psymphonic'
+import argparse
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from collections import OrderedDict
+from random import randint, seed
+
+import simplejson as json
+
+from psynth.psynth import *
+from psynth.fakeserver import FakeServer
+
+# Benchmarks for the client. The in-memory ones never talk to a server; upload and load talk to an in-process
+# FakeServer. Every run is appended to a history file and compared with the last comparable run, so regressions
+# show up. Run with --help for the options.
+
+# The largest Graph any benchmark builds. Set from --max-size.
+max_size = 100000
+
+# The seconds the FakeServer adds to every request. Set from --latency.
+latency = 0.0
+
+# Seconds per measurement, by name, for this run.
+results = OrderedDict()
+
+
+def sizes(*candidates):
+    # The candidate sizes that fit within max_size.
+    return [size for size in candidates if size <= max_size]
+
+
+def offline_graph(nodes, links):
+    # Builds a Graph of random Links without sending any queries.
+    seed(nodes)
+    g = Graph(name='bench', filename='bench.gt', url='http://localhost/', username='bench', key='bench')
+    lt = LinkType()
+    g.add_link_type(lt, update=False)
+    ns = []
+    for i in range(0, nodes):
+        n = Node(name='Node '+str(i), x=randint(0, 10000), y=randint(0, 10000))
+        g.add_node(n, update=False)
+        ns.append(n)
+    for i in range(0, links):
+        g.add_link(Link(ns[randint(0, nodes-1)].uid, ns[randint(0, nodes-1)].uid, lt.name), update=False)
+    return g
+
+
+def uploaded_graph(server, local, mode):
+    # Creates a Graph on the FakeServer and sends it every object of a local Graph.
+    g = create_graph('bench', server.url, 'bench', 'bench', mode=mode)
+    for lt in local.link_types().values():
+        g.add_link_type(lt)
+    g.add_nodes(local.node_list())
+    g.add_links(local.link_list())
+    return g
+
+
+def timed(fn):
+    start = time.time()
+    fn()
+    return time.time()-start
+
+
+def record(name, seconds):
+    # Keeps a measurement for the history file.
+    results[name] = seconds
+    return seconds
+
+
+def bench_construction():
+    # Builds Graphs in memory. The time per object should stay flat as the Graph grows.
+    print 'construction'
+    for size in sizes(1000, 10000, 100000, 1000000):
+        t = record('construction/%d' % size, timed(lambda: offline_graph(size, size*2)))
+        print '    %7d nodes %7d links: %.3fs total, %.2fus per object' % (size, size*2, t, t/(size*3)*1e6)
+
+
+def bench_neighbors():
+    # Walks every Node's neighbors. The time per Node should stay flat as the Graph grows.
+    print 'neighbors'
+    for size in sizes(1000, 10000, 100000, 1000000):
+        g = offline_graph(size, size*2)
+
+        def walk():
+            for n in g.node_list():
+                n.all_neighbors()
+                n.out_links()
+                n.in_links()
+        t = record('neighbors/%d' % size, timed(walk))
+        print '    %7d nodes %7d links: %.3fs total, %.2fus per node' % (size, size*2, t, t/size*1e6)
+
+
+def bench_link_indexes():
+    # Looks up every Link's parallel Link objects and LinkType, then totals the value of every Node pair.
+    # The time per Link should stay flat as the Graph grows.
+    print 'link indexes'
+    for size in sizes(1000, 10000, 100000):
+        g = offline_graph(size, size*2)
+
+        def walk():
+            for link in g.link_list():
+                link.parallel()
+            for lt in g.link_types().itervalues():
+                lt.links()
+            g.pair_values()
+        t = record('link_indexes/%d' % size, timed(walk))
+        print '    %7d nodes %7d links: %.3fs total, %.2fus per link' % (size, size*2, t, t/(size*2)*1e6)
+
+
+def bench_details():
+    # Attaches Details to every Node. The time per Detail should stay flat as the Graph grows.
+    print 'details'
+    for size in sizes(1000, 10000, 50000):
+        g = offline_graph(size, 0)
+
+        def attach():
+            for n in g.node_list():
+                for i in range(0, 3):
+                    n.add_detail(Detail('http://psymphonic.com', type='link'), update=False)
+                n.detail_list()
+        t = record('details/%d' % size, timed(attach))
+        print '    %7d nodes %7d details: %.3fs total, %.2fus per detail' % (size, size*3, t, t/(size*3)*1e6)
+
+
+class DictNode(object):
+    # A Node stand-in that keeps its attributes in a per-instance __dict__, as Node did before it used __slots__.
+    pass
+
+
+def bench_memory():
+    # Compares the per-object overhead of slotted model objects with the same attributes held in a __dict__.
+    # Strings are shared by both layouts and are not counted.
+    print 'memory'
+    size = min(max_size, 100000)
+    g = offline_graph(size, size)
+    for label, objs in (('Node', g.node_list()), ('Link', g.link_list())):
+        slotted = 0
+        plain = 0
+        for obj in objs:
+            slotted += sys.getsizeof(obj)
+            d = DictNode()
+            for attr in obj.__slots__:
+                setattr(d, attr, getattr(obj, attr))
+            plain += sys.getsizeof(d)+sys.getsizeof(d.__dict__)
+        print '    %7d %-4s: %6.1fMB slotted, %6.1fMB with __dict__' % (len(objs), label, slotted/1e6, plain/1e6)
+
+
+def bench_spatial():
+    # Runs box, nearest-neighbor, and free-position queries. The time per query should stay flat as the Graph grows.
+    print 'spatial'
+    for size in sizes(10000, 100000, 1000000):
+        g = offline_graph(size, 0)
+        g.nodes_in_box(0, 0, 1, 1)
+
+        def query():
+            for i in range(0, 1000):
+                x = randint(0, 10000)
+                y = randint(0, 10000)
+                g.nodes_in_box(x, y, x+200, y+200)
+                g.nearest(x, y, k=5)
+            for i in range(0, 100):
+                g.find_free_position(24, x=randint(0, 10000), y=randint(0, 10000))
+        t = record('spatial/%d' % size, timed(query))
+        print '    %7d nodes: %.3fs for 1000 box and nearest queries and 100 placements' % (size, t)
+
+
+def bench_bbox():
+    # Moves Node objects and reads the bounding box after every move. The time per move should stay flat as the
+    # Graph grows.
+    print 'bounding box'
+    for size in sizes(1000, 10000, 100000, 1000000):
+        g = offline_graph(size, 0)
+        ns = g.node_list()
+        first = timed(g.bounding_box)
+
+        def move():
+            for i in range(0, 10000):
+                n = ns[randint(0, size-1)]
+                n.x = randint(0, 10000)
+                n.y = randint(0, 10000)
+                g.bounding_box()
+        t = record('bbox/%d' % size, timed(move))
+        print '    %7d nodes: %.3fs first read, %.2fus per move and read' % (size, first, t/10000*1e6)
+
+
+def bench_serialization():
+    # Builds the request URL for an update of every Node, as Node.update does. Runs twice, since the second pass
+    # reuses the quoted fields cached by the first.
+    print 'serialization'
+    size = min(max_size, 100000)
+    g = offline_graph(size, 0)
+
+    def serialize():
+        for n in g.node_list():
+            q = n.dictionary()
+            q['query'] = 'updatenode'
+            g.prep(q)
+    for label in ('first', 'second'):
+        t = record('serialization/%s' % label, timed(serialize))
+        print '    %7d updates, %s pass: %.3fs total, %.2fus per query' % (size, label, t, t/size*1e6)
+
+
+def bench_layout():
+    # Runs the local layout engine. The time per Node should grow far slower than the number of Node pairs.
+    # Skipped when numpy is not installed.
+    try:
+        from psynth.layout import force_layout
+    except ImportError:
+        return
+    print 'layout'
+    for size in sizes(1000, 10000):
+        g = offline_graph(size, size)
+        t = record('layout/%d' % size, timed(lambda: force_layout(g, iterations=10)))
+        print '    %7d nodes %7d links: %.3fs for 10 iterations, %.2fus per node' % (size, size, t, t/size*1e6)
+
+
+def bench_analytics():
+    # Converts a Graph to sparse matrices, then runs every analysis on the cached conversion.
+    # Skipped when numpy or scipy is not installed.
+    try:
+        from psynth import analytics
+    except ImportError:
+        return
+    print 'analytics'
+    size = min(max_size, 100000)
+    g = offline_graph(size, size*2)
+    t = record('analytics/convert', timed(lambda: analytics.matrices(g)))
+    print '    %7d nodes %7d links: %.3fs to convert' % (size, size*2, t)
+    for fn in (analytics.degree, analytics.weighted_degree, analytics.pagerank, analytics.eigenvector_centrality,
+               analytics.components, analytics.link_type_stats):
+        t = record('analytics/'+fn.__name__, timed(lambda: fn(g)))
+        print '    %-22s %.3fs' % (fn.__name__, t)
+
+
+def bench_upload():
+    # Uploads Graphs to a FakeServer with add_nodes and add_links, with queries in the URL and in POST bodies.
+    # The time per object should stay flat as the Graph grows.
+    print 'upload'
+    with FakeServer(latency=latency, seed=0) as server:
+        for mode in ('url', 'post'):
+            for size in sizes(1000, 10000, 100000, 1000000):
+                local = offline_graph(size, size*2)
+                box = []
+                t = record('upload/%s/%d' % (mode, size),
+                           timed(lambda: box.append(uploaded_graph(server, local, mode))))
+                print '    %-4s %7d nodes %7d links: %.3fs total, %.2fus per object, %d requests' % (
+                    mode, size, size*2, t, t/(size*3)*1e6, sum(server.counts.values()))
+                box[0].close()
+                server.reset()
+
+
+def bench_load():
+    # Loads Graphs from a FakeServer with load_graph, then from a SnapshotCache: first while filling it, then from
+    # the fresh snapshot without asking the server. The time per object should stay flat as the Graph grows.
+    from psynth.cache import SnapshotCache
+    print 'load'
+    directory = tempfile.mkdtemp()
+    try:
+        cache = SnapshotCache(directory, max_age=3600)
+        with FakeServer(latency=latency, seed=0) as server:
+            for size in sizes(1000, 10000, 100000, 1000000):
+                g = uploaded_graph(server, offline_graph(size, size*2), 'post')
+                g.close()
+                for label, c in (('server', None), ('caching', cache), ('snapshot', cache)):
+                    t = record('load/%s/%d' % (label, size),
+                               timed(lambda: load_graph(g.filename, server.url, 'bench', 'bench', cache=c).close()))
+                    print '    %-8s %7d nodes %7d links: %.3fs total, %.2fus per object' % (
+                        label, size, size*2, t, t/(size*3)*1e6)
+                server.reset()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+benchmarks = OrderedDict([('construction', bench_construction),
+                          ('neighbors', bench_neighbors),
+                          ('link_indexes', bench_link_indexes),
+                          ('details', bench_details),
+                          ('memory', bench_memory),
+                          ('spatial', bench_spatial),
+                          ('bbox', bench_bbox),
+                          ('serialization', bench_serialization),
+                          ('layout', bench_layout),
+                          ('analytics', bench_analytics),
+                          ('upload', bench_upload),
+                          ('load', bench_load)])
+
+
+def revision():
+    # The git commit of the working tree, or None outside a git checkout.
+    try:
+        with open(os.devnull, 'w') as null:
+            return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], stderr=null,
+                                           cwd=os.path.dirname(os.path.abspath(__file__))).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(history, run, threshold):
+    # Prints the measurements that got slower since the last run with the same settings, and returns how many.
+    previous = None
+    if os.path.exists(history):
+        with open(history) as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if (entry.get('max_size'), entry.get('latency'), entry.get('python')) == \
+                        (run['max_size'], run['latency'], run['python']):
+                    previous = entry
+    if previous is None:
+        print 'no earlier run to compare with'
+        return 0
+    print 'compared with %s of %s' % (previous.get('commit'), time.ctime(previous['time']))
+    slower = 0
+    for name, seconds in run['results'].iteritems():
+        before = previous['results'].get(name)
+        # Measurements under 10ms are mostly noise.
+        if before and max(before, seconds) >= 0.01 and seconds > before*(1+threshold):
+            print '    slower: %-28s %.3fs -> %.3fs (%+.0f%%)' % (name, before, seconds, (seconds/before-1)*100)
+            slower += 1
+    if not slower:
+        print '    nothing is more than %.0f%% slower' % (threshold*100)
+    return slower
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks for the psynth client.')
+    parser.add_argument('names', nargs='*', help='benchmarks to run, from: '+', '.join(benchmarks))
+    parser.add_argument('--max-size', type=int, default=max_size, help='the largest Graph to build, up to 1000000')
+    parser.add_argument('--latency', type=float, default=latency, help='seconds the FakeServer adds per request')
+    parser.add_argument('--history', default=os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                                          'bench_history.jsonl'),
+                        help='the file each run is appended to and compared with')
+    parser.add_argument('--no-history', action='store_true', help='neither compare with nor append to the history')
+    parser.add_argument('--threshold', type=float, default=0.25, help='how much slower counts as a regression')
+    args = parser.parse_args()
+    for name in args.names:
+        if name not in benchmarks:
+            parser.error('unknown benchmark: '+name)
+    max_size = args.max_size
+    latency = args.latency
+    for name in args.names or benchmarks:
+        benchmarks[name]()
+    run = {'time': time.time(), 'commit': revision(), 'python': platform.python_version(), 'max_size': max_size,
+           'latency': latency, 'results': results}
+    if not args.no_history:
+        slower = compare(args.history, run, args.threshold)
+        with open(args.history, 'a') as f:
+            f.write(json.dumps(run)+'\n')
+        sys.exit(1 if slower else 0)
@@ -0,0 +1,280 @@
+#coding=utf-8
+from __future__ import absolute_import
+__author__ = 'psymphonic'
+import weakref
+import numpy as np
+import scipy.sparse as sparse
+from scipy.sparse.csgraph import connected_components
+## @package psynth.analytics
+#  Local analytics for psynth Graph objects. Requires numpy and scipy.
+#  A Graph is converted to sparse matrices once, and the conversion is reused until the Graph changes. Conversions
+#  hold uids rather than Node objects, so they never keep a Graph alive.
+#  Graph.heat asks the server for its own analysis instead.
+
+_cache = weakref.WeakKeyDictionary()
+
+
+##
+# The sparse-matrix form of a Graph. Use matrices() instead of constructing one.
+#
+class Matrices(object):
+    def __init__(self, graph):
+        ##
+        # Converts a Graph. Link objects whose origin or terminus is not in the Graph are left out.
+        #
+        # @param graph: <i>Graph</i> :: The Graph to convert.
+        ## <i>int</i> :: The Graph.version() this conversion was made at.
+        self.version = graph.version()
+
+        ## <i>list</i> :: The uids of the Node objects of the Graph. Row and column i of every matrix is the Node
+        # with uid uids[i].
+        self.uids = [node.uid for node in graph.node_list()]
+
+        ## <i>dict</i> :: The row of every Node, by uid.
+        self.index = dict((uid, i) for i, uid in enumerate(self.uids))
+
+        links = graph.link_list()
+        count = len(links)
+        index = self.index
+        src = np.fromiter((index.get(link.origin_uid, -1) for link in links), dtype=np.int64, count=count)
+        dst = np.fromiter((index.get(link.terminus_uid, -1) for link in links), dtype=np.int64, count=count)
+        value = np.fromiter((link.value for link in links), dtype=np.float64, count=count)
+        codes = {}
+        type_code = np.fromiter((codes.setdefault(link.type, len(codes)) for link in links), dtype=np.int64,
+                                count=count)
+        keep = (src >= 0) & (dst >= 0)
+        if not keep.all():
+            src, dst, value, type_code = src[keep], dst[keep], value[keep], type_code[keep]
+
+        ## <i>ndarray</i> :: The row of the origin of every Link.
+        self.src = src
+
+        ## <i>ndarray</i> :: The row of the terminus of every Link.
+        self.dst = dst
+
+        ## <i>ndarray</i> :: The value of every Link.
+        self.value = value
+
+        ## <i>list</i> :: The LinkType names, in the order of their codes in type_code.
+        self.types = sorted(codes, key=codes.get)
+
+        ## <i>ndarray</i> :: The code of the LinkType of every Link.
+        self.type_code = type_code
+
+        n = len(self.uids)
+        ## <i>csr_matrix</i> :: Directed Link values from row to column. Parallel Link values are summed.
+        self.weights = sparse.csr_matrix((value, (src, dst)), shape=(n, n))
+
+        ## <i>csr_matrix</i> :: Directed Link counts from row to column.
+        self.counts = sparse.csr_matrix((np.ones(len(src)), (src, dst)), shape=(n, n))
+
+    def by_uid(self, values):
+        ##
+        # Returns a uid-keyed dictionary of one value per Node.
+        #
+        # @param values: <i>ndarray</i> :: One value per row.
+        # @return values: <i>dict</i> ::
+        return dict(zip(self.uids, values.tolist()))
+
+
+def matrices(graph):
+    ##
+    # Returns the sparse-matrix form of a Graph, converting it only if it changed since the last call.
+    #
+    # @param graph: <i>Graph</i> :: The Graph to convert.
+    # @return matrices: <i>Matrices</i> ::
+    #
+    # @code
+    # m = matrices(g)
+    # print m.weights.sum(), 'total value over', len(m.uids), 'nodes'
+    # @endcode
+    m = _cache.get(graph)
+    if m is None or m.version != graph.version():
+        m = Matrices(graph)
+        _cache[graph] = m
+    return m
+
+
+def degree(graph, direction='all'):
+    ##
+    # Returns the number of Link objects at every Node. A Link from a Node to itself counts twice for 'all'.
+    #
+    # @param graph: <i>Graph</i> :: The Graph to measure.
+    # @param direction: <i>str</i> :: 'out', 'in', or 'all'.
+    # @return degree: <i>dict</i> :: A uid-keyed dictionary of ints.
+    #
+    # @code
+    # d = degree(g, direction='out')
+    # busiest = max(d, key=d.get)
+    # @endcode
+    m = matrices(graph)
+    return m.by_uid(_tally(m, None, direction))
+
+
+def weighted_degree(graph, direction='all'):
+    ##
+    # Returns the total Link.value at every Node. A Link from a Node to itself counts twice for 'all'.
+    #
+    # @param graph: <i>Graph</i> :: The Graph to measure.
+    # @param direction: <i>str</i> :: 'out', 'in', or 'all'.
+    # @return degree: <i>dict</i> :: A uid-keyed dictionary of floats.
+    #
+    # @code
+    # received = weighted_degree(g, direction='in')
+    # @endcode
+    m = matrices(graph)
+    return m.by_uid(_tally(m, m.value, direction))
+
+
+def pagerank(graph, damping=0.85, weighted=False, tol=1.0e-10, max_iter=200):
+    ##
+    # Returns the PageRank of every Node, following Link objects from origin to terminus. The ranks sum to 1.
+    # Node objects without outgoing Link objects share their rank with every Node.
+    #
+    # @param graph: <i>Graph</i> :: The Graph to rank.
+    # @param damping: <i>float</i> :: The chance of following a Link rather than jumping to a random Node.
+    # @param weighted: <i>bool</i> :: Whether Link objects are followed in proportion to Link.value. Negative
+    # values count as 0.
+    # @param tol: <i>float</i> :: The total change in rank at which to stop.
+    # @param max_iter: <i>int</i> :: The most iterations to run.
+    # @return pagerank: <i>dict</i> :: A uid-keyed dictionary of floats.
+    #
+    # @code
+    # pr = pagerank(g, weighted=True)
+    # top = sorted(pr, key=pr.get, reverse=True)[:10]
+    # @endcode
+    m = matrices(graph)
+    n = len(m.uids)
+    if not n:
+        return {}
+    w = _weights(m, weighted)
+    out = np.asarray(w.sum(axis=1)).ravel()
+    dangling = out == 0
+    scale = np.where(dangling, 0.0, 1.0/np.where(dangling, 1.0, out))
+    # Rows of the transition matrix are scaled by 1/out; iterating with its transpose spreads rank along Link objects.
+    step = (sparse.diags(scale).dot(w)).T.tocsr()
+    rank = np.full(n, 1.0/n)
+    for i in range(0, max_iter):
+        new = damping*(step.dot(rank)+rank[dangling].sum()/n)+(1.0-damping)/n
+        new /= new.sum()
+        change = np.abs(new-rank).sum()
+        rank = new
+        if change < tol:
+            break
+    return m.by_uid(rank)
+
+
+def eigenvector_centrality(graph, weighted=False, tol=1.0e-10, max_iter=500):
+    ##
+    # Returns the eigenvector centrality of every Node, ignoring the direction of Link objects. The result has a
+    # Euclidean norm of 1.
+    #
+    # @param graph: <i>Graph</i> :: The Graph to measure.
+    # @param weighted: <i>bool</i> :: Whether Link objects count in proportion to Link.value. Negative values count
+    # as 0.
+    # @param tol: <i>float</i> :: The total change at which to stop.
+    # @param max_iter: <i>int</i> :: The most iterations to run.
+    # @return centrality: <i>dict</i> :: A uid-keyed dictionary of floats.
+    #
+    # @code
+    # c = eigenvector_centrality(g)
+    # @endcode
+    m = matrices(graph)
+    n = len(m.uids)
+    if not n:
+        return {}
+    w = _weights(m, weighted)
+    a = (w+w.T).tocsr()
+    x = np.full(n, 1.0/np.sqrt(n))
+    for i in range(0, max_iter):
+        # Adding x to each step shifts the spectrum, so the iteration converges on bipartite Graphs too.
+        new = a.dot(x)+x
+        norm = np.sqrt(new.dot(new))
+        if norm == 0:
+            break
+        new /= norm
+        change = np.abs(new-x).sum()
+        x = new
+        if change < tol:
+            break
+    return m.by_uid(x)
+
+
+def components(graph, connection='weak'):
+    ##
+    # Returns the connected components of a Graph as lists of Node objects, largest first.
+    #
+    # @param graph: <i>Graph</i> :: The Graph to split.
+    # @param connection: <i>str</i> :: 'weak' to ignore the direction of Link objects, or 'strong' to require a
+    # path each way.
+    # @return components: <i>list</i> :: A list of lists of Node objects.
+    #
+    # @code
+    # islands = components(g)[1:]
+    # @endcode
+    m = matrices(graph)
+    if not m.uids:
+        return []
+    count, labels = connected_components(m.counts, directed=True, connection=connection)
+    order = np.argsort(labels, kind='mergesort')
+    sizes = np.bincount(labels, minlength=count)
+    groups = np.split(order, np.cumsum(sizes)[:-1])
+    groups.sort(key=len, reverse=True)
+    uids = m.uids
+    node = graph.node
+    return [[node(uids[i]) for i in group.tolist()] for group in groups]
+
+
+def link_type_stats(graph):
+    ##
+    # Returns the number of Link objects of every LinkType, and the total, mean, minimum, and maximum of their
+    # values. The mean, minimum, and maximum are None for a LinkType without Link objects.
+    #
+    # @param graph: <i>Graph</i> :: The Graph to measure.
+    # @return stats: <i>dict</i> :: A dictionary of dictionaries with keys 'count', 'total', 'mean', 'min', and
+    # 'max', keyed by LinkType name.
+    #
+    # @code
+    # for name, s in link_type_stats(g).items():
+    #     print name, s['count'], s['mean']
+    # @endcode
+    m = matrices(graph)
+    stats = dict((name, {'count': 0, 'total': 0, 'mean': None, 'min': None, 'max': None})
+                 for name in graph.link_types())
+    if not len(m.type_code):
+        return stats
+    k = len(m.types)
+    counts = np.bincount(m.type_code, minlength=k)
+    totals = np.bincount(m.type_code, weights=m.value, minlength=k)
+    order = np.argsort(m.type_code, kind='mergesort')
+    present = np.flatnonzero(counts)
+    starts = (np.cumsum(counts)-counts)[present]
+    values = m.value[order]
+    lows = np.minimum.reduceat(values, starts)
+    highs = np.maximum.reduceat(values, starts)
+    for j, t in enumerate(present.tolist()):
+        c = int(counts[t])
+        total = float(totals[t])
+        stats[m.types[t]] = {'count': c, 'total': total, 'mean': total/c, 'min': float(lows[j]),
+                             'max': float(highs[j])}
+    return stats
+
+
+def _tally(m, weights, direction):
+    n = len(m.uids)
+    if direction == 'out':
+        return np.bincount(m.src, weights=weights, minlength=n)
+    if direction == 'in':
+        return np.bincount(m.dst, weights=weights, minlength=n)
+    if direction == 'all':
+        return np.bincount(m.src, weights=weights, minlength=n)+np.bincount(m.dst, weights=weights, minlength=n)
+    raise ValueError("direction must be 'out', 'in', or 'all'")
+
+
+def _weights(m, weighted):
+    if not weighted:
+        return m.counts
+    w = m.weights.copy()
+    w.data = np.maximum(w.data, 0.0)
+    w.eliminate_zeros()
+    return w
@@ -0,0 +1,375 @@
+#coding=utf-8
+from __future__ import absolute_import
+__author__ = 'psymphonic'
+import hashlib
+import itertools
+import marshal
+import mmap
+import os
+import struct
+import time
+import uuid
+## @package psynth.cache
+#  An on-disk cache of whole-graph snapshots, so load_graph can skip downloading a Graph that has not changed.
+#
+#  A snapshot file holds blocks of up to block_rows values of one section ('rel_types', 'nodes', 'rels', 'details'),
+#  then a header listing them. Each block stores the server's values column by column with marshal, and is written
+#  as soon as it fills, so saving a snapshot while a Graph downloads keeps memory bounded. Blocks are read from a
+#  memory map of the file one at a time, as a load reaches them, and rows are rebuilt from the columns one by one.
+#
+#  Snapshots are kept per user. One is only used without asking the server by the same username and key that saved
+#  it; with other credentials it is revalidated by ETag, so the server still checks access.
+
+## <i>int</i> :: The most values in one block of a snapshot file.
+block_rows = 8192
+
+_magic = 'PSYSNAP2'
+_sections = ('rel_types', 'nodes', 'rels', 'details')
+
+
+##
+# A SnapshotCache is a directory of Graph snapshots keyed by server URL, username, and filename.
+#
+class SnapshotCache(object):
+    def __init__(self, directory=None, max_age=60, max_bytes=256*1024*1024, max_idle=7*24*3600):
+        ##
+        # Constructs a SnapshotCache object.
+        #
+        # @param directory: <i>str</i> :: The directory to keep snapshots in. Defaults to ~/.psynth/snapshots.
+        # @param max_age: <i>float</i> :: The number of seconds a snapshot is used without asking the server.
+        # Older snapshots are revalidated with the server's ETag, or downloaded again if the server sent none.
+        # @param max_bytes: <i>int</i> :: The most bytes of snapshots to keep. The least recently used go first.
+        # @param max_idle: <i>float</i> :: The number of seconds after which an unused snapshot is deleted.
+        #
+        # @code
+        # cache = SnapshotCache(max_age=300)
+        # g = load_graph('myfile.gt', url, username, key, cache=cache)
+        # @endcode
+        if directory is None:
+            directory = os.path.join(os.path.expanduser('~'), '.psynth', 'snapshots')
+        ## <i>str</i> :: The directory snapshots are kept in.
+        self.directory = directory
+
+        ## <i>float</i> :: The number of seconds a snapshot is used without asking the server.
+        self.max_age = max_age
+
+        ## <i>int</i> :: The most bytes of snapshots to keep.
+        self.max_bytes = max_bytes
+
+        ## <i>float</i> :: The number of seconds after which an unused snapshot is deleted.
+        self.max_idle = max_idle
+
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):
+                    raise
+
+    def clear(self):
+        ##
+        # Deletes every snapshot.
+        #
+        # @code
+        # cache.clear()
+        # @endcode
+        for path in self.__paths():
+            _unlink(path)
+
+    def lookup(self, url, filename, username=None, key=None):
+        ##
+        # Returns the snapshot of a Graph, or None if there is none or it cannot be read. A snapshot saved with
+        # other credentials is returned, but is never fresh.
+        #
+        # @param url: <i>str</i> :: The base URL of the Psynth server.
+        # @param filename: <i>str</i> :: The global unique filename of the Graph.
+        # @param username: <i>str</i> :: The Psynth username loading the Graph.
+        # @param key: <i>str</i> :: The Psynth API key loading the Graph.
+        # @return snapshot: <i>Snapshot</i> ::
+        #
+        # @code
+        # s = cache.lookup(url, 'myfile.gt', username, key)
+        # if s and s.fresh():
+        #     print s.name
+        # @endcode
+        path = self.__path(url, filename, username)
+        try:
+            snapshot = Snapshot(self, path)
+        except (IOError, OSError, EOFError, ValueError, TypeError, KeyError, struct.error):
+            _unlink(path)
+            return None
+        if snapshot.url != url or snapshot.filename != filename or snapshot.username != username:
+            return None
+        snapshot.trusted = snapshot.credentials == _digest(username, key)
+        # The access time records use, for eviction; the modification time records when it was last validated.
+        os.utime(path, (time.time(), snapshot.saved))
+        return snapshot
+
+    def prune(self):
+        ##
+        # Deletes snapshots unused for max_idle seconds, then the least recently used until max_bytes are left.
+        #
+        # @code
+        # cache.prune()
+        # @endcode
+        now = time.time()
+        entries = []
+        for path in self.__paths():
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            if now-max(st.st_atime, st.st_mtime) > self.max_idle:
+                _unlink(path)
+            else:
+                entries.append((max(st.st_atime, st.st_mtime), st.st_size, path))
+        total = sum(e[1] for e in entries)
+        for used, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            _unlink(path)
+            total -= size
+
+    def remove(self, url, filename, username=None):
+        ##
+        # Deletes the snapshot of a Graph, e.g. after changing it, so the next load downloads it again.
+        #
+        # @param url: <i>str</i> :: The base URL of the Psynth server.
+        # @param filename: <i>str</i> :: The global unique filename of the Graph.
+        # @param username: <i>str</i> :: The Psynth username the snapshot was saved for.
+        #
+        # @code
+        # cache.remove(url, g.filename, g.username)
+        # @endcode
+        _unlink(self.__path(url, filename, username))
+
+    def touch(self, snapshot):
+        ##
+        # Marks a snapshot as just validated by the server, so it is fresh for another max_age seconds.
+        #
+        # @param snapshot: <i>Snapshot</i> :: The snapshot to mark.
+        snapshot.saved = time.time()
+        try:
+            os.utime(snapshot.path, (snapshot.saved, snapshot.saved))
+        except OSError:
+            pass
+
+    def writer(self, url, filename, etag=None, username=None, key=None):
+        ##
+        # Returns a SnapshotWriter that saves a Graph's values as they are parsed. Mostly for internal use.
+        #
+        # @param url: <i>str</i> :: The base URL of the Psynth server.
+        # @param filename: <i>str</i> :: The global unique filename of the Graph.
+        # @param etag: <i>str</i> :: The server's ETag for this version of the Graph, if it sent one.
+        # @param username: <i>str</i> :: The Psynth username that downloaded the Graph.
+        # @param key: <i>str</i> :: The Psynth API key that downloaded the Graph.
+        # @return writer: <i>SnapshotWriter</i> ::
+        return SnapshotWriter(self, self.__path(url, filename, username), url, filename, etag, username,
+                              _digest(username, key))
+
+    def __path(self, url, filename, username):
+        return os.path.join(self.directory, _digest(url, username, filename)+'.snap')
+
+    def __paths(self):
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return []
+        return [os.path.join(self.directory, n) for n in names if n.endswith('.snap')]
+
+
+##
+# A Snapshot is a saved copy of a whole Graph, as the server sent it.
+#
+class Snapshot(object):
+    def __init__(self, cache, path):
+        ##
+        # Reads the header of a snapshot file. Use SnapshotCache.lookup instead.
+        #
+        # @param cache: <i>SnapshotCache</i> :: The cache the snapshot belongs to.
+        # @param path: <i>str</i> :: The path of the snapshot file.
+        with open(path, 'rb') as f:
+            if f.read(len(_magic)) != _magic:
+                raise ValueError('Not a psynth snapshot: '+path)
+            st = os.fstat(f.fileno())
+            f.seek(-4, os.SEEK_END)
+            length = struct.unpack('<I', f.read(4))[0]
+            end = st.st_size-4-length
+            if end < len(_magic):
+                raise ValueError('Truncated psynth snapshot: '+path)
+            f.seek(end)
+            header = marshal.loads(f.read(length))
+            saved = st.st_mtime
+        blocks = header['blocks']
+        if sum(b[2] for b in blocks) != end-len(_magic):
+            raise ValueError('Truncated psynth snapshot: '+path)
+        ## <i>str</i> :: The path of the snapshot file.
+        self.path = path
+
+        ## <i>str</i> :: The base URL of the Psynth server.
+        self.url = header['url']
+
+        ## <i>str</i> :: The global unique filename of the Graph.
+        self.filename = header['filename']
+
+        ## <i>str</i> :: The Psynth username the snapshot was saved for.
+        self.username = header['username']
+
+        ## <i>str</i> :: A digest of the username and key that saved the snapshot.
+        self.credentials = header['credentials']
+
+        ## <i>bool</i> :: Whether the snapshot was looked up with the credentials that saved it. Only then can it be
+        # fresh.
+        self.trusted = False
+
+        ## <i>str</i> :: The server's ETag for this version of the Graph, or None.
+        self.etag = header['etag']
+
+        ## <i>str</i> :: The display name of the Graph.
+        self.name = header['name']
+
+        ## <i>float</i> :: When the server last confirmed this snapshot, in seconds since the epoch.
+        self.saved = saved
+
+        self.__cache = cache
+        self.__blocks = blocks
+        self.__base = len(_magic)
+
+    def age(self):
+        ##
+        # Returns the number of seconds since the server last confirmed this snapshot.
+        #
+        # @return age: <i>float</i> ::
+        return time.time()-self.saved
+
+    def fresh(self):
+        ##
+        # Returns whether this snapshot can be used without asking the server.
+        #
+        # @return fresh: <i>bool</i> ::
+        return self.trusted and self.age() < self.__cache.max_age
+
+    def items(self):
+        ##
+        # Yields ('name', str) once, then (section, value) for every item of every section, in the order of a
+        # 'getwholegraph' response. Each block is decoded only when it is reached.
+        #
+        # @return items: <i>generator</i> ::
+        #
+        # @code
+        # for section, value in s.items():
+        #     if section == 'nodes':
+        #         print value['NAME']
+        # @endcode
+        yield 'name', self.name
+        with open(self.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for section, offset, length in self.__blocks:
+                    offset += self.__base
+                    # A buffer lets marshal read the block in place rather than from a copy of it.
+                    fields, columns = marshal.loads(buffer(mm, offset, length))
+                    for row in itertools.izip(*columns):
+                        yield section, dict(itertools.izip(fields, row))
+                    del columns
+            finally:
+                mm.close()
+
+
+##
+# A SnapshotWriter saves the values of a Graph column by column while it downloads, a block at a time.
+#
+class SnapshotWriter(object):
+    def __init__(self, cache, path, url, filename, etag, username, credentials):
+        ##
+        # Constructs a SnapshotWriter object. Use SnapshotCache.writer instead.
+        self.__cache = cache
+        self.__path = path
+        self.__tmp = '%s.%s.tmp' % (path, uuid.uuid4().hex)
+        self.__file = None
+        self.__header = {'url': url, 'filename': filename, 'etag': etag, 'name': '', 'username': username,
+                         'credentials': credentials, 'blocks': []}
+        self.__offset = 0
+        self.__section = None
+        self.__fields = []
+        self.__columns = []
+        self.__count = 0
+
+    def add(self, section, value):
+        ##
+        # Records one parsed value of a 'getwholegraph' response.
+        #
+        # @param section: <i>str</i> :: 'name', 'rel_types', 'nodes', 'rels', or 'details'.
+        # @param value: <i>dict</i> :: The value as the server sent it.
+        if section == 'name':
+            self.__header['name'] = value
+            return
+        if section not in _sections:
+            return
+        if section != self.__section or self.__count >= block_rows:
+            self.__write_block()
+            self.__section = section
+        fields = self.__fields
+        columns = self.__columns
+        if len(value) != len(fields) or any(f not in value for f in fields):
+            for f in value:
+                if f not in fields:
+                    fields.append(f)
+                    columns.append([None]*self.__count)
+        for i, f in enumerate(fields):
+            columns[i].append(value.get(f))
+        self.__count += 1
+
+    def commit(self):
+        ##
+        # Finishes the snapshot file, replacing any older one, then prunes the cache.
+        self.__write_block()
+        f = self.__open()
+        encoded = marshal.dumps(self.__header, 2)
+        f.write(encoded)
+        f.write(struct.pack('<I', len(encoded)))
+        f.close()
+        self.__file = None
+        if os.name == 'nt':
+            _unlink(self.__path)
+        os.rename(self.__tmp, self.__path)
+        self.__cache.prune()
+
+    def discard(self):
+        ##
+        # Abandons the snapshot, e.g. when the download fails, and deletes what was written of it.
+        if self.__file:
+            self.__file.close()
+            self.__file = None
+            _unlink(self.__tmp)
+
+    def __open(self):
+        if self.__file is None:
+            self.__file = open(self.__tmp, 'wb')
+            self.__file.write(_magic)
+        return self.__file
+
+    def __write_block(self):
+        if not self.__count:
+            return
+        d = marshal.dumps((tuple(self.__fields), self.__columns), 2)
+        self.__open().write(d)
+        # Block offsets are counted from the end of the magic string.
+        self.__header['blocks'].append((self.__section, self.__offset, len(d)))
+        self.__offset += len(d)
+        self.__fields = []
+        self.__columns = []
+        self.__count = 0
+
+
+def _digest(*parts):
+    # A hex digest of some strings, any of which may be None or unicode.
+    return hashlib.sha1('\0'.join((p or u'').encode('utf-8') if isinstance(p, unicode) else (p or '')
+                                   for p in parts)).hexdigest()
+
+
+def _unlink(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,460 @@
+#coding=utf-8
+from __future__ import absolute_import
+__author__ = 'psymphonic'
+import BaseHTTPServer
+import SocketServer
+import random
+import socket
+import threading
+import time
+import urllib
+import uuid
+import zlib
+from collections import deque, OrderedDict
+import simplejson as json
+from psynth.psynth import allowed_queries
+## @package psynth.fakeserver
+#  An in-process stand-in for a Psynth server, for benchmarks and offline development.
+#  It keeps Graphs in memory, answers every query in allowed_queries over GET or POST, and can add latency and
+#  fail queries on purpose. Queries that need the real server's analysis get simple answers of the same shape.
+
+_node_fields = {'uid': 'UID', 'name': 'NAME', 'x': 'X', 'y': 'Y', 'shape': 'SHAPE', 'radius': 'RADIUS',
+                'color': 'COLOR', 'picture': 'PICTURE'}
+_rel_fields = {'uid': 'UID', 'name': 'NAME', 'rel_type': 'TYPE', 'value': 'VALUE', 'o_uid': 'ORIGIN',
+               't_uid': 'TERMINUS'}
+_detail_fields = {'uid': 'UID', 'name': 'NAME', 'type': 'TYPE', 'content': 'CONTENT', 'anchor_uid': 'ANCHOR_UID',
+                  'anchor_type': 'ANCHOR_TYPE', 'x': 'X', 'y': 'Y'}
+_numbers = {'X': float, 'Y': float, 'RADIUS': float, 'VALUE': int, 'MAX': int}
+
+
+##
+# A FakeServer serves the Psynth API from memory on a local port.
+#
+class FakeServer(object):
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, failure_rate=0.0, failure_status=500,
+                 fail_queries=None, accept_post=True, accept_gzip=True, etags=True, seed=None):
+        ##
+        # Constructs a FakeServer object. Call start() to begin serving.
+        #
+        # @param host: <i>str</i> :: The address to listen on.
+        # @param port: <i>int</i> :: The port to listen on. 0 picks a free port.
+        # @param latency: <i>float</i> :: The seconds to wait before answering each request.
+        # @param jitter: <i>float</i> :: The most extra seconds, chosen at random, to wait before answering.
+        # @param failure_rate: <i>float</i> :: The chance, between 0 and 1, that a request fails on purpose.
+        # @param failure_status: <i>int</i> :: The HTTP status of a failed request, or None to drop the connection
+        # without answering.
+        # @param fail_queries: <i>iterable</i> :: The query types that may fail. Every type if omitted.
+        # @param accept_post: <i>bool</i> :: Whether queries sent as POST bodies are accepted. If False they are
+        # refused with 405, as by a server that only reads queries from the URL.
+        # @param accept_gzip: <i>bool</i> :: Whether gzip-compressed POST bodies are accepted. If False they are
+        # refused with 415.
+        # @param etags: <i>bool</i> :: Whether 'getwholegraph' responses carry an ETag and honor If-None-Match.
+        # @param seed: <i>int</i> :: A seed for the random failures, jitter, and layouts, for repeatable runs.
+        #
+        # @code
+        # with FakeServer(latency=0.01) as server:
+        #     g = create_graph('test', server.url, 'me', 'key')
+        #     g.add_node(Node(name='A'))
+        #     print server.counts['newnode']
+        # @endcode
+
+        ## <i>float</i> :: The seconds to wait before answering each request.
+        self.latency = latency
+
+        ## <i>float</i> :: The most extra seconds, chosen at random, to wait before answering.
+        self.jitter = jitter
+
+        ## <i>float</i> :: The chance, between 0 and 1, that a request fails on purpose.
+        self.failure_rate = failure_rate
+
+        ## <i>int</i> :: The HTTP status of a failed request, or None to drop the connection.
+        self.failure_status = failure_status
+
+        ## <i>set</i> :: The query types that may fail, or None for every type.
+        self.fail_queries = set(fail_queries) if fail_queries is not None else None
+
+        ## <i>bool</i> :: Whether queries sent as POST bodies are accepted.
+        self.accept_post = accept_post
+
+        ## <i>bool</i> :: Whether gzip-compressed POST bodies are accepted.
+        self.accept_gzip = accept_gzip
+
+        ## <i>bool</i> :: Whether 'getwholegraph' responses carry an ETag and honor If-None-Match.
+        self.etags = etags
+
+        ## <i>dict</i> :: The Graphs held by the server, keyed by filename. See new_graph() for their layout.
+        self.graphs = {}
+
+        ## <i>dict</i> :: The number of requests answered, by query type.
+        self.counts = {}
+
+        ## <i>int</i> :: The number of requests failed on purpose.
+        self.failures = 0
+
+        ## <i>int</i> :: The bytes of request bodies and URLs received.
+        self.received = 0
+
+        ## <i>deque</i> :: The most recent queries, as decoded dictionaries. Set to a deque with a larger maxlen to
+        # keep more, or None to keep none.
+        self.queries = deque(maxlen=1000)
+
+        ## <i>str</i> :: The base URL to give create_graph and load_graph, once started.
+        self.url = None
+
+        self.__address = (host, port)
+        self.__random = random.Random(seed)
+        self.__lock = threading.RLock()
+        self.__fail_next = deque()
+        self.__server = None
+        self.__thread = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        ##
+        # Starts serving on a background thread.
+        #
+        # @return server: <i>FakeServer</i> :: This FakeServer.
+        server = _HTTPServer(self.__address, _Handler)
+        server.fake = self
+        self.__server = server
+        self.url = 'http://%s:%d/' % server.server_address[:2]
+        self.__thread = threading.Thread(target=server.serve_forever)
+        self.__thread.daemon = True
+        self.__thread.start()
+        return self
+
+    def stop(self):
+        ##
+        # Stops serving.
+        if self.__server:
+            self.__server.shutdown()
+            self.__server.server_close()
+            self.__server = None
+            self.__thread = None
+
+    def fail_next(self, count=1, status=500):
+        ##
+        # Fails the next requests on purpose, whatever failure_rate says.
+        #
+        # @param count: <i>int</i> :: The number of requests to fail.
+        # @param status: <i>int</i> :: The HTTP status to fail them with, or None to drop the connection.
+        #
+        # @code
+        # server.fail_next(1, status=503)
+        # @endcode
+        with self.__lock:
+            self.__fail_next.extend([status]*count)
+
+    def new_graph(self, name, filename=None):
+        ##
+        # Adds an empty Graph to the server, as 'createmap' does, and returns it.
+        # A Graph is a dictionary with 'name', 'version', and OrderedDicts of 'rel_types', 'nodes', 'rels', and
+        # 'details' records, keyed by NAME or UID, in the form 'getwholegraph' sends them.
+        #
+        # @param name: <i>str</i> :: The display name of the Graph.
+        # @param filename: <i>str</i> :: The filename of the Graph. A new one is made if omitted.
+        # @return graph: <i>dict</i> ::
+        if filename is None:
+            filename = str(uuid.uuid4())+'.gt'
+        graph = {'name': name, 'filename': filename, 'version': 0, 'rel_types': OrderedDict(),
+                 'nodes': OrderedDict(), 'rels': OrderedDict(), 'details': OrderedDict()}
+        with self.__lock:
+            self.graphs[filename] = graph
+        return graph
+
+    def reset(self):
+        ##
+        # Forgets every Graph and every count.
+        with self.__lock:
+            self.graphs.clear()
+            self.counts.clear()
+            self.failures = 0
+            self.received = 0
+            self.__fail_next.clear()
+            if self.queries is not None:
+                self.queries.clear()
+
+    def _failure(self, name):
+        ##
+        # Returns whether this request fails on purpose, and with which status. Mostly for internal use.
+        with self.__lock:
+            if self.__fail_next:
+                self.failures += 1
+                return True, self.__fail_next.popleft()
+            if self.failure_rate and (self.fail_queries is None or name in self.fail_queries) \
+                    and self.__random.random() < self.failure_rate:
+                self.failures += 1
+                return True, self.failure_status
+        return False, None
+
+    def _count(self, size):
+        ##
+        # Adds to the bytes received. Mostly for internal use.
+        with self.__lock:
+            self.received += size
+
+    def _delay(self):
+        ##
+        # Waits for latency plus jitter seconds. Mostly for internal use.
+        wait = self.latency
+        if self.jitter:
+            with self.__lock:
+                wait += self.__random.random()*self.jitter
+        if wait > 0:
+            time.sleep(wait)
+
+    def _answer(self, query, if_none_match=None):
+        ##
+        # Applies a decoded query and returns (status, response, headers). Mostly for internal use.
+        name = query.get('query')
+        if name not in allowed_queries:
+            return 406, "'query' field contained an invalid value.", ()
+        if 'user' not in query or 'key' not in query:
+            return 406, 'Missing user or key.', ()
+        with self.__lock:
+            self.counts[name] = self.counts.get(name, 0)+1
+            if self.queries is not None:
+                self.queries.append(query)
+            if name == 'createmap':
+                return 200, {'filename': self.new_graph(query.get('name', ''))['filename']}, ()
+            if name == 'getfilelist':
+                return 200, [{'filename': f, 'name': g['name']} for f, g in self.graphs.iteritems()], ()
+            graph = self.graphs.get(query.get('filename'))
+            if graph is None:
+                return 406, 'No such file.', ()
+            return _apply(graph, name, query, if_none_match, self.etags, self.__random)
+
+
+def _record(query, fields):
+    # Turns the fields of a query into a record in the form 'getwholegraph' sends.
+    record = {}
+    for k, v in query.iteritems():
+        k = fields.get(k, k.upper())
+        if k in _numbers and v is not None:
+            try:
+                v = _numbers[k](v)
+            except (TypeError, ValueError):
+                pass
+        record[k] = v
+    return record
+
+
+def _creates(section, fields, key):
+    def create(graph, query):
+        record = _record(dict((k, v) for k, v in query.iteritems() if k not in ('query', 'user', 'key', 'filename')),
+                         fields)
+        graph[section][record[key]] = record
+    return create
+
+
+def _updates(section, fields, key, field):
+    def update(graph, query):
+        record = graph[section].get(query.get(field))
+        if record is not None:
+            record.update(_record(dict((k, v) for k, v in query.iteritems()
+                                       if k not in ('query', 'user', 'key', 'filename')), fields))
+    return update
+
+
+def _deletes(section):
+    def delete(graph, query):
+        graph[section].pop(query.get('uid'), None)
+    return delete
+
+
+_create_node = _creates('nodes', _node_fields, 'UID')
+_create_rel = _creates('rels', _rel_fields, 'UID')
+_changes = {'newnode': _create_node,
+            'newrel': _create_rel,
+            'newdetail': _creates('details', _detail_fields, 'UID'),
+            'newreltype': _creates('rel_types', {}, 'NAME'),
+            'batchnodes': lambda graph, query: [_create_node(graph, n) for n in query.get('nodes', ())],
+            'batchrels': lambda graph, query: [_create_rel(graph, r) for r in query.get('rels', ())],
+            'updatenode': _updates('nodes', _node_fields, 'UID', 'uid'),
+            'updaterel': _updates('rels', _rel_fields, 'UID', 'uid'),
+            'updatedetail': _updates('details', _detail_fields, 'UID', 'uid'),
+            'updatereltype': _updates('rel_types', {}, 'NAME', 'NAME'),
+            'delnode': _deletes('nodes'),
+            'delrel': _deletes('rels'),
+            'deldetail': _deletes('details')}
+
+
+def _apply(graph, name, query, if_none_match, etags, rng):
+    # Answers a query about one Graph. Called with the FakeServer's lock held.
+    if name in _changes:
+        _changes[name](graph, query)
+        graph['version'] += 1
+        return 200, 'ok', ()
+    if name == 'getwholegraph':
+        tag = '"%s-%d"' % (graph['filename'], graph['version'])
+        headers = (('ETag', tag),) if etags else ()
+        if etags and if_none_match == tag:
+            return 304, None, headers
+        return 200, {'name': graph['name'],
+                     'rel_types': graph['rel_types'].values(),
+                     'nodes': graph['nodes'].values(),
+                     'rels': graph['rels'].values(),
+                     'details': graph['details'].values()}, headers
+    if name in ('renamemap', 'setgraphname'):
+        graph['name'] = query.get('name', graph['name'])
+        return 200, 'ok', ()
+    if name == 'getgraphname':
+        return 200, {'name': graph['name']}, ()
+    if name == 'drawgraph':
+        # Any layout will do; positions are spread at random over a square that grows with the Graph.
+        side = 100.0*max(1, len(graph['nodes']))**0.5
+        for record in graph['nodes'].itervalues():
+            record['X'] = rng.random()*side
+            record['Y'] = rng.random()*side
+        for record in graph['details'].itervalues():
+            anchor = graph['nodes'].get(record.get('ANCHOR_UID'))
+            if anchor:
+                record['X'] = anchor['X']+10
+                record['Y'] = anchor['Y']
+        graph['version'] += 1
+        return 200, _positions(graph), ()
+    if name == 'getallpos':
+        return 200, _positions(graph), ()
+    if name == 'getheat':
+        return 200, {'heat': [{'UID': urllib.unquote(u), 'HEAT': h} for u, h in _degrees(graph).iteritems()]}, ()
+    if name == 'nodeplusone':
+        uid = query.get('uid')
+        return 200, {'uids': _unquoted(set([uid]) | _neighbors(graph, uid))}, ()
+    if name == 'expandselection':
+        uids = set(query.get('uids', ()))
+        found = set(uids)
+        for uid in uids:
+            found |= _neighbors(graph, uid)
+        return 200, {'uids': _unquoted(found)}, ()
+    if name == 'interconnections':
+        uids = set(query.get('uids', ()))
+        rels = [r['UID'] for r in graph['rels'].itervalues() if r['ORIGIN'] in uids and r['TERMINUS'] in uids]
+        return 200, {'uids': _unquoted(rels)}, ()
+    if name == 'shortestpath':
+        return 200, {'uids': _unquoted(_path(graph, query.get('o_uid'), query.get('t_uid')))}, ()
+    if name == 'getcomments' or name == 'getchat' or name == 'getqueue':
+        return 200, [], ()
+    return 200, 'ok', ()
+
+
+def _positions(graph):
+    return {'nodes': [{'UID': urllib.unquote(r['UID']), 'X': r.get('X'), 'Y': r.get('Y')}
+                      for r in graph['nodes'].itervalues()],
+            'details': [{'UID': urllib.unquote(r['UID']), 'X': r.get('X'), 'Y': r.get('Y')}
+                        for r in graph['details'].itervalues()]}
+
+
+def _unquoted(uids):
+    return [urllib.unquote(u) for u in uids]
+
+
+def _degrees(graph):
+    degrees = dict((u, 0) for u in graph['nodes'])
+    for r in graph['rels'].itervalues():
+        for end in (r['ORIGIN'], r['TERMINUS']):
+            if end in degrees:
+                degrees[end] += 1
+    return degrees
+
+
+def _neighbors(graph, uid):
+    found = set()
+    for r in graph['rels'].itervalues():
+        if r['ORIGIN'] == uid:
+            found.add(r['TERMINUS'])
+        elif r['TERMINUS'] == uid:
+            found.add(r['ORIGIN'])
+    return found
+
+
+def _path(graph, origin, terminus):
+    # A breadth-first search, ignoring the direction of Links.
+    adjacent = {}
+    for r in graph['rels'].itervalues():
+        adjacent.setdefault(r['ORIGIN'], []).append(r['TERMINUS'])
+        adjacent.setdefault(r['TERMINUS'], []).append(r['ORIGIN'])
+    previous = {origin: None}
+    frontier = deque([origin])
+    while frontier:
+        uid = frontier.popleft()
+        if uid == terminus:
+            path = []
+            while uid is not None:
+                path.append(uid)
+                uid = previous[uid]
+            return path[::-1]
+        for v in adjacent.get(uid, ()):
+            if v not in previous:
+                previous[v] = uid
+                frontier.append(v)
+    return []
+
+
+class _HTTPServer(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        fake = self.server.fake
+        fake._count(len(self.path))
+        path = urllib.unquote(self.path)
+        if not path.startswith('/api/'):
+            return self.__reply(404, 'Not found.')
+        self.__handle(path[len('/api/'):])
+
+    def do_POST(self):
+        fake = self.server.fake
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        fake._count(len(self.path)+len(body))
+        if not fake.accept_post:
+            return self.__reply(405, 'Queries must be sent in the URL.')
+        if self.headers.get('Content-Encoding') == 'gzip':
+            if not fake.accept_gzip:
+                return self.__reply(415, 'Compressed bodies are not supported.')
+            body = zlib.decompress(body, 31)
+        self.__handle(body)
+
+    def __handle(self, text):
+        fake = self.server.fake
+        try:
+            query = json.loads(text)
+        except ValueError:
+            return self.__reply(406, 'Malformed query.')
+        if not isinstance(query, dict):
+            return self.__reply(406, 'Malformed query.')
+        fake._delay()
+        failed, status = fake._failure(query.get('query'))
+        if failed:
+            if status is None:
+                self.close_connection = 1
+                self.connection.shutdown(socket.SHUT_RDWR)
+                return
+            return self.__reply(status, 'Failed on purpose.')
+        status, response, headers = fake._answer(query, self.headers.get('If-None-Match'))
+        self.__reply(status, response, headers)
+
+    def __reply(self, status, response, headers=()):
+        body = json.dumps(response) if status != 304 else ''
+        self.send_response(status)
+        for header in headers:
+            self.send_header(*header)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
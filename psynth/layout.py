@@ -0,0 +1,317 @@
+#coding=utf-8
+from __future__ import absolute_import
+__author__ = 'psymphonic'
+import math
+import multiprocessing
+import numpy as np
+from collections import deque
+from psynth.psynth import Node, Detail
+## @package psynth.layout
+#  A local force-directed layout engine for psynth Graph objects. Requires numpy.
+#  It is an offline alternative to Graph.draw, which asks the server for a layout.
+
+
+def force_layout(graph, iterations=50, distance=100.0, processes=1, fixed=None, nodes=None):
+    ##
+    # Lays out a Graph with a Fruchterman-Reingold force simulation, and writes the new x and y of every Node and
+    # Detail, just as Graph.draw does. Links pull their Node objects together and every pair of Node objects pushes
+    # apart. Pushes between nearby Node objects are computed exactly on a grid; farther Node objects push through
+    # the centroids of grid cells, and the farthest through the centroids of coarse blocks of cells.
+    #
+    # @param graph: <i>Graph</i> :: The Graph to lay out.
+    # @param iterations: <i>int</i> :: The number of simulation steps.
+    # @param distance: <i>float</i> :: The ideal length of a Link.
+    # @param processes: <i>int</i> :: The number of processes that share the push computation.
+    # @param fixed: <i>iterable</i> :: uids of Node objects that must keep their current positions.
+    # @param nodes: <i>list</i> :: The Node objects to simulate. Every Node in the Graph if omitted; any other Node
+    # and its Link objects are ignored.
+    #
+    # @code
+    # from psynth.layout import force_layout
+    # force_layout(g, iterations=100, processes=4)
+    # @endcode
+    if nodes is None:
+        nodes = graph.node_list()
+    n = len(nodes)
+    if not n:
+        return
+    index = dict((node.uid, i) for i, node in enumerate(nodes))
+    pos = np.array([(node.x, node.y) for node in nodes], dtype=np.float64)
+    movable = np.ones(n, dtype=bool)
+    if fixed:
+        for uid in fixed:
+            if uid in index:
+                movable[index[uid]] = False
+    src = []
+    dst = []
+    links = graph.link_list() if len(nodes) == len(graph.nodes()) else _links_among(graph, nodes)
+    for link in links:
+        o = index.get(link.origin_uid)
+        t = index.get(link.terminus_uid)
+        if o is not None and t is not None and o != t:
+            src.append(o)
+            dst.append(t)
+    src = np.array(src, dtype=np.intp)
+    dst = np.array(dst, dtype=np.intp)
+
+    k = float(distance)
+    side = math.sqrt(n)*k
+    rng = np.random.RandomState(n)
+    if movable.all() and np.ptp(pos, axis=0).max() < k:
+        # Everything starts in one spot, e.g. freshly created Node objects, so scatter them first.
+        pos = rng.uniform(0, side, (n, 2))
+    pos[movable] += rng.uniform(-k*1e-3, k*1e-3, (int(movable.sum()), 2))
+
+    pool = None
+    if processes > 1:
+        pool = multiprocessing.Pool(processes)
+    try:
+        # With fixed Node objects the rest of the layout is settled, so only local moves are allowed.
+        start = side/10 if movable.all() else k
+        for i in range(0, iterations):
+            disp = _repulsion(pos, k, processes, pool)
+            if len(src):
+                delta = pos[src]-pos[dst]
+                d = np.sqrt((delta**2).sum(axis=1))[:, None]
+                pull = delta*d/k
+                for axis in (0, 1):
+                    disp[:, axis] -= np.bincount(src, pull[:, axis], minlength=n)
+                    disp[:, axis] += np.bincount(dst, pull[:, axis], minlength=n)
+            temperature = start*(1-float(i)/iterations)
+            length = np.sqrt((disp**2).sum(axis=1))
+            step = np.minimum(length, temperature)/np.maximum(length, 1e-9)
+            pos[movable] += (disp*step[:, None])[movable]
+    finally:
+        if pool:
+            pool.close()
+            pool.join()
+
+    for i, node in enumerate(nodes):
+        if movable[i]:
+            node.x = float(pos[i, 0])
+            node.y = float(pos[i, 1])
+    place_details(graph, [node for i, node in enumerate(nodes) if movable[i]])
+
+
+def incremental_layout(graph, objects, iterations=30, distance=100.0):
+    ##
+    # Places new Node and Detail objects in a Graph that is already laid out, keeping every other Node where it is.
+    # Each new Node starts at the mean position of its placed neighbors, or at a free position near the center of
+    # the Graph if it has none. The new Node objects are then settled by force_layout among their neighbors and the
+    # placed Node objects around them.
+    #
+    # @param graph: <i>Graph</i> :: The Graph to lay out.
+    # @param objects: <i>iterable</i> :: The Node and Detail objects to place, e.g. Graph.unplaced().
+    # @param iterations: <i>int</i> :: The number of simulation steps.
+    # @param distance: <i>float</i> :: The ideal length of a Link.
+    # @return changed: <i>tuple</i> :: A tuple (nodes, details) of the objects whose positions changed.
+    #
+    # @code
+    # nodes, details = incremental_layout(g, g.unplaced())
+    # g.push_positions(nodes, details)
+    # @endcode
+    new = [o for o in objects if isinstance(o, Node)]
+    placing = set(node.uid for node in new)
+    k = float(distance)
+    rng = np.random.RandomState(len(graph.nodes()))
+
+    # Seed breadth first from the placed Node objects, so chains of new Node objects grow outward from them.
+    neighbors = dict((node.uid, [n for n in node.all_neighbors() if n is not None]) for node in new)
+    queue = deque(node for node in new if any(n.uid not in placing for n in neighbors[node.uid]))
+    queued = set(node.uid for node in queue)
+    seeded = 0
+    while seeded < len(new):
+        if not queue:
+            node = next(n for n in new if n.uid not in queued)
+            queued.add(node.uid)
+            p = graph.find_free_position(node.radius)
+            node.x, node.y = p['x'], p['y']
+        else:
+            node = queue.popleft()
+            anchors = [n for n in neighbors[node.uid] if n.uid not in placing]
+            node.x = sum(n.x for n in anchors)/len(anchors)+rng.uniform(-k/2, k/2)
+            node.y = sum(n.y for n in anchors)/len(anchors)+rng.uniform(-k/2, k/2)
+        placing.discard(node.uid)
+        seeded += 1
+        for n in neighbors[node.uid]:
+            if n.uid in placing and n.uid not in queued:
+                queued.add(n.uid)
+                queue.append(n)
+
+    before = dict((d.uid, (d.x, d.y)) for d in graph.detail_list())
+    if new:
+        # Only the neighbors of the new Node objects and the Node objects around them take part.
+        reach = 2*k
+        local = dict((node.uid, node) for node in new)
+        for node in new:
+            for n in neighbors[node.uid]:
+                local[n.uid] = n
+            for n in graph.nodes_in_box(node.x-reach, node.y-reach, node.x+reach, node.y+reach):
+                local[n.uid] = n
+        moving = set(node.uid for node in new)
+        force_layout(graph, iterations=iterations, distance=distance, nodes=local.values(),
+                     fixed=[uid for uid in local if uid not in moving])
+    anchors = {}
+    for d in objects:
+        if isinstance(d, Detail) and d.anchor_uid in graph.nodes():
+            anchors[d.anchor_uid] = graph.node(d.anchor_uid)
+        elif isinstance(d, Detail) and d.anchor_uid in graph.links():
+            link = graph.link(d.anchor_uid)
+            anchors[link.origin_uid] = link.origin()
+    place_details(graph, [n for n in anchors.values() if n is not None])
+    details = [d for d in graph.detail_list() if before.get(d.uid) != (d.x, d.y)]
+    return new, details
+
+
+def place_details(graph, anchors=None):
+    ##
+    # Stacks the Detail objects of Node and Link objects beside their anchors, the same way Node.add_detail and
+    # Link.add_detail place a new Detail.
+    #
+    # @param graph: <i>Graph</i> :: The Graph whose Detail objects to place.
+    # @param anchors: <i>list</i> :: The Node objects whose Detail objects, and whose Link objects' Detail objects,
+    # should be placed. Every Detail in the Graph is placed if omitted.
+    #
+    # @code
+    # place_details(g)
+    # @endcode
+    if anchors is None:
+        nodes = graph.node_list()
+        links = graph.link_list()
+    else:
+        nodes = anchors
+        links = {}
+        for node in anchors:
+            for link in node.all_links():
+                links[link.uid] = link
+        links = links.values()
+    for node in nodes:
+        for i, d in enumerate(graph.anchored_details(node.uid)):
+            d.x = node.x+node.radius+4
+            d.y = node.y+node.radius+(20*i)
+    for link in links:
+        details = graph.anchored_details(link.uid)
+        if details and link.origin() and link.terminus():
+            c = link.center()
+            for i, d in enumerate(details):
+                d.x = c['x']+10
+                d.y = c['y']+(20*i)
+
+
+def _links_among(graph, nodes):
+    ##
+    # Returns the Link objects whose ends are both in a list of Node objects. Mostly for internal use.
+    uids = set(node.uid for node in nodes)
+    links = {}
+    for node in nodes:
+        for link in node.out_links():
+            if link.terminus_uid in uids:
+                links[link.uid] = link
+    return links.values()
+
+
+def _repulsion(pos, k, processes, pool):
+    ##
+    # Returns the push on every Node, splitting the fine grid cells among worker processes. Mostly for internal use.
+    #
+    # Every other Node pushes a Node exactly once, in one of three ways. Node objects in the 3x3 fine cells around
+    # its own push it exactly. Other fine cells in the 3x3 coarse cells around its own push through their
+    # centroids, and the remaining coarse cells push through theirs. Coarse cells are whole blocks of fine cells,
+    # so the three groups never overlap, and a centroid is always at least its own cell's width away.
+    n = len(pos)
+    lo = pos.min(axis=0)
+    area = np.prod(np.maximum(np.ptp(pos, axis=0), k))
+    # Fine cells hold about 32 Node objects each, and are never narrower than twice the ideal Link length.
+    cell = max(2*k, math.sqrt(area*32/n))
+    cells = np.floor((pos-lo)/cell).astype(np.intp)
+    rows = int(cells[:, 1].max())+3
+    ids = (cells[:, 0]+1)*rows+cells[:, 1]+1
+    order = np.argsort(ids, kind='mergesort')
+    unique, starts, inverse, counts = np.unique(ids[order], return_index=True, return_inverse=True,
+                                                return_counts=True)
+    fine = np.column_stack((unique//rows-1, unique % rows-1))
+    fine_mass = counts.astype(np.float64)
+    fine_centroids = np.column_stack((np.bincount(inverse, pos[order, 0]),
+                                      np.bincount(inverse, pos[order, 1])))/fine_mass[:, None]
+
+    # Coarse cells, about sqrt(n) of them, are square blocks of fine cells.
+    span = max(1, int(round(math.sqrt(area/max(math.sqrt(n), 1))/cell)))
+    coarse_of = fine//span
+    coarse_rows = int(coarse_of[:, 1].max())+3
+    coarse_ids = (coarse_of[:, 0]+1)*coarse_rows+coarse_of[:, 1]+1
+    coarse_unique, coarse_inverse = np.unique(coarse_ids, return_inverse=True)
+    coarse = np.column_stack((coarse_unique//coarse_rows-1, coarse_unique % coarse_rows-1))
+    mass = np.bincount(coarse_inverse, fine_mass)
+    centroids = np.column_stack((np.bincount(coarse_inverse, fine_centroids[:, 0]*fine_mass),
+                                 np.bincount(coarse_inverse, fine_centroids[:, 1]*fine_mass)))/mass[:, None]
+    # The fine cells of each coarse cell, by position in coarse_unique.
+    by_coarse = np.argsort(coarse_inverse, kind='mergesort')
+    coarse_starts = np.searchsorted(coarse_inverse[by_coarse], np.arange(len(coarse_unique)))
+    coarse_counts = np.bincount(coarse_inverse, minlength=len(coarse_unique))
+
+    shared = (pos, k, rows, order, unique, starts, counts, fine, fine_centroids, fine_mass, coarse_rows,
+              coarse_unique, coarse_inverse, coarse, centroids, mass, by_coarse, coarse_starts, coarse_counts)
+    chunks = np.array_split(np.arange(len(unique)), max(processes, 1))
+    jobs = [shared+(chunk,) for chunk in chunks if len(chunk)]
+    if pool:
+        parts = pool.map(_repulse_cells, jobs)
+    else:
+        parts = [_repulse_cells(job) for job in jobs]
+    disp = np.zeros((n, 2))
+    for members, force in parts:
+        disp[members] = force
+    return disp
+
+
+def _repulse_cells(job):
+    ##
+    # Computes the push on the Node objects in a range of fine cells. Runs in a worker process when processes > 1.
+    # Mostly for internal use.
+    (pos, k, rows, order, unique, starts, counts, fine, fine_centroids, fine_mass, coarse_rows, coarse_unique,
+     coarse_inverse, coarse, centroids, mass, by_coarse, coarse_starts, coarse_counts, chunk) = job
+    k2 = k*k
+    lookup = dict((u, i) for i, u in enumerate(unique))
+    coarse_lookup = dict((u, i) for i, u in enumerate(coarse_unique))
+    offsets = [dx*rows+dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+    coarse_offsets = [dx*coarse_rows+dy for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+    all_members = []
+    forces = []
+    for c in chunk:
+        members = order[starts[c]:starts[c]+counts[c]]
+        near = []
+        for offset in offsets:
+            j = lookup.get(unique[c]+offset)
+            if j is not None:
+                near.append(order[starts[j]:starts[j]+counts[j]])
+        near = np.concatenate(near)
+        here = pos[members]
+        force = _push(here, pos[near], np.ones(len(near)), k2, members[:, None] == near[None, :])
+
+        home = coarse_inverse[c]
+        cells = []
+        for offset in coarse_offsets:
+            j = coarse_lookup.get(coarse_unique[home]+offset)
+            if j is not None:
+                cells.append(by_coarse[coarse_starts[j]:coarse_starts[j]+coarse_counts[j]])
+        cells = np.concatenate(cells)
+        cells = cells[np.abs(fine[cells]-fine[c]).max(axis=1) > 1]
+        if len(cells):
+            force += _push(here, fine_centroids[cells], fine_mass[cells], k2, None)
+
+        far = np.abs(coarse-coarse[home]).max(axis=1) > 1
+        if far.any():
+            force += _push(here, centroids[far], mass[far], k2, None)
+        all_members.append(members)
+        forces.append(force)
+    return np.concatenate(all_members), np.concatenate(forces)
+
+
+def _push(here, there, weight, k2, same):
+    ##
+    # Returns the push on each point in here from the weighted points in there. Pairs marked in same are skipped.
+    # Mostly for internal use.
+    d2 = (here**2).sum(axis=1)[:, None]+(there**2).sum(axis=1)[None, :]-2*here.dot(there.T)
+    w = k2*weight[None, :]/np.maximum(d2, 1e-9)
+    if same is not None:
+        w[same] = 0
+    return here*w.sum(axis=1)[:, None]-w.dot(there)
@@ -1,35 +1,451 @@
-__author__ = 'psymphonic'
 #coding=utf-8
+from __future__ import absolute_import
+__author__ = 'psymphonic'
 import urllib
+import codecs
+import functools
+import heapq
+import math
 import simplejson as json
 import uuid
+import zlib
 import requests
-from collections import deque
+import requests.adapters
+import threading
+import time
+from collections import deque, OrderedDict
 ## @package psynth
 #  psynth is the official python package for generating graphs in Psymphonic Psynth
 
-allowed_queries = ['createmap', 'getfilelist', 'renamemap', 'getwholegraph', 'newnode', 'batchnodes',
-                    'delnode', 'newrel', 'batchrels', 'delrel', 'updatenode','updaterel', 'newdetail', 'deldetail',
-                    'updatedetail', 'tag', 'newcomment', 'getcomments','setdrawparams', 'drawgraph', 'nodeplusone',
-                    'interconnections', 'expandselection', 'setgraphname', 'getgraphname', 'sessionquit', 'saveprefs',
-                    'getheat', 'newreltype', 'updatereltype', 'shortestpath', 'chatmessage', 'getchat', 'getqueue',
-                    'getallpos', 'exporttoimage', 'publish']
+allowed_queries = frozenset(['createmap', 'getfilelist', 'renamemap', 'getwholegraph', 'newnode', 'batchnodes',
+                              'delnode', 'newrel', 'batchrels', 'delrel', 'updatenode', 'updaterel', 'newdetail',
+                              'deldetail', 'updatedetail', 'tag', 'newcomment', 'getcomments', 'setdrawparams',
+                              'drawgraph', 'nodeplusone', 'interconnections', 'expandselection', 'setgraphname',
+                              'getgraphname', 'sessionquit', 'saveprefs', 'getheat', 'newreltype', 'updatereltype',
+                              'shortestpath', 'chatmessage', 'getchat', 'getqueue', 'getallpos', 'exporttoimage',
+                              'publish'])
+
+## <i>int</i> :: The longest request URL the client will build for a batch query.
+max_url_length = 8000
+
+## <i>int</i> :: The most objects the client will put into a single batch query.
+max_batch_size = 500
+
+## <i>int</i> :: The smallest POST body, in bytes, that the client compresses with gzip.
+min_gzip_length = 1024
+
+## <i>int</i> :: The number of threads in the Executor shared by create_graph_async, load_graph_async, and the
+# AsyncGraph objects they make. Only read when that Executor is first needed.
+max_async_threads = 16
+# Serializes queries without the whitespace json.dumps adds, so URLs stay short.
+_encode = json.JSONEncoder(separators=(',', ':')).encode
+_node_queries = ['newnode', 'updatenode', 'delnode']
+_rel_queries = ['newrel', 'updaterel', 'delrel']
+_detail_queries = ['newdetail', 'updatedetail', 'deldetail']
+_link_type_queries = ['newreltype', 'updatereltype']
+
+
+def _query_keys(query):
+    ##
+    # Returns the keys of the objects a query writes and reads, so that concurrent queries touching the same
+    # objects can be kept in order. Mostly for internal use.
+    #
+    # @param query: <i>dict</i> :: A query dictionary.
+    # @return keys: <i>tuple</i> :: A (writes, reads) pair of key lists, or None if the query must wait for every
+    # query before it, and every query after it must wait for it.
+    name = query['query']
+    if name in _node_queries:
+        return [urllib.unquote(query['uid'])], []
+    elif name in _rel_queries:
+        return [urllib.unquote(query['uid'])], _rel_reads(query)
+    elif name in _detail_queries:
+        reads = []
+        if query.get('anchor_uid'):
+            reads.append(urllib.unquote(query['anchor_uid']))
+        return [urllib.unquote(query['uid'])], reads
+    elif name in _link_type_queries:
+        return ['type:'+urllib.unquote(query['NAME'])], []
+    elif name == 'batchnodes':
+        return [urllib.unquote(n['uid']) for n in query['nodes']], []
+    elif name == 'batchrels':
+        writes = []
+        reads = []
+        for r in query['rels']:
+            writes.append(urllib.unquote(r['uid']))
+            reads.extend(_rel_reads(r))
+        return writes, reads
+    return None
+
+
+def _rel_reads(rel):
+    reads = []
+    for k in ('o_uid', 't_uid'):
+        if rel.get(k):
+            reads.append(urllib.unquote(rel[k]))
+    if rel.get('rel_type'):
+        reads.append('type:'+urllib.unquote(rel['rel_type']))
+    return reads
+
+
+def _intern(s):
+    ##
+    # Returns a shared copy of a string that repeats across many objects, such as a color or a LinkType name,
+    # so each distinct value is only stored once. Uses the interpreter's own intern table, which lets go of a value
+    # once nothing refers to it. unicode values are returned as they are; simplejson already decodes ASCII strings
+    # to str. Mostly for internal use.
+    #
+    # @param s: <i>str</i> ::
+    # @return s: <i>str</i> ::
+    if type(s) is str:
+        return intern(s)
+    return s
+
+
+##
+# A pending query in a Graph's concurrent queue. Mostly for internal use.
+#
+class _Task(object):
+    __slots__ = ('query', 'callback', 'keys', 'waiting', 'dependents', 'future')
+
+    def __init__(self, query, callback):
+        self.query = query
+        self.callback = callback
+        self.keys = _query_keys(query)
+        self.waiting = 0
+        self.dependents = []
+        self.future = Future()
+
+##
+# A Future holds the eventual response to a query that is sent by a worker thread.
+#
+class Future(object):
+    def __init__(self):
+        ##
+        # Constructs a Future object. Futures are made by Graph.queue when the Graph has workers.
+        #
+        # @code
+        # g.workers = 4
+        # f = g.queue({'query': 'getgraphname'}, None)
+        # print f.result()
+        # @endcode
+        self.__cond = threading.Condition()
+        self.__done = False
+        self.__result = None
+        self.__error = None
+        self.__callbacks = []
+
+    def add_done_callback(self, fn):
+        ##
+        # Performs a function on this Future once it is done. Performed immediately if it is already done.
+        #
+        # @param fn: <i>function</i> :: A function that takes this Future.
+        #
+        # @code
+        # f.add_done_callback(lambda f: log(f.result()))
+        # @endcode
+        with self.__cond:
+            if not self.__done:
+                self.__callbacks.append(fn)
+                return
+        fn(self)
+
+    def done(self):
+        ##
+        # Returns whether or not this Future has a result or an error.
+        #
+        # @return done: <i>bool</i> ::
+        return self.__done
+
+    def exception(self, timeout=None):
+        ##
+        # Waits for this Future and returns its error, or None if it succeeded.
+        #
+        # @param timeout: <i>float</i> :: The number of seconds to wait. Waits forever if omitted.
+        # @return error: <i>Exception</i> ::
+        self.__wait(timeout)
+        return self.__error
+
+    def result(self, timeout=None):
+        ##
+        # Waits for this Future and returns its result, raising its error if it failed.
+        #
+        # @param timeout: <i>float</i> :: The number of seconds to wait. Waits forever if omitted.
+        # @return result: ::
+        #
+        # @code
+        # g.add_node(n).result()
+        # @endcode
+        self.__wait(timeout)
+        if self.__error:
+            raise self.__error
+        return self.__result
+
+    def set_exception(self, error):
+        ##
+        # Marks this Future as failed. Mostly used internally.
+        #
+        # @param error: <i>Exception</i> ::
+        self.__resolve(None, error)
+
+    def set_result(self, result):
+        ##
+        # Marks this Future as done with a result. Mostly used internally.
+        #
+        # @param result: ::
+        self.__resolve(result, None)
+
+    def __resolve(self, result, error):
+        with self.__cond:
+            if self.__done:
+                return
+            self.__result = result
+            self.__error = error
+            self.__done = True
+            callbacks = self.__callbacks
+            self.__callbacks = []
+            self.__cond.notify_all()
+        for fn in callbacks:
+            fn(self)
+
+    def __wait(self, timeout):
+        with self.__cond:
+            if not self.__done:
+                self.__cond.wait(timeout)
+            if not self.__done:
+                raise RuntimeError('Future did not finish within '+str(timeout)+' seconds.')
+
+
+def gather(futures):
+    ##
+    # Combines several Future objects into one that resolves to the list of their results,
+    # or fails with the first error among them.
+    #
+    # @param futures: <i>list</i> :: A list of Future objects.
+    # @return future: <i>Future</i> ::
+    #
+    # @code
+    # print gather([g.add_node(n1), g.add_node(n2)]).result()
+    # @endcode
+    futures = list(futures)
+    combined = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def done(f):
+        with lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if f.exception():
+            combined.set_exception(f.exception())
+        elif last:
+            combined.set_result([x.result() for x in futures])
+    if not futures:
+        combined.set_result([])
+    for f in futures:
+        f.add_done_callback(done)
+    return combined
+
+
+##
+# An Executor is a fixed-size pool of threads that performs functions and returns Future objects for their results.
+# Sharing one Executor between many AsyncGraph objects bounds the number of threads in the process, however many
+# Graphs are open.
+#
+class Executor(object):
+    def __init__(self, threads=8):
+        ##
+        # Constructs an Executor object. Threads are started as work arrives, up to the limit.
+        #
+        # @param threads: <i>int</i> :: The most threads to run at once.
+        #
+        # @code
+        # ex = Executor(threads=32)
+        # t = Transport(pool_size=32)
+        # futures = [load_graph_async(f, url, username, key, transport=t, executor=ex) for f in filenames]
+        # @endcode
+
+        ## <i>int</i> :: The most threads to run at once.
+        self.threads = max(1, threads)
+        self.__cond = threading.Condition()
+        self.__jobs = deque()
+        self.__threads = []
+        self.__idle = 0
+        self.__closed = False
+
+    def submit(self, fn, *args, **kwargs):
+        ##
+        # Performs a function on one of the Executor's threads.
+        #
+        # @param fn: <i>function</i> :: The function to perform, followed by its arguments.
+        # @return future: <i>Future</i> :: A Future for the function's result.
+        #
+        # @code
+        # f = ex.submit(load_graph, 'myfile.gt', url, username, key)
+        # @endcode
+        future = Future()
+        with self.__cond:
+            if self.__closed:
+                raise RuntimeError('Executor.submit called on a shut down Executor.')
+            self.__jobs.append((future, fn, args, kwargs))
+            if self.__idle:
+                self.__idle -= 1
+                self.__cond.notify()
+            elif len(self.__threads) < self.threads:
+                t = threading.Thread(target=self.__run)
+                t.daemon = True
+                t.start()
+                self.__threads.append(t)
+        return future
+
+    def shutdown(self, wait=True):
+        ##
+        # Stops the Executor's threads once every submitted function has been performed.
+        #
+        # @param wait: <i>bool</i> :: Whether or not to wait for the threads to stop.
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+            threads = self.__threads
+            self.__threads = []
+        if wait:
+            for t in threads:
+                if t is not threading.current_thread():
+                    t.join()
+
+    def __run(self):
+        while True:
+            with self.__cond:
+                while not self.__jobs and not self.__closed:
+                    self.__idle += 1
+                    self.__cond.wait()
+                if not self.__jobs:
+                    return
+                future, fn, args, kwargs = self.__jobs.popleft()
+            try:
+                future.set_result(fn(*args, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def default_executor():
+    ##
+    # Returns the Executor shared by create_graph_async, load_graph_async, and their AsyncGraph objects. It has
+    # max_async_threads threads.
+    #
+    # @return executor: <i>Executor</i> ::
+    with _shared_lock:
+        if 'executor' not in _shared:
+            _shared['executor'] = Executor(max_async_threads)
+        return _shared['executor']
+
+
+def default_transport():
+    ##
+    # Returns the Transport shared by create_graph_async, load_graph_async, and their AsyncGraph objects. It keeps
+    # as many connections open as the shared Executor has threads.
+    #
+    # @return transport: <i>Transport</i> ::
+    with _shared_lock:
+        if 'transport' not in _shared:
+            _shared['transport'] = Transport(pool_size=max_async_threads)
+        return _shared['transport']
+
+##
+# A Transport is a pool of persistent HTTP connections to a Psynth server.
+# Every Graph sends its queries through a Transport, and one Transport can be shared by several Graph objects
+# that point at the same server.
+#
+class Transport:
+    def __init__(self, pool_size=10, keep_alive=True, timeout=60, verify=False):
+        ##
+        # Constructs a Transport object.
+        #
+        # @param pool_size: <i>int</i> :: The number of connections to keep open per host.
+        # @param keep_alive: <i>bool</i> :: Whether or not connections should be reused between queries.
+        # @param timeout: <i>float</i> :: The number of seconds to wait for the server before giving up on a query.
+        # @param verify: <i>bool</i> :: Whether or not to verify the server's SSL certificate.
+        #
+        # @code
+        # t = Transport(pool_size=4, timeout=10)
+        # g1 = load_graph('first.gt', url, username, key, transport=t)
+        # g2 = load_graph('second.gt', url, username, key, transport=t)
+        # @endcode
+
+        ## <i>int</i> :: The number of connections to keep open per host.
+        self.pool_size = pool_size
+
+        ## <i>bool</i> :: Whether or not connections are reused between queries.
+        self.keep_alive = keep_alive
+
+        ## <i>float</i> :: The number of seconds to wait for the server before giving up on a query.
+        self.timeout = timeout
+
+        ## <i>bool</i> :: Whether or not to verify the server's SSL certificate.
+        self.verify = verify
+
+        self.__session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.__session.mount('http://', adapter)
+        self.__session.mount('https://', adapter)
+        if not keep_alive:
+            self.__session.headers['Connection'] = 'close'
+
+    def get(self, url, stream=False, headers=None):
+        ##
+        # Sends a GET request over a pooled connection.
+        #
+        # @param url: <i>str</i> :: The URL to request.
+        # @param stream: <i>bool</i> :: Whether or not to leave the response body unread until it is iterated.
+        # @param headers: <i>dict</i> :: Optional extra request headers, e.g. If-None-Match.
+        # @return response: <i>requests.Response</i> ::
+        #
+        # @code
+        # c = g.transport.get(g.prep({'query': 'getfilelist'}))
+        # @endcode
+        return self.__session.get(url, timeout=self.timeout, verify=self.verify, stream=stream, headers=headers)
+
+    def post(self, url, body, stream=False, headers=None, compress=True):
+        ##
+        # Sends a POST request with a JSON body over a pooled connection. Bodies of min_gzip_length bytes or more
+        # are compressed with gzip unless compress is False.
+        #
+        # @param url: <i>str</i> :: The URL to request.
+        # @param body: <i>str</i> :: The JSON body.
+        # @param stream: <i>bool</i> :: Whether or not to leave the response body unread until it is iterated.
+        # @param headers: <i>dict</i> :: Optional extra request headers, e.g. If-None-Match.
+        # @param compress: <i>bool</i> :: Whether or not large bodies may be compressed.
+        # @return response: <i>requests.Response</i> ::
+        #
+        # @code
+        # c = t.post('https://psynth.psymphonic.com/api/', '{"query":"getfilelist","user":"me","key":"k"}')
+        # @endcode
+        headers = dict(headers or (), **{'Content-Type': 'application/json'})
+        if compress and len(body) >= min_gzip_length:
+            gz = zlib.compressobj(6, zlib.DEFLATED, 31)
+            body = gz.compress(body)+gz.flush()
+            headers['Content-Encoding'] = 'gzip'
+        return self.__session.post(url, data=body, headers=headers, timeout=self.timeout, verify=self.verify,
+                                   stream=stream)
+
+    def close(self):
+        ##
+        # Closes every pooled connection.
+        #
+        # @code
+        # t.close()
+        # @endcode
+        self.__session.close()
+
 ##
 # The Graph is a structured collection of Node, Link, LinkType, and Detail objects.
 # Most actions are performed through the Graph class.
 #
 class Graph:
-    __nodes = []
-    __node_index = {}
-    __links = []
-    __link_index = {}
-    __details = []
-    __details_index = {}
-    __link_types = {}
-    __queries = deque()
-    __transit = False
-
-    def __init__(self, name, filename, url, username, key):
+    def __init__(self, name, filename, url, username, key, transport=None, mode='url', telemetry=None):
         ##
         # This is the constructor for the Graph class. It should not be accessed directly,
         # but instead through the create_graph and load_graph functions.
@@ -38,6 +454,9 @@ class Graph:
         # @param url: <i>str</i> :: The base URL of your Psynth server. e.g. https://psynth.psymphonic.com/
         # @param username: <i>str</i> :: Your Psynth username
         # @param key: <i>str</i> :: Your Psynth API key.
+        # @param transport: <i>Transport</i> :: The connection pool to send queries through. A new one is made if omitted.
+        # @param mode: <i>str</i> :: How queries are sent: 'url', 'post', or 'auto'. See Graph.mode.
+        # @param telemetry: <i>Telemetry</i> :: An optional psynth.telemetry.Telemetry to record queries with.
         #
         # @code
         # g = load_graph(
@@ -72,20 +491,283 @@ class Graph:
         ## <i>str</i> :: Your Psynth API Key.
         self.key = key
 
-    def __transmit(self):
-        if len(self.__queries) > 0:
-            q = self.__queries.popleft()
-            c = requests.get(self.prep(q['query']), verify=False)
-            if c.status_code == 200:
-                cr = c.json()
-                if q['callback']:
-                    q['callback'](cr)
-            elif c.status_code == 406:
-                raise SyntaxError(str(q['query'])+"    "+c.json())
+        self.__nodes = None
+        self.__node_index = OrderedDict()
+        self.__links = None
+        self.__link_index = OrderedDict()
+        self.__details = None
+        self.__details_index = OrderedDict()
+        self.__link_types = {}
+        self.__out_index = {}
+        self.__in_index = {}
+        self.__type_index = {}
+        self.__pair_index = {}
+        self.__anchor_index = {}
+        self.__bounds = None
+        self.__grid = None
+        self.__grid_cell = None
+        self.__max_radius = 0
+        self.__unplaced = OrderedDict()
+        self.__queries = deque()
+        self.__transit = False
+
+        self.__owns_transport = not transport
+        if not transport:
+            transport = Transport()
+        ## <i>Transport</i> :: The connection pool this Graph sends its queries through.
+        self.transport = transport
+
+        ## <i>str</i> :: How queries are sent. 'url' encodes each query into the URL of a GET request, which every
+        # server accepts but which limits its length. 'post' sends each query as the JSON body of a POST request,
+        # compressed when large, so batches are limited only by max_batch_size. 'auto' tries POST and falls back
+        # to 'url' for good if the server refuses it, and likewise sends plain bodies if it refuses compressed ones.
+        self.mode = mode
+        self.__post_ok = None
+        self.__gzip_ok = None
+
+        ## <i>Telemetry</i> :: Records the cost of every query this Graph sends, or None to record nothing.
+        # See psynth.telemetry.
+        self.telemetry = telemetry
+
+        ## <i>float</i> :: The width of a cell in the spatial index used by nodes_in_box, nearest, and find_free_position.
+        self.grid_size = 100.0
+
+        ## <i>int</i> :: The most queries allowed to wait in the queue. 0 for no limit.
+        self.max_queue = 10000
+
+        ## <i>int</i> :: The number of worker threads sending queries at once. 0 to send queries from the calling thread.
+        # Queries that touch the same objects still run in order, e.g. a 'newrel' waits for the 'newnode' of both ends.
+        self.workers = 0
+
+        ## <i>bool</i> :: Whether update() on a Node, Link, LinkType, or Detail waits for flush() instead of queueing
+        # its query at once. Repeated updates of the same object are then sent as one query.
+        self.defer_updates = False
+
+        ## <i>bool</i> :: Whether update queries carry only the fields changed since the last update, plus the uid.
+        # Requires a server that accepts partial updates.
+        self.partial_updates = False
+        self.__deferred = OrderedDict()
+        self.__prefix = None
+        self.__prefix_tag = None
+        self.__etag = None
+        self.__cache = None
+        self.__version = 0
+
+        self.__enqueued = 0
+        self.__sent = 0
+        self.__peak = 0
+
+        self.__cond = threading.Condition()
+        self.__callback_lock = threading.RLock()
+        self.__threads = []
+        self.__pending = set()
+        self.__ready = deque()
+        self.__writers = {}
+        self.__readers = {}
+        self.__barrier = None
+        self.__errors = []
+        self.__closed = False
+        self.__concurrent = False
+        self.__draining = 0
+        self.__local = threading.local()
+
+        ## <i>Executor</i> :: The Executor whose threads send this Graph's queries when it has workers, or None to
+        # start workers threads of its own. Many Graph objects can share one Executor.
+        self.executor = None
+
+    def __request(self, query):
+        ##
+        # Sends a single query and returns the decoded response. Mostly for internal use.
+        #
+        # @param query: <i>dict</i> :: A query dictionary.
+        # @return response: <i>dict</i> :: The server's response.
+        c = self._fetch(query)
+        if c.status_code == 200:
+            return c.json()
+        elif c.status_code == 406:
+            raise SyntaxError(str(query)+"    "+c.json())
+        else:
+            raise SyntaxError(str(query)+"    "+str(c.status_code))
+
+    def __send(self, q):
+        ##
+        # Sends a single queued query and hands the response to its callback. Mostly for internal use.
+        #
+        # @param q: <i>dict</i> :: A queue entry with 'query' and 'callback' fields.
+        cr = self.__request(q['query'])
+        self.__sent += 1
+        if q['callback']:
+            q['callback'](cr)
+
+    def __submit(self, query, callback):
+        ##
+        # Adds a query to the concurrent queue, after every pending query that touches the same objects.
+        # Mostly for internal use.
+        #
+        # @param query: <i>dict</i> :: A query dictionary.
+        # @param callback: <i>function</i> :: A function that should be performed on the response from the query.
+        task = _Task(query, callback)
+        with self.__cond:
+            if not self.__concurrent:
+                self.__concurrent = True
+                if self.executor is None:
+                    for i in range(0, self.workers):
+                        t = threading.Thread(target=self.__work)
+                        t.daemon = True
+                        t.start()
+                        self.__threads.append(t)
+            # Queries enqueued by callbacks must not wait for room, or the worker would wait on itself.
+            if not getattr(self.__local, 'working', False):
+                while self.max_queue and len(self.__pending) >= self.max_queue:
+                    self.__cond.wait()
+            deps = set()
+            if self.__barrier:
+                deps.add(self.__barrier)
+            if task.keys is None:
+                deps.update(self.__pending)
+                self.__barrier = task
             else:
-                raise SyntaxError(str(q['query'])+"    "+str(c.status_code))
-            self.__transmit()
+                writes, reads = task.keys
+                for k in writes:
+                    if k in self.__writers:
+                        deps.add(self.__writers[k])
+                    deps.update(self.__readers.get(k, ()))
+                for k in reads:
+                    if k in self.__writers:
+                        deps.add(self.__writers[k])
+                for k in writes:
+                    self.__writers[k] = task
+                    self.__readers.pop(k, None)
+                for k in reads:
+                    self.__readers.setdefault(k, set()).add(task)
+            deps.discard(task)
+            task.waiting = len(deps)
+            for d in deps:
+                d.dependents.append(task)
+            self.__pending.add(task)
+            self.__enqueued += 1
+            if len(self.__pending) > self.__peak:
+                self.__peak = len(self.__pending)
+            if self.telemetry is not None:
+                self.telemetry.sample(len(self.__pending))
+            if not task.waiting:
+                self.__ready.append(task)
+                self.__cond.notify_all()
+                self.__schedule()
+        return task.future
+
+    def __schedule(self):
+        ##
+        # Starts enough drains on the Executor for the ready queries, up to workers at once. Must be called while
+        # holding the queue's condition. Mostly for internal use.
+        if self.executor is None:
+            return
+        while self.__draining < self.workers and self.__draining < len(self.__ready):
+            self.__draining += 1
+            self.executor.submit(self.__drain)
+
+    def __complete(self, task, error=None):
+        ##
+        # Removes a finished query from the concurrent queue and releases the queries that were waiting on it.
+        # If the query failed, every query waiting on it, directly or not, is dropped instead of sent.
+        # Must be called while holding the queue's condition. Mostly for internal use.
+        #
+        # @param task: <i>_Task</i> :: The finished query.
+        # @param error: <i>Exception</i> :: The exception the query failed with, or None if it succeeded.
+        # @return dropped: <i>list</i> :: The queries dropped because they depended on a failed one.
+        dropped = []
+        stack = [task]
+        while stack:
+            t = stack.pop()
+            self.__pending.discard(t)
+            if self.__barrier is t:
+                self.__barrier = None
+            if t.keys:
+                writes, reads = t.keys
+                for k in writes:
+                    if self.__writers.get(k) is t:
+                        del self.__writers[k]
+                for k in reads:
+                    readers = self.__readers.get(k)
+                    if readers:
+                        readers.discard(t)
+                        if not readers:
+                            del self.__readers[k]
+            for d in t.dependents:
+                if d not in self.__pending:
+                    # Already dropped through another failed query.
+                    continue
+                if error is None:
+                    d.waiting -= 1
+                    if not d.waiting:
+                        self.__ready.append(d)
+                else:
+                    self.__pending.discard(d)
+                    dropped.append(d)
+                    stack.append(d)
+            t.dependents = []
+        self.__sent += 1
+        self.__cond.notify_all()
+        self.__schedule()
+        return dropped
+
+    def __work(self):
+        ##
+        # The loop run by each worker thread of the concurrent queue. Callbacks are performed one at a time.
+        self.__local.working = True
+        while True:
+            with self.__cond:
+                while not self.__ready and not self.__closed:
+                    self.__cond.wait()
+                if not self.__ready:
+                    return
+                task = self.__ready.popleft()
+            self.__perform(task)
+
+    def __drain(self):
+        ##
+        # Sends ready queries on an Executor thread until none are left, then gives the thread back.
+        self.__local.working = True
+        try:
+            while True:
+                with self.__cond:
+                    if not self.__ready:
+                        self.__draining -= 1
+                        return
+                    task = self.__ready.popleft()
+                self.__perform(task)
+        finally:
+            self.__local.working = False
+
+    def __perform(self, task):
+        ##
+        # Sends one query of the concurrent queue and performs its callback. Mostly for internal use.
+        try:
+            cr = self.__request(task.query)
+            if task.callback:
+                with self.__callback_lock:
+                    task.callback(cr)
+        except Exception as e:
+            with self.__cond:
+                self.__errors.append(e)
+                dropped = self.__complete(task, e)
+            task.future.set_exception(e)
+            for d in dropped:
+                d.future.set_exception(e)
         else:
+            with self.__cond:
+                self.__complete(task)
+            task.future.set_result(cr)
+
+    def __transmit(self):
+        ##
+        # Drains the query queue in order. Queries enqueued by callbacks are picked up by the same loop,
+        # so the call stack stays flat no matter how many queries are pending.
+        self.__transit = True
+        try:
+            while self.__queries:
+                self.__send(self.__queries.popleft())
+        finally:
             self.__transit = False
 
     def queue(self, query, callback):
@@ -93,19 +775,183 @@ class Graph:
         # All queries should be processed through this function to ensure that they process in order.
         # Mostly used internally.
         #
+        # If the queue already holds max_queue queries, the oldest ones are sent before this one is accepted.
+        # With workers, queue() returns immediately and the caller waits only for room in the queue.
+        #
         # @param query: <i>dict</i> :: A dictionary object that contains query parameters.
         # @param callback: <i>function</i> :: A function that should be performed on the response from the query.
+        # @return future: <i>Future</i> :: A Future for the response when the Graph has workers, otherwise None.
         #
         # @code
         # def point_handler(r):
         #     print r
         # g.queue({'query': 'drawgraph'}, point_handler)
         # @endcode
+        if self.__closed:
+            raise RuntimeError('Graph.queue called on a closed Graph.')
+        if self.workers or self.__concurrent:
+            return self.__submit(query, callback)
+        while self.max_queue and len(self.__queries) >= self.max_queue:
+            self.__send(self.__queries.popleft())
         self.__queries.append({'query': query, 'callback': callback})
+        self.__enqueued += 1
+        if len(self.__queries) > self.__peak:
+            self.__peak = len(self.__queries)
+        if self.telemetry is not None:
+            self.telemetry.sample(len(self.__queries))
         if not self.__transit:
-            self.__transit = True
             self.__transmit()
 
+    def close(self, wait=True):
+        ##
+        # Sends any pending queries, stops the worker threads, closes the Transport if this Graph made it,
+        # and releases every Node, Link, Detail, and LinkType held by this Graph.
+        # A Graph can also be used as a context manager, which closes it on exit.
+        #
+        # @param wait: <i>bool</i> :: Whether or not to send pending queries first. Unsent queries are dropped if False.
+        #
+        # @code
+        # with load_graph('myfile.gt', url, username, key) as g:
+        #     print len(g.node_list())
+        # @endcode
+        try:
+            if wait:
+                self.flush()
+                self.join()
+        finally:
+            with self.__cond:
+                self.__closed = True
+                self.__ready.clear()
+                self.__cond.notify_all()
+            for t in self.__threads:
+                if t is not threading.current_thread():
+                    t.join()
+            self.__threads = []
+            self.__pending.clear()
+            self.__writers.clear()
+            self.__readers.clear()
+            self.__barrier = None
+            self.__queries.clear()
+            self.__deferred.clear()
+            for index in (self.__node_index, self.__link_index, self.__details_index, self.__link_types):
+                for obj in index.itervalues():
+                    obj.graph = None
+            self.__nodes = None
+            self.__node_index.clear()
+            self.__links = None
+            self.__link_index.clear()
+            self.__out_index.clear()
+            self.__in_index.clear()
+            self.__type_index.clear()
+            self.__pair_index.clear()
+            self.__details = None
+            self.__details_index.clear()
+            self.__anchor_index.clear()
+            self.__unplaced.clear()
+            self.__bounds = None
+            self.__grid = None
+            self.__link_types.clear()
+            self.__version += 1
+            if self.__owns_transport:
+                self.transport.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(wait=exc_type is None)
+        return False
+
+    def flush(self):
+        ##
+        # Queues one update for every object updated while defer_updates was set, then sends every pending query.
+        # Also useful after a failed query has left the rest of the queue waiting.
+        # With workers, this waits like join().
+        #
+        # @code
+        # g.defer_updates = True
+        # for n in g.node_list():
+        #     n.radius += 5
+        #     n.update()
+        #     n.color = '#FF0000'
+        #     n.update()
+        # g.flush()
+        # @endcode
+        with self.__callback_lock:
+            deferred = self.__deferred.values()
+            self.__deferred.clear()
+        for obj, query, callbacks in deferred:
+            self.__send_update(obj, query, callbacks)
+        if self.__concurrent:
+            self.join()
+        elif not self.__transit:
+            self.__transmit()
+
+    def join(self):
+        ##
+        # Blocks until every pending query has been sent and its callback performed.
+        # With workers, the first error raised by a query or callback since the last join() is raised here.
+        # Must not be called from within a callback.
+        #
+        # @code
+        # g.workers = 8
+        # g.add_nodes(ns)
+        # g.join()
+        # @endcode
+        if self.__concurrent:
+            with self.__cond:
+                while self.__pending:
+                    self.__cond.wait()
+                errors = self.__errors
+                self.__errors = []
+            if errors:
+                raise errors[0]
+        else:
+            self.flush()
+
+    def queue_depth(self):
+        ##
+        # Returns the number of queries waiting to be sent.
+        #
+        # @return depth: <i>int</i> ::
+        #
+        # @code
+        # print g.queue_depth()
+        # @endcode
+        if self.__concurrent:
+            return len(self.__pending)
+        return len(self.__queries)
+
+    def queue_stats(self):
+        ##
+        # Returns counters describing the query queue.
+        #
+        # @return stats: <i>dict</i> :: 'depth', 'peak', 'enqueued' and 'sent' query counts.
+        #
+        # @code
+        # print g.queue_stats()['peak']
+        # @endcode
+        return {'depth': self.queue_depth(),
+                'peak': self.__peak,
+                'enqueued': self.__enqueued,
+                'sent': self.__sent}
+
+    def telemetry_report(self):
+        ##
+        # Returns a table of the count, errors, latency, and bytes of every type of query sent so far, and of the
+        # queue depth, as recorded by Graph.telemetry. Returns None if the Graph has no telemetry.
+        #
+        # @return report: <i>str</i> ::
+        #
+        # @code
+        # g.telemetry = Telemetry()
+        # g.add_nodes(nodes)
+        # print g.telemetry_report()
+        # @endcode
+        if self.telemetry is None:
+            return None
+        return self.telemetry.report()
+
     def __id_tag(self, obj):
         ##
         # This attaches the 'username', 'key', and 'filename' fields to the query dictionary.
@@ -120,23 +966,311 @@ class Graph:
             obj['filename'] = self.filename
         return obj
 
+    def _fetch(self, query, stream=False, headers=None):
+        ##
+        # Sends a query over the Transport as Graph.mode requires, and returns the raw response.
+        # Mostly for internal use.
+        #
+        # @param query: <i>dict</i> :: A query dictionary.
+        # @param stream: <i>bool</i> :: Whether or not to leave the response body unread until it is iterated.
+        # @param headers: <i>dict</i> :: Optional extra request headers.
+        # @return response: <i>requests.Response</i> ::
+        telemetry = self.telemetry
+        if telemetry is None:
+            return self.__exchange(query, stream, headers)
+        start = time.time()
+        try:
+            c = self.__exchange(query, stream, headers)
+        except Exception as e:
+            telemetry.record(query['query'], time.time()-start, 0, None, error=e.__class__.__name__)
+            raise
+        seconds = time.time()-start
+        sent = len(c.request.url)+len(c.request.body or '')
+        if stream:
+            received = c.headers.get('Content-Length')
+            received = int(received) if received else None
+        else:
+            received = len(c.content)
+        telemetry.record(query['query'], seconds, sent, received, status=c.status_code)
+        return c
+
+    def __exchange(self, query, stream, headers):
+        ##
+        # Sends a query as _fetch does, without recording it. Mostly for internal use.
+        if self.mode == 'url' or (self.mode == 'auto' and self.__post_ok is False):
+            return self.transport.get(self.prep(query), stream=stream, headers=headers)
+        body = self.__encode(query)
+        compressed = len(body) >= min_gzip_length and self.__gzip_ok is not False
+        c = self.transport.post(self.url+'api/', body, stream=stream, headers=headers, compress=compressed)
+        if self.mode == 'auto':
+            if compressed and self.__gzip_ok is None:
+                if c.status_code in (400, 406, 415):
+                    # If the same body is accepted uncompressed, the server does not read gzip.
+                    c.close()
+                    plain = self.transport.post(self.url+'api/', body, stream=stream, headers=headers,
+                                                compress=False)
+                    if plain.status_code != c.status_code:
+                        self.__gzip_ok = False
+                    c = plain
+                elif c.status_code < 400:
+                    self.__gzip_ok = True
+            if self.__post_ok is None:
+                if c.status_code in (404, 405, 411, 415, 501):
+                    # The server only understands queries in the URL.
+                    c.close()
+                    self.__post_ok = False
+                    return self.transport.get(self.prep(query), stream=stream, headers=headers)
+                self.__post_ok = True
+        return c
+
+    def _posting(self):
+        ##
+        # Returns whether queries are known to go out as POST bodies, so batches need not fit in a URL.
+        # Mostly for internal use.
+        return self.mode == 'post' or (self.mode == 'auto' and self.__post_ok is True)
+
     def prep(self, query):
         ##
-        # Turns a query dictionary into a valid URL. Mostly used internally.
+        # Turns a query dictionary into a valid URL. Mostly used internally. The query is not modified.
         #
         # @param query: <i>dict</i> :: A query dictionary.
         # @return url: <i>str</i> :: A valid URL
         #
         # @code
-        # c = requests.get(g.prep(query))
+        # c = g.transport.get(g.prep(query))
         # print c.json()
         # @endcode
-        query = self.__id_tag(query)
+        return self.url+'api/'+self.__encode(query)
+
+    def __encode(self, query):
+        ##
+        # Returns the JSON for a query with the credentials attached. The query is not modified.
+        # Mostly for internal use.
         if query['query'] not in allowed_queries:
             raise ValueError("'query' field contained an invalid value.")
+        if 'user' in query or 'key' in query or 'filename' in query:
+            return _encode(self.__id_tag(dict(query)))
+        # The credentials are encoded once, and the query is spliced in after them.
+        tag = (self.username, self.key, self.filename)
+        if self.__prefix_tag != tag:
+            self.__prefix = '{'+_encode(self.__id_tag({}))[1:-1]
+            self.__prefix_tag = tag
+        return self.__prefix+','+_encode(query)[1:]
+
+    def _update(self, obj, query, callback):
+        ##
+        # Queues an update query for a Node, Link, LinkType, or Detail, or with defer_updates holds it for flush().
+        # Called by their update() methods. Mostly for internal use.
+        #
+        # @param obj: <i>Node|Link|LinkType|Detail</i> :: The object to update.
+        # @param query: <i>str</i> :: The update query, e.g. 'updatenode'.
+        # @param callback: <i>function</i> :: An optional function to handle the server's response to the query.
+        # @return future: <i>Future</i> :: A Future for the response when the Graph has workers, otherwise None.
+        if self.defer_updates:
+            with self.__callback_lock:
+                entry = self.__deferred.get(id(obj))
+                if entry is None:
+                    entry = self.__deferred[id(obj)] = (obj, query, [])
+                if callback:
+                    entry[2].append(callback)
+            return None
+        return self.__send_update(obj, query, [callback] if callback else [])
+
+    def __send_update(self, obj, query, callbacks):
+        ##
+        # Queues one update query for an object, and calls every callback with its response. Mostly for internal use.
+        q = obj.dictionary()
+        if self.partial_updates and obj.dirty is not None:
+            keep = set(obj._fields[name] for name in obj.dirty)
+            keep.add(obj._key)
+            q = dict((k, v) for k, v in q.iteritems() if k in keep)
+        q['query'] = query
+        obj.dirty = None
+        callback = None
+        if len(callbacks) == 1:
+            callback = callbacks[0]
+        elif callbacks:
+            def callback(r):
+                for c in callbacks:
+                    c(r)
+        return self.queue(q, callback)
+
+    def __unindex(self, index, key, obj):
+        ##
+        # Removes an object from a key's list or set in one of the Graph's indexes. Mostly for internal use.
+        #
+        # @param index: <i>dict</i> :: The index to update.
+        # @param key: <i>str</i> :: The key the object is listed under.
+        # @param obj: :: The object to remove.
+        objs = index.get(key)
+        if objs:
+            if isinstance(objs, dict):
+                objs.pop(obj.uid, None)
+            else:
+                objs.remove(obj)
+            if not objs:
+                del index[key]
+
+    def _reanchor(self, detail, old):
+        ##
+        # Moves a Detail within the anchor index after its anchor_uid has changed.
+        # Called by Detail objects. Mostly for internal use.
+        #
+        # @param detail: <i>Detail</i> :: The Detail that changed.
+        # @param old: <i>str</i> :: The previous anchor_uid.
+        if detail.uid not in self.__details_index:
+            return
+        self.__unindex(self.__anchor_index, old, detail)
+        if detail.anchor_uid:
+            self.__anchor_index.setdefault(detail.anchor_uid, []).append(detail)
+
+    def _move_node(self, node, attr, old):
+        ##
+        # Updates the bounding box and spatial index after a Node's x or y has changed.
+        # Called by Node objects. Mostly for internal use.
+        #
+        # @param node: <i>Node</i> :: The Node that moved.
+        # @param attr: <i>str</i> :: 'x' or 'y'.
+        # @param old: <i>float</i> :: The previous value of the attribute.
+        if self.__node_index.get(node.uid) is not node:
+            return
+        grid = self.__grid
+        if grid is not None:
+            if attr == 'x':
+                old_cell = self.__cell(old, node.y)
+            else:
+                old_cell = self.__cell(node.x, old)
+            new_cell = self.__cell(node.x, node.y)
+            if old_cell != new_cell:
+                self.__unindex(grid, old_cell, node)
+                grid.setdefault(new_cell, set()).add(node)
+        b = self.__bounds
+        if b:
+            if attr == 'x':
+                i = 0
+            else:
+                i = 2
+            new = getattr(node, attr)
+            if (old == b[i] and new > old) or (old == b[i+1] and new < old):
+                # The Node was on the edge and moved inward, so the new edge is unknown until the next scan.
+                self.__bounds = None
+            else:
+                b[i] = min(b[i], new)
+                b[i+1] = max(b[i+1], new)
+
+    def _resize_node(self, node):
+        ##
+        # Records a Node's new radius for find_free_position. Called by Node objects. Mostly for internal use.
+        #
+        # @param node: <i>Node</i> :: The Node that changed.
+        self.__max_radius = max(self.__max_radius, node.radius)
+
+    def __cell(self, x, y):
+        ##
+        # Returns the spatial index cell that contains a point. Mostly for internal use.
+        s = self.__grid_cell
+        return int(math.floor(x/s)), int(math.floor(y/s))
+
+    def __spatial_grid(self):
+        ##
+        # Returns the spatial index, building it on first use or after grid_size has changed.
+        # Once built it is kept up to date as Node objects are added, moved, and removed. Mostly for internal use.
+        #
+        # @return grid: <i>dict</i> :: A dictionary of sets of Node objects keyed by (column, row) cell.
+        if self.__grid is None or self.__grid_cell != self.grid_size:
+            self.__grid_cell = float(self.grid_size)
+            grid = {}
+            for n in self.__node_index.itervalues():
+                grid.setdefault(self.__cell(n.x, n.y), set()).add(n)
+            self.__grid = grid
+        return self.__grid
+
+    def _changed(self):
+        ##
+        # Records a change to the Graph's structure that no index tracks, e.g. a new Link.value.
+        # Called by Link objects. Mostly for internal use.
+        self.__version += 1
+
+    def _relink(self, link, attr, old):
+        ##
+        # Moves a Link within the Graph's Link indexes after its origin_uid, terminus_uid, or type has changed.
+        # Called by Link objects. Mostly for internal use.
+        #
+        # @param link: <i>Link</i> :: The Link that changed.
+        # @param attr: <i>str</i> :: 'origin_uid', 'terminus_uid', or 'type'.
+        # @param old: <i>str</i> :: The previous value of the attribute.
+        if link.uid not in self.__link_index:
+            return
+        self.__version += 1
+        if attr == 'type':
+            self.__unindex(self.__type_index, old, link)
+            self.__type_index.setdefault(link.type, OrderedDict())[link.uid] = link
+            return
+        if attr == 'origin_uid':
+            index = self.__out_index
+            self.__unindex(self.__pair_index, _pair(old, link.terminus_uid), link)
         else:
-            url = self.url+'api/'+json.dumps(query)
-            return url
+            index = self.__in_index
+            self.__unindex(self.__pair_index, _pair(link.origin_uid, old), link)
+        self.__unindex(index, old, link)
+        index.setdefault(getattr(link, attr), []).append(link)
+        self.__pair_index.setdefault(_pair(link.origin_uid, link.terminus_uid), []).append(link)
+
+    def __batch(self, query, key, objects, callback, item_callback):
+        ##
+        # Groups object dictionaries into batch queries bounded by max_batch_size and, unless queries are posted,
+        # max_url_length, and enqueues them. Mostly for internal use.
+        #
+        # @param query: <i>str</i> :: The batch query to send, 'batchnodes' or 'batchrels'.
+        # @param key: <i>str</i> :: The query field that holds the list of object dictionaries.
+        # @param objects: <i>list</i> :: The Node or Link objects to create.
+        # @param callback: <i>function</i> :: A function to perform on the response to each batch query.
+        # @param item_callback: <i>function</i> :: A function to perform on each object and its result.
+        # @return future: <i>Future</i> :: A Future for the list of batch responses, or None when sent synchronously.
+        base = len(self.prep({'query': query, key: []}))
+        posting = self._posting()
+        futures = []
+        batch = []
+        size = base
+        for obj in objects:
+            d = obj.dictionary()
+            s = len(urllib.quote(_encode(d)))+4
+            if batch and (len(batch) >= max_batch_size or (size+s > max_url_length and not posting)):
+                futures.append(self.__queue_batch(query, key, batch, callback, item_callback))
+                batch = []
+                size = base
+            batch.append((obj, d))
+            size += s
+        if batch:
+            futures.append(self.__queue_batch(query, key, batch, callback, item_callback))
+        if None in futures:
+            return None
+        return gather(futures)
+
+    def __queue_batch(self, query, key, batch, callback, item_callback):
+        ##
+        # Enqueues a single batch query and dispatches its per-item results. Mostly for internal use.
+        #
+        # @param query: <i>str</i> :: The batch query to send.
+        # @param key: <i>str</i> :: The query field that holds the list of object dictionaries.
+        # @param batch: <i>list</i> :: A list of (object, dictionary) pairs.
+        # @param callback: <i>function</i> :: A function to perform on the response to the query.
+        # @param item_callback: <i>function</i> :: A function to perform on each object and its result.
+        objs = [b[0] for b in batch]
+
+        def handler(r):
+            per_item = isinstance(r, list) and len(r) == len(objs)
+            for i, obj in enumerate(objs):
+                obj.created = True
+                obj.dirty = None
+                if item_callback:
+                    if per_item:
+                        item_callback(obj, r[i])
+                    else:
+                        item_callback(obj, r)
+            if callback:
+                callback(r)
+        return self.queue({'query': query, key: [b[1] for b in batch]}, handler)
 
     def add_detail(self, detail, callback=None, update=True):
         ##
@@ -151,13 +1285,18 @@ class Graph:
         # @endcode
         if detail.__class__.__name__ == "Detail":
             detail.graph = self
-            self.__details.append(detail)
+            if self.__details is not None:
+                self.__details.append(detail)
             self.__details_index[detail.uid] = detail
+            if detail.anchor_uid:
+                self.__anchor_index.setdefault(detail.anchor_uid, []).append(detail)
+            self.__unplaced[detail.uid] = detail
             if update:
                 q = detail.dictionary()
                 q['query'] = "newdetail"
                 detail.created = True
-                self.queue(q, callback)
+                detail.dirty = None
+                return self.queue(q, callback)
         else:
             raise TypeError('Graph.add_detail requires a Detail-type object')
 
@@ -174,13 +1313,25 @@ class Graph:
         # @endcode
         if link.__class__.__name__ == "Link":
             link.graph = self
-            self.__links.append(link)
+            # Share the endpoint Nodes' uid strings rather than keeping copies of them.
+            for attr in ('origin_uid', 'terminus_uid'):
+                node = self.__node_index.get(getattr(link, attr))
+                if node:
+                    object.__setattr__(link, attr, node.uid)
+            if self.__links is not None:
+                self.__links.append(link)
             self.__link_index[link.uid] = link
+            self.__out_index.setdefault(link.origin_uid, []).append(link)
+            self.__in_index.setdefault(link.terminus_uid, []).append(link)
+            self.__type_index.setdefault(link.type, OrderedDict())[link.uid] = link
+            self.__pair_index.setdefault(_pair(link.origin_uid, link.terminus_uid), []).append(link)
+            self.__version += 1
             if update:
                 q = link.dictionary()
                 q['query'] = "newrel"
                 link.created = True
-                self.queue(q, callback)
+                link.dirty = None
+                return self.queue(q, callback)
         else:
             raise TypeError('Graph.add_link requires a Link-type object.')
 
@@ -202,10 +1353,31 @@ class Graph:
                 q = link_type.dictionary()
                 q['query'] = "newreltype"
                 link_type.created = True
-                self.queue(q, callback)
+                link_type.dirty = None
+                return self.queue(q, callback)
         else:
             raise TypeError('Graph.add_link_type requires a LinkType-type object.')
 
+    def add_links(self, links, callback=None, update=True, item_callback=None):
+        ##
+        # Adds many Link objects to the Graph, creating them on the server with as few 'batchrels' queries as
+        # max_batch_size and max_url_length allow.
+        #
+        # @param links: <i>iterable</i> :: The Link objects to add to the Graph.
+        # @param callback: <i>function</i> :: An optional function to handle the server's response to each batch.
+        # @param update: <i>bool</i> :: Whether or not to immediately enqueue the queries.
+        # @param item_callback: <i>function</i> :: An optional function called as item_callback(link, result)
+        # for every Link once its batch has been acknowledged.
+        #
+        # @code
+        # g.add_links([Link(a.uid, b.uid, lt.name), Link(b.uid, c.uid, lt.name)])
+        # @endcode
+        links = list(links)
+        for link in links:
+            self.add_link(link, update=False)
+        if update:
+            return self.__batch('batchrels', 'rels', links, callback, item_callback)
+
     def add_node(self, node, callback=None, update=True):
         ##
         # Adds a Node to the Graph.
@@ -219,16 +1391,94 @@ class Graph:
         # @endcode
         if node.__class__.__name__ == "Node":
             node.graph = self
-            self.__nodes.append(node)
+            if self.__nodes is not None:
+                self.__nodes.append(node)
             self.__node_index[node.uid] = node
+            b = self.__bounds
+            if b:
+                b[0] = min(b[0], node.x)
+                b[1] = max(b[1], node.x)
+                b[2] = min(b[2], node.y)
+                b[3] = max(b[3], node.y)
+            if self.__grid is not None:
+                self.__grid.setdefault(self.__cell(node.x, node.y), set()).add(node)
+            self.__max_radius = max(self.__max_radius, node.radius)
+            self.__unplaced[node.uid] = node
+            self.__version += 1
             if update:
                 q = node.dictionary()
                 q['query'] = "newnode"
                 node.created = True
-                self.queue(q, callback)
+                node.dirty = None
+                return self.queue(q, callback)
         else:
             raise TypeError('Graph.add_node requires a Node-type object.')
 
+    def add_nodes(self, nodes, callback=None, update=True, item_callback=None):
+        ##
+        # Adds many Node objects to the Graph, creating them on the server with as few 'batchnodes' queries as
+        # max_batch_size and max_url_length allow.
+        #
+        # @param nodes: <i>iterable</i> :: The Node objects to add to the Graph.
+        # @param callback: <i>function</i> :: An optional function to handle the server's response to each batch.
+        # @param update: <i>bool</i> :: Whether or not to immediately enqueue the queries.
+        # @param item_callback: <i>function</i> :: An optional function called as item_callback(node, result)
+        # for every Node once its batch has been acknowledged.
+        #
+        # @code
+        # g.add_nodes(Node(name='Node '+str(i)) for i in range(0, 50000))
+        # @endcode
+        nodes = list(nodes)
+        for node in nodes:
+            self.add_node(node, update=False)
+        if update:
+            return self.__batch('batchnodes', 'nodes', nodes, callback, item_callback)
+
+    def anchored_details(self, uid):
+        ##
+        # Returns a list of Detail objects which are attached to the Node or Link with the given uid.
+        #
+        # @param uid: <i>str</i> :: The uid of a Node or Link.
+        # @return details: <i>list</i> :: A list of Detail objects.
+        #
+        # @code
+        # for d in g.anchored_details(n.uid):
+        #     print d.content
+        # @endcode
+        return list(self.__anchor_index.get(uid, ()))
+
+    def anchored_detail_count(self, uid):
+        ##
+        # Returns the number of Detail objects which are attached to the Node or Link with the given uid.
+        #
+        # @param uid: <i>str</i> :: The uid of a Node or Link.
+        # @return count: <i>int</i> ::
+        #
+        # @code
+        # print g.anchored_detail_count(n.uid)
+        # @endcode
+        return len(self.__anchor_index.get(uid, ()))
+
+    def bounding_box(self):
+        ##
+        # Returns the bounds of all Node positions in the Graph. The bounds are kept up to date as Node objects
+        # are added, moved, and removed, so this is usually O(1).
+        #
+        # @return box: <i>dict</i> :: A dictionary {min_x, min_y, max_x, max_y}, or None if the Graph has no Node objects.
+        #
+        # @code
+        # b = g.bounding_box()
+        # n = Node(x=b['max_x']+50, y=b['min_y'])
+        # @endcode
+        b = self.__bounds
+        if not b:
+            if not self.__node_index:
+                return None
+            xs = [n.x for n in self.__node_index.itervalues()]
+            ys = [n.y for n in self.__node_index.itervalues()]
+            b = self.__bounds = [min(xs), max(xs), min(ys), max(ys)]
+        return {'min_x': b[0], 'max_x': b[1], 'min_y': b[2], 'max_y': b[3]}
+
     def detail(self, uid):
         ##
         # Returns a Detail by its UID
@@ -253,6 +1503,8 @@ class Graph:
         # for d in g.detail_list():
         #     print d.content
         # @endcode
+        if self.__details is None:
+            self.__details = self.__details_index.values()
         return self.__details
 
     def details(self):
@@ -267,11 +1519,23 @@ class Graph:
         # @endcode
         return self.__details_index
 
-    def draw(self, callback=None):
+    def draw(self, callback=None, local=False, update=True, iterations=None, processes=1, incremental=False):
         ##
         # Calculates a layout for the Graph and returns new positions for all Node and Detail objects.
         #
+        # By default the server calculates the layout. With local=True the layout is calculated in this process by
+        # psynth.layout.force_layout, which requires numpy, and the new positions are then saved on the server.
+        # With incremental=True only the objects returned by unplaced() are placed, locally, and every other Node
+        # keeps its position; only the positions that changed are saved.
+        #
         # @param callback: <i>function</i> :: An optional function to handle the server's response to the query.
+        # With local=True it receives a dictionary of the same shape, built from the local positions.
+        # @param local: <i>bool</i> :: Whether to calculate the layout locally instead of on the server.
+        # @param update: <i>bool</i> :: With local=True, whether or not to save the new positions on the server.
+        # @param iterations: <i>int</i> :: With local=True or incremental=True, the number of simulation steps.
+        # 50 for a whole layout and 30 for an incremental one if omitted.
+        # @param processes: <i>int</i> :: With local=True, the number of processes to calculate the layout with.
+        # @param incremental: <i>bool</i> :: Whether to place only new Node and Detail objects, locally.
         #
         # @code
         # for i in range(0, 100):
@@ -279,29 +1543,148 @@ class Graph:
         #     g.add_node(n)
         # g.draw()
         # @endcode
+        if incremental:
+            from psynth.layout import incremental_layout
+            with self.__callback_lock:
+                nodes, details = incremental_layout(self, self.unplaced(),
+                                                    iterations=30 if iterations is None else iterations)
+                self.__unplaced.clear()
+        elif local:
+            from psynth.layout import force_layout
+            with self.__callback_lock:
+                force_layout(self, iterations=50 if iterations is None else iterations, processes=processes)
+                self.__unplaced.clear()
+            nodes = self.node_list()
+            details = self.detail_list()
+        if incremental or local:
+            if callback:
+                callback({'nodes': [{'UID': n.uid, 'X': n.x, 'Y': n.y} for n in nodes],
+                          'details': [{'UID': d.uid, 'X': d.x, 'Y': d.y} for d in details]})
+            if update and (nodes or details):
+                return self.push_positions(nodes, details)
+            return None
+
         q = {'query': 'drawgraph'}
 
         def handler(r):
-            for n in r['nodes']:
-                self.__node_index[n['UID']].x = n['X']
-                self.__node_index[n['UID']].y = n['Y']
-            for d in r['details']:
-                self.__details_index[d['UID']].x = d['X']
-                self.__details_index[d['UID']].y = d['Y']
+            self.__apply_positions(r)
             if callback:
                 callback(r)
-        self.queue(q, handler)
+        return self.queue(q, handler)
+
+    def __apply_positions(self, r):
+        ##
+        # Moves Node and Detail objects to the positions in a 'drawgraph' or 'getallpos' response.
+        # Mostly for internal use.
+        #
+        # @param r: <i>dict</i> :: A response with 'nodes' and 'details' lists of {UID, X, Y}.
+        # @return moved: <i>list</i> :: The Node and Detail objects whose positions changed.
+        moved = []
+        for section, index in (('nodes', self.__node_index), ('details', self.__details_index)):
+            for p in r.get(section, ()):
+                obj = index.get(p['UID'])
+                if obj is None:
+                    continue
+                if obj.x != p['X'] or obj.y != p['Y']:
+                    obj.x = p['X']
+                    obj.y = p['Y']
+                    moved.append(obj)
+                _settle(obj, ('x', 'y'))
+                self.__unplaced.pop(p['UID'], None)
+        return moved
+
+    def expand_selection(self, nodes, hops=1, remote=False, callback=None):
+        ##
+        # Returns a selection of Node objects grown by every Node within some number of Link objects of it,
+        # in either direction. The original selection comes first, then each ring of neighbors in turn.
+        #
+        # @param nodes: <i>iterable</i> :: The selected Node objects.
+        # @param hops: <i>int</i> :: The number of Link objects to follow outward.
+        # @param remote: <i>bool</i> :: Whether to ask the server with 'expandselection' instead, one hop only.
+        # @param callback: <i>function</i> :: An optional function to perform on the result, or on the server's response.
+        # @return nodes: <i>list</i> :: A list of Node objects. With remote=True, what queue returns.
+        #
+        # @code
+        # for n in g.expand_selection([hub], hops=2):
+        #     n.color = '#FF0000'
+        # @endcode
+        if remote:
+            return self.queue({'query': 'expandselection', 'uids': [urllib.quote(n.uid) for n in nodes]}, callback)
+        found = OrderedDict((n.uid, n) for n in nodes)
+        ring = list(found)
+        for i in range(0, hops):
+            next_ring = []
+            for uid in ring:
+                for other, link in self.__adjacent(uid, False):
+                    if other not in found and other in self.__node_index:
+                        found[other] = self.__node_index[other]
+                        next_ring.append(other)
+            ring = next_ring
+        result = found.values()
+        if callback:
+            callback(result)
+        return result
+
+    def height(self):
+        ##
+        # Returns the height of the Graph.
+        #
+        # @return height: <i>float</i> ::
+        #
+        # @code
+        # h = g.height()
+        # @endcode
+        return self.max_y()-self.min_y()
+
+    def heat(self, callback=None):
+        ##
+        # Asks the server for its 'getheat' analysis of the Graph. See psynth.analytics for local equivalents.
+        #
+        # @param callback: <i>function</i> :: An optional function to handle the server's response to the query.
+        # @return future: <i>Future</i> :: A Future for the response when the Graph has workers, otherwise None.
+        #
+        # @code
+        # g.heat(callback=my_function)
+        # @endcode
+        return self.queue({'query': 'getheat'}, callback)
+
+    def in_links(self, uid):
+        ##
+        # Returns a list of Link objects which terminate at the Node with the given uid.
+        #
+        # @param uid: <i>str</i> :: The uid of a Node.
+        # @return links: <i>list</i> :: A list of Link objects.
+        #
+        # @code
+        # for link in g.in_links(n.uid):
+        #     print link.origin().name
+        # @endcode
+        return list(self.__in_index.get(uid, ()))
 
-    def height(self):
+    def interconnections(self, nodes, remote=False, callback=None):
         ##
-        # Returns the height of the Graph.
+        # Returns the Link objects whose origin and terminus are both among some Node objects.
         #
-        # @return height: <i>float</i> ::
+        # @param nodes: <i>iterable</i> :: The Node objects.
+        # @param remote: <i>bool</i> :: Whether to ask the server with 'interconnections' instead.
+        # @param callback: <i>function</i> :: An optional function to perform on the result, or on the server's response.
+        # @return links: <i>list</i> :: A list of Link objects. With remote=True, what queue returns.
         #
         # @code
-        # h = g.height()
+        # total = sum(link.value for link in g.interconnections(team))
         # @endcode
-        return self.max_y()-self.min_y()
+        nodes = list(nodes)
+        if remote:
+            return self.queue({'query': 'interconnections', 'uids': [urllib.quote(n.uid) for n in nodes]}, callback)
+        uids = set(n.uid for n in nodes)
+        result = []
+        for uid in uids:
+            for link in self.__out_index.get(uid, ()):
+                if link.terminus_uid in uids:
+                    result.append(link)
+        if callback:
+            callback(result)
+        return result
 
     def link(self, uid):
         ##
@@ -328,6 +1711,8 @@ class Graph:
         # for link in g.link_list():
         #     print link.name
         # @endcode
+        if self.__links is None:
+            self.__links = self.__link_index.values()
         return self.__links
 
     def links(self):
@@ -342,6 +1727,76 @@ class Graph:
         # @endcode
         return self.__link_index
 
+    def links_between(self, uid1, uid2):
+        ##
+        # Returns the Link objects between two Node objects, in either direction.
+        #
+        # @param uid1: <i>str</i> :: The uid of one Node.
+        # @param uid2: <i>str</i> :: The uid of the other Node.
+        # @return links: <i>list</i> :: A list of Link objects.
+        #
+        # @code
+        # if not g.links_between(a.uid, b.uid):
+        #     g.add_link(Link(a.uid, b.uid, 'Friends'))
+        # @endcode
+        return list(self.__pair_index.get(_pair(uid1, uid2), ()))
+
+    def links_of_type(self, name):
+        ##
+        # Returns the Link objects of a LinkType.
+        #
+        # @param name: <i>str</i> :: The name of the LinkType.
+        # @return links: <i>list</i> :: A list of Link objects.
+        #
+        # @code
+        # for link in g.links_of_type('Money'):
+        #     print link.value
+        # @endcode
+        links = self.__type_index.get(name)
+        if links is None:
+            return []
+        return links.values()
+
+    def pair_values(self, multiple=False):
+        ##
+        # Returns the total Link.value between every pair of connected Node objects, in either direction.
+        #
+        # @param multiple: <i>bool</i> :: Whether to only include pairs joined by more than one Link.
+        # @return values: <i>dict</i> :: A dictionary of total values, keyed by (uid, uid) tuples. The lesser uid
+        # comes first, so look pairs up with the same order.
+        #
+        # @code
+        # for (a, b), total in g.pair_values(multiple=True).items():
+        #     print g.node(a).name, g.node(b).name, total
+        # @endcode
+        values = {}
+        for pair, links in self.__pair_index.iteritems():
+            if len(links) == 1:
+                if not multiple:
+                    values[pair] = links[0].value
+            else:
+                values[pair] = sum(link.value for link in links)
+        return values
+
+    def link_centers(self):
+        ##
+        # Returns the center point of every Link in the Graph at once.
+        #
+        # @return centers: <i>dict</i> :: A uid-keyed dictionary of {x,y} dictionaries.
+        #
+        # @code
+        # for uid, c in g.link_centers().iteritems():
+        #     print g.link(uid).name, c['x'], c['y']
+        # @endcode
+        nodes = self.__node_index
+        centers = {}
+        for link in self.__link_index.itervalues():
+            o = nodes.get(link.origin_uid)
+            t = nodes.get(link.terminus_uid)
+            if o and t:
+                centers[link.uid] = {'x': (o.x+t.x)/2, 'y': (o.y+t.y)/2}
+        return centers
+
     def link_type(self, name):
         ##
         # Returns a LinkType object by name.
@@ -367,6 +1822,34 @@ class Graph:
         # @endcode
         return self.__link_types
 
+    def mark_unplaced(self, obj):
+        ##
+        # Marks a Node or Detail to be placed again by the next draw(incremental=True).
+        #
+        # @param obj: <i>Node or Detail</i> :: The object to place again.
+        #
+        # @code
+        # g.mark_unplaced(n)
+        # g.draw(incremental=True)
+        # @endcode
+        self.__unplaced[obj.uid] = obj
+
+    def mark_placed(self, objs=None):
+        ##
+        # Marks Node and Detail objects as placed, so draw(incremental=True) leaves them where they are.
+        #
+        # @param objs: <i>iterable</i> :: The objects to mark. Every object is marked if omitted.
+        #
+        # @code
+        # g.add_node(Node(x=200, y=300))
+        # g.mark_placed()
+        # @endcode
+        if objs is None:
+            self.__unplaced.clear()
+        else:
+            for obj in objs:
+                self.__unplaced.pop(obj.uid, None)
+
     def max_x(self):
         ##
         # Returns the maximum x value of all Node objects in the Graph.
@@ -377,11 +1860,9 @@ class Graph:
         # n = Node(x=g.max_x()+50)
         # g.add_node(n)
         # @endcode
-        m = None
-        for n in self.__nodes:
-            if not m or n.x > m:
-                m = n.x
-        return m
+        b = self.bounding_box()
+        if b:
+            return b['max_x']
 
     def max_y(self):
         ##
@@ -393,11 +1874,9 @@ class Graph:
         # n = Node(y=g.max_y()-50)
         # g.add_node(n)
         # @endcode
-        m = None
-        for n in self.__nodes:
-            if not m or n.y > m:
-                m = n.y
-        return m
+        b = self.bounding_box()
+        if b:
+            return b['max_y']
 
     def min_x(self):
         ##
@@ -409,11 +1888,9 @@ class Graph:
         # n = Node(x=g.min_x()+50)
         # g.add_node(n)
         # @endcode
-        m = None
-        for n in self.__nodes:
-            if not m or n.x < m:
-                m = n.x
-        return m
+        b = self.bounding_box()
+        if b:
+            return b['min_x']
 
     def min_y(self):
         ##
@@ -425,11 +1902,9 @@ class Graph:
         # n = Node(x=g.min_y()+50)
         # g.add_node(n)
         # @endcode
-        m = None
-        for n in self.__nodes:
-            if not m or n.y < m:
-                m = n.y
-        return m
+        b = self.bounding_box()
+        if b:
+            return b['min_y']
 
     def node(self, uid):
         ##
@@ -456,6 +1931,8 @@ class Graph:
         # for n in g.node_list():
         #     print n.name
         # @endcode
+        if self.__nodes is None:
+            self.__nodes = self.__node_index.values()
         return self.__nodes
 
     def nodes(self):
@@ -470,6 +1947,150 @@ class Graph:
         # @endcode
         return self.__node_index
 
+    def node_plus_one(self, node, remote=False, callback=None):
+        ##
+        # Returns a Node followed by every Node linked to it, in either direction.
+        #
+        # @param node: <i>Node</i> :: The Node.
+        # @param remote: <i>bool</i> :: Whether to ask the server with 'nodeplusone' instead.
+        # @param callback: <i>function</i> :: An optional function to perform on the result, or on the server's response.
+        # @return nodes: <i>list</i> :: A list of Node objects. With remote=True, what queue returns.
+        #
+        # @code
+        # for n in g.node_plus_one(hub):
+        #     print n.name
+        # @endcode
+        if remote:
+            return self.queue({'query': 'nodeplusone', 'uid': urllib.quote(node.uid)}, callback)
+        return self.expand_selection([node], 1, callback=callback)
+
+    def nearest(self, x, y, k=1):
+        ##
+        # Returns the Node objects closest to a point, nearest first.
+        #
+        # @param x: <i>float</i> :: The x-coordinate of the point.
+        # @param y: <i>float</i> :: The y-coordinate of the point.
+        # @param k: <i>int</i> :: The number of Node objects to return.
+        # @return nodes: <i>list</i> :: Up to k Node objects.
+        #
+        # @code
+        # closest = g.nearest(n.x, n.y, k=2)[1]
+        # @endcode
+        grid = self.__spatial_grid()
+        k = min(k, len(self.__node_index))
+        if k < 1:
+            return []
+        s = self.__grid_cell
+        cx, cy = self.__cell(x, y)
+        b = self.bounding_box()
+        bx0, by0 = self.__cell(b['min_x'], b['min_y'])
+        bx1, by1 = self.__cell(b['max_x'], b['max_y'])
+        last_ring = max(abs(cx-bx0), abs(cx-bx1), abs(cy-by0), abs(cy-by1))
+        heap = []
+        r = 0
+        while r <= last_ring:
+            if 8*r > len(grid):
+                # Sparse rings cost more than a scan of the remaining cells.
+                nodes = self.__node_index.itervalues()
+                return heapq.nsmallest(k, nodes, key=lambda n: (n.x-x)**2+(n.y-y)**2)
+            if r == 0:
+                ring = [(cx, cy)]
+            else:
+                ring = [(cx+i, cy+j) for i in range(-r, r+1) for j in (-r, r)]
+                ring += [(cx+i, cy+j) for i in (-r, r) for j in range(-r+1, r)]
+            for cell in ring:
+                for n in grid.get(cell, ()):
+                    entry = (-((n.x-x)**2+(n.y-y)**2), id(n), n)
+                    if len(heap) < k:
+                        heapq.heappush(heap, entry)
+                    elif entry > heap[0]:
+                        heapq.heapreplace(heap, entry)
+            # Every Node outside ring r is at least r cells away from the point.
+            if len(heap) == k and -heap[0][0] <= (r*s)**2:
+                break
+            r += 1
+        return [e[2] for e in sorted(heap, reverse=True)]
+
+    def find_free_position(self, radius, x=None, y=None):
+        ##
+        # Returns the closest point to (x, y) where a Node of the given radius would not overlap any other Node.
+        # Candidate points are searched on rings of growing size around (x, y).
+        #
+        # @param radius: <i>float</i> :: The radius of the Node to place.
+        # @param x: <i>float</i> :: The x-coordinate to search from. Defaults to the center of the Graph.
+        # @param y: <i>float</i> :: The y-coordinate to search from. Defaults to the center of the Graph.
+        # @return point: <i>dict</i> :: A dictionary {x,y}.
+        #
+        # @code
+        # p = g.find_free_position(24, x=n.x, y=n.y)
+        # g.add_node(Node(x=p['x'], y=p['y']))
+        # @endcode
+        b = self.bounding_box()
+        if x is None:
+            x = (b['min_x']+b['max_x'])/2 if b else 0.0
+        if y is None:
+            y = (b['min_y']+b['max_y'])/2 if b else 0.0
+        reach = radius+self.__max_radius
+        step = max(radius, 1.0)
+        ring = 0
+        while True:
+            if ring == 0:
+                points = [(x, y)]
+            else:
+                count = int(2*math.pi*ring)+1
+                points = [(x+ring*step*math.cos(2*math.pi*i/count), y+ring*step*math.sin(2*math.pi*i/count))
+                          for i in range(0, count)]
+            for px, py in points:
+                free = True
+                for n in self.nodes_in_box(px-reach, py-reach, px+reach, py+reach):
+                    if (n.x-px)**2+(n.y-py)**2 < (radius+n.radius)**2:
+                        free = False
+                        break
+                if free:
+                    return {'x': px, 'y': py}
+            ring += 1
+
+    def nodes_in_box(self, x0, y0, x1, y1):
+        ##
+        # Returns a list of Node objects whose positions fall inside a rectangle, edges included.
+        #
+        # @param x0: <i>float</i> :: The left edge of the rectangle.
+        # @param y0: <i>float</i> :: The top edge of the rectangle.
+        # @param x1: <i>float</i> :: The right edge of the rectangle.
+        # @param y1: <i>float</i> :: The bottom edge of the rectangle.
+        # @return nodes: <i>list</i> :: A list of Node objects.
+        #
+        # @code
+        # for n in g.nodes_in_box(0, 0, 500, 500):
+        #     print n.name
+        # @endcode
+        grid = self.__spatial_grid()
+        cx0, cy0 = self.__cell(x0, y0)
+        cx1, cy1 = self.__cell(x1, y1)
+        if (cx1-cx0+1)*(cy1-cy0+1) > len(grid):
+            cells = [c for key, c in grid.iteritems() if cx0 <= key[0] <= cx1 and cy0 <= key[1] <= cy1]
+        else:
+            cells = [grid[(i, j)] for i in range(cx0, cx1+1) for j in range(cy0, cy1+1) if (i, j) in grid]
+        nodes = []
+        for c in cells:
+            for n in c:
+                if x0 <= n.x <= x1 and y0 <= n.y <= y1:
+                    nodes.append(n)
+        return nodes
+
+    def out_links(self, uid):
+        ##
+        # Returns a list of Link objects which originate at the Node with the given uid.
+        #
+        # @param uid: <i>str</i> :: The uid of a Node.
+        # @return links: <i>list</i> :: A list of Link objects.
+        #
+        # @code
+        # for link in g.out_links(n.uid):
+        #     print link.terminus().name
+        # @endcode
+        return list(self.__out_index.get(uid, ()))
+
     def publish(self, callback=None):
         ##
         # Creates a perma-link for a public viewer of the graph.
@@ -487,7 +2108,135 @@ class Graph:
             if callback:
                 callback(r)
 
-        self.queue(q, handler)
+        return self.queue(q, handler)
+
+    def push_positions(self, nodes=None, details=None, callback=None):
+        ##
+        # Saves the positions of Node and Detail objects on the server, e.g. after a local layout.
+        # The server has no bulk position query, so one update is queued per object; with workers they run concurrently.
+        #
+        # @param nodes: <i>iterable</i> :: The Node objects to save. Every Node and Detail is saved if both are omitted.
+        # @param details: <i>iterable</i> :: The Detail objects to save.
+        # @param callback: <i>function</i> :: An optional function to handle the server's response to each query.
+        # @return future: <i>Future</i> :: A Future for the list of responses, or None when sent synchronously.
+        #
+        # @code
+        # g.translate(100, 0)
+        # g.push_positions()
+        # @endcode
+        if nodes is None and details is None:
+            nodes = self.node_list()
+            details = self.detail_list()
+        futures = []
+        for obj, query in ((nodes, 'updatenode'), (details, 'updatedetail')):
+            for o in obj or ():
+                with self.__callback_lock:
+                    self.__deferred.pop(id(o), None)
+                futures.append(self.__send_update(o, query, [callback] if callback else []))
+        if None in futures:
+            return None
+        return gather(futures)
+
+    def refresh(self, positions_only=False, callback=None):
+        ##
+        # Brings the Graph up to date with the server in place, keeping every unchanged object and all indexes.
+        # Pending queries are sent first.
+        #
+        # The whole Graph is requested with the ETag of the last load or refresh, so an unchanged Graph costs
+        # only a 304 response. Otherwise objects the server added are added, changed attributes are copied onto
+        # the existing objects, and objects the server no longer has are removed. Attributes changed locally
+        # and not yet sent (see Node.dirty) are kept. If the Graph was loaded with a SnapshotCache, the snapshot is
+        # replaced too.
+        #
+        # With positions_only=True only the positions of Node and Detail objects are fetched, with 'getallpos'.
+        #
+        # @param positions_only: <i>bool</i> :: Whether to fetch only positions instead of the whole Graph.
+        # @param callback: <i>function</i> :: An optional function to perform on the dictionary of changes.
+        # @return changes: <i>dict</i> :: Lists of the 'created', 'updated', and 'removed' objects.
+        #
+        # @code
+        # while True:
+        #     changes = g.refresh()
+        #     for n in changes['updated']:
+        #         print n.name
+        #     time.sleep(5)
+        # @endcode
+        self.flush()
+        changes = {'created': [], 'updated': [], 'removed': []}
+        if positions_only:
+            r = self.__request({'query': 'getallpos'})
+            with self.__callback_lock:
+                changes['updated'] = self.__apply_positions(r)
+        else:
+            headers = {'If-None-Match': self.__etag} if self.__etag else None
+            c = self._fetch({'query': 'getwholegraph'}, stream=True, headers=headers)
+            if c.status_code == 304:
+                snapshot = (self.__cache.lookup(self.url, self.filename, self.username, self.key)
+                            if self.__cache else None)
+                if snapshot:
+                    self.__cache.touch(snapshot)
+            elif c.status_code == 200:
+                etag = c.headers.get('ETag')
+                writer = (self.__cache.writer(self.url, self.filename, etag, self.username, self.key)
+                          if self.__cache else None)
+                with self.__callback_lock:
+                    self.__merge_all(_graph_sections(c, writer), changes)
+                if writer:
+                    writer.commit()
+                self.__etag = etag
+            elif c.status_code == 406:
+                raise SyntaxError(c.url+"    "+c.json())
+            else:
+                raise SyntaxError(c.url+"    "+str(c.status_code))
+        if callback:
+            callback(changes)
+        return changes
+
+    def _synced(self, etag, cache):
+        ##
+        # Records the ETag and SnapshotCache of the last full load, for refresh(). Mostly for internal use.
+        self.__etag = etag
+        self.__cache = cache
+
+    def __merge_all(self, sections, changes):
+        ##
+        # Applies a full 'getwholegraph' response to the Graph, recording what changed. Mostly for internal use.
+        indexes = {'rel_types': self.__link_types,
+                   'nodes': self.__node_index,
+                   'rels': self.__link_index,
+                   'details': self.__details_index}
+        adders = {'rel_types': self.add_link_type,
+                  'nodes': self.add_node,
+                  'rels': self.add_link,
+                  'details': self.add_detail}
+        seen = dict((section, set()) for section in indexes)
+        for section, obj in sections:
+            if section == 'name':
+                self.name = obj
+                continue
+            if section not in indexes:
+                continue
+            key = obj.name if section == 'rel_types' else obj.uid
+            seen[section].add(key)
+            old = indexes[section].get(key)
+            if old is None:
+                adders[section](obj, update=False)
+                self.__unplaced.pop(key, None)
+                changes['created'].append(obj)
+            elif _merge(old, obj):
+                changes['updated'].append(old)
+        # Dependents go before the objects they hang from.
+        for obj in [d for uid, d in self.__details_index.iteritems() if uid not in seen['details']]:
+            self.remove_detail(obj, update=False)
+            changes['removed'].append(obj)
+        for obj in [l for uid, l in self.__link_index.iteritems() if uid not in seen['rels']]:
+            self.remove_link(obj, update=False)
+            changes['removed'].append(obj)
+        for obj in [n for uid, n in self.__node_index.iteritems() if uid not in seen['nodes']]:
+            self.remove_node(obj, update=False)
+            changes['removed'].append(obj)
+        for name in [name for name in self.__link_types if name not in seen['rel_types']]:
+            changes['removed'].append(self.__link_types.pop(name))
 
     def remove_detail(self, detail, callback=None, update=True):
         ##
@@ -500,45 +2249,290 @@ class Graph:
         # @code
         # g.remove_detail(my_detail, callback=my_function)
         # @endcode
-        self.__details.remove(detail)
         del self.__details_index[detail.uid]
+        self.__details = None
+        self.__deferred.pop(id(detail), None)
+        self.__unplaced.pop(detail.uid, None)
+        self.__unindex(self.__anchor_index, detail.anchor_uid, detail)
         if update:
             q = {'query': 'deldetail', 'uid': detail.uid}
-            self.queue(q, callback)
+            return self.queue(q, callback)
 
-    def remove_link(self, link, callback=None, update=True):
+    def remove_link(self, link, callback=None, update=True, cascade=False):
         ##
         # Removes a Link from the Graph.
         #
         # @param link: <i>Link<i> The Link to remove.
         # @param callback: <i>function</i> :: An optional function to handle the server's response to the query.
         # @param update: <i>bool</i> :: Whether or not to immediately enqueue the query.
+        # @param cascade: <i>bool</i> :: Whether or not to also remove the Detail objects attached to the Link.
         #
         # @code
         # g.remove_link(my_link, callback=my_function)
         # @endcode
-        self.__links.remove(link)
+        if cascade:
+            return self.__remove_all([], [link], callback, update, True)
         del self.__link_index[link.uid]
+        self.__links = None
+        self.__version += 1
+        self.__deferred.pop(id(link), None)
+        self.__unindex(self.__out_index, link.origin_uid, link)
+        self.__unindex(self.__in_index, link.terminus_uid, link)
+        self.__unindex(self.__type_index, link.type, link)
+        self.__unindex(self.__pair_index, _pair(link.origin_uid, link.terminus_uid), link)
         if update:
             q = {'query': 'delrel', 'uid': link.uid}
-            self.queue(q, callback)
+            return self.queue(q, callback)
 
-    def remove_node(self, node, callback=None, update=True):
+    def remove_node(self, node, callback=None, update=True, cascade=False):
         ##
         # Removes a Node from the Graph.
         #
         # @param node: <i>Node</i> :: The Node to remove.
         # @param callback: <i>function</i> :: An optional function to handle the server's response to the query.
         # @param update: <i>bool</i> :: Whether or not to immediately enqueue the query.
+        # @param cascade: <i>bool</i> :: Whether or not to also remove the Link objects connected to the Node,
+        # and the Detail objects attached to the Node and those Links.
         #
         # @code
-        # g.remove_node(my_node, callback=my_function)
+        # g.remove_node(my_node, callback=my_function, cascade=True)
         # @endcode
-        self.__nodes.remove(node)
+        if cascade:
+            return self.__remove_all([node], [], callback, update, True)
         del self.__node_index[node.uid]
+        self.__nodes = None
+        self.__version += 1
+        self.__deferred.pop(id(node), None)
+        self.__unplaced.pop(node.uid, None)
+        b = self.__bounds
+        if b and (node.x in (b[0], b[1]) or node.y in (b[2], b[3])):
+            self.__bounds = None
+        if self.__grid is not None:
+            self.__unindex(self.__grid, self.__cell(node.x, node.y), node)
         if update:
             q = {'query': 'delnode', 'uid': node.uid}
-            self.queue(q, callback)
+            return self.queue(q, callback)
+
+    def remove_nodes(self, nodes, callback=None, update=True, cascade=False):
+        ##
+        # Removes many Node objects from the Graph. With cascade, a Link between two removed Node objects
+        # is only deleted once.
+        #
+        # @param nodes: <i>iterable</i> :: The Node objects to remove.
+        # @param callback: <i>function</i> :: An optional function to handle the server's response to each query.
+        # @param update: <i>bool</i> :: Whether or not to immediately enqueue the queries.
+        # @param cascade: <i>bool</i> :: Whether or not to also remove connected Link objects and attached Detail objects.
+        #
+        # @code
+        # g.remove_nodes([n for n in g.node_list() if n.radius < 10], cascade=True)
+        # @endcode
+        return self.__remove_all(list(nodes), [], callback, update, cascade)
+
+    def __remove_all(self, nodes, links, callback, update, cascade):
+        ##
+        # Removes Node and Link objects, and with cascade their connected Link objects and attached Detail objects.
+        # Details are removed first, then Links, then Nodes, so the server never holds a dangling reference.
+        # Mostly for internal use.
+        #
+        # @return future: <i>Future</i> :: A Future for the list of responses, or None when sent synchronously.
+        links = OrderedDict((link.uid, link) for link in links)
+        details = OrderedDict()
+        if cascade:
+            for node in nodes:
+                for link in self.__out_index.get(node.uid, ()):
+                    links[link.uid] = link
+                for link in self.__in_index.get(node.uid, ()):
+                    links[link.uid] = link
+                for d in self.__anchor_index.get(node.uid, ()):
+                    details[d.uid] = d
+            for link in links.itervalues():
+                for d in self.__anchor_index.get(link.uid, ()):
+                    details[d.uid] = d
+        futures = []
+        for d in details.values():
+            futures.append(self.remove_detail(d, callback=callback, update=update))
+        for link in links.values():
+            futures.append(self.remove_link(link, callback=callback, update=update))
+        for node in nodes:
+            futures.append(self.remove_node(node, callback=callback, update=update))
+        if not update or None in futures:
+            return None
+        return gather(futures)
+
+    def scale(self, factor, origin_x=None, origin_y=None, nodes=None):
+        ##
+        # Scales the positions of Node objects, and the Detail objects attached to them, about a point.
+        # Positions change locally only; call update() on each object to save them on the server.
+        #
+        # @param factor: <i>float</i> :: The scale factor.
+        # @param origin_x: <i>float</i> :: The x-coordinate to scale about. Defaults to the center of the Graph.
+        # @param origin_y: <i>float</i> :: The y-coordinate to scale about. Defaults to the center of the Graph.
+        # @param nodes: <i>iterable</i> :: The Node objects to scale. Defaults to every Node and Detail in the Graph.
+        #
+        # @code
+        # g.scale(2)
+        # @endcode
+        b = self.bounding_box()
+        if not b:
+            return
+        if origin_x is None:
+            origin_x = (b['min_x']+b['max_x'])/2
+        if origin_y is None:
+            origin_y = (b['min_y']+b['max_y'])/2
+        self.__transform(lambda x: origin_x+(x-origin_x)*factor, lambda y: origin_y+(y-origin_y)*factor, nodes)
+
+    def shortest_path(self, origin, terminus, weighted=False, directed=False, remote=False, callback=None):
+        ##
+        # Returns the shortest path between two Node objects, found with breadth-first search, or with Dijkstra's
+        # algorithm over Link.value as the length of each Link if weighted.
+        #
+        # @param origin: <i>Node</i> :: The Node to start from.
+        # @param terminus: <i>Node</i> :: The Node to reach.
+        # @param weighted: <i>bool</i> :: Whether to minimize the total Link.value instead of the number of Links.
+        # @param directed: <i>bool</i> :: Whether Link objects may only be followed from origin to terminus.
+        # @param remote: <i>bool</i> :: Whether to ask the server with 'shortestpath' instead.
+        # @param callback: <i>function</i> :: An optional function to perform on the result, or on the server's response.
+        # @return nodes: <i>list</i> :: The Node objects along the path, both ends included, or None if there is no
+        # path. With remote=True, what queue returns.
+        #
+        # @code
+        # path = g.shortest_path(a, b, weighted=True)
+        # if path:
+        #     print ' -> '.join(n.name for n in path)
+        # @endcode
+        if remote:
+            q = {'query': 'shortestpath', 'o_uid': urllib.quote(origin.uid), 't_uid': urllib.quote(terminus.uid)}
+            return self.queue(q, callback)
+        start = origin.uid
+        goal = terminus.uid
+        previous = {start: None}
+        if weighted:
+            dist = {start: 0}
+            heap = [(0, start)]
+            while heap:
+                d, uid = heapq.heappop(heap)
+                if uid == goal:
+                    break
+                if d > dist[uid]:
+                    continue
+                for other, link in self.__adjacent(uid, directed):
+                    if link.value < 0:
+                        raise ValueError('Graph.shortest_path requires Link values of 0 or more.')
+                    nd = d+link.value
+                    if other not in dist or nd < dist[other]:
+                        dist[other] = nd
+                        previous[other] = uid
+                        heapq.heappush(heap, (nd, other))
+        else:
+            ring = [start]
+            while ring and goal not in previous:
+                next_ring = []
+                for uid in ring:
+                    for other, link in self.__adjacent(uid, directed):
+                        if other not in previous:
+                            previous[other] = uid
+                            next_ring.append(other)
+                ring = next_ring
+        if goal not in previous:
+            result = None
+        else:
+            result = []
+            uid = goal
+            while uid is not None:
+                result.append(self.__node_index.get(uid))
+                uid = previous[uid]
+            result.reverse()
+        if callback:
+            callback(result)
+        return result
+
+    def __adjacent(self, uid, directed):
+        ##
+        # Yields (uid, Link) for every Node one Link away from a Node, following Links backwards too unless
+        # directed. Mostly for internal use.
+        for link in self.__out_index.get(uid, ()):
+            yield link.terminus_uid, link
+        if not directed:
+            for link in self.__in_index.get(uid, ()):
+                yield link.origin_uid, link
+
+    def translate(self, dx, dy, nodes=None):
+        ##
+        # Moves Node objects, and the Detail objects attached to them, by an offset.
+        # Positions change locally only; call update() on each object to save them on the server.
+        #
+        # @param dx: <i>float</i> :: The distance to move along x.
+        # @param dy: <i>float</i> :: The distance to move along y.
+        # @param nodes: <i>iterable</i> :: The Node objects to move. Defaults to every Node and Detail in the Graph.
+        #
+        # @code
+        # g.translate(-g.min_x(), -g.min_y())
+        # @endcode
+        self.__transform(lambda x: x+dx, lambda y: y+dy, nodes)
+
+    def __transform(self, fx, fy, nodes):
+        ##
+        # Applies a coordinate transform to Node objects and their Detail objects. Mostly for internal use.
+        #
+        # @param fx: <i>function</i> :: A monotonic function of x.
+        # @param fy: <i>function</i> :: A monotonic function of y.
+        # @param nodes: <i>iterable</i> :: The Node objects to move, or None for the whole Graph.
+        set_attr = object.__setattr__
+        if nodes is None:
+            nodes = self.__node_index.values()
+            details = self.__details_index.values()
+            b = self.__bounds
+            if b:
+                # A monotonic transform of every position maps the old bounds onto the new ones.
+                xs = sorted([fx(b[0]), fx(b[1])])
+                ys = sorted([fy(b[2]), fy(b[3])])
+                b[:] = [xs[0], xs[1], ys[0], ys[1]]
+        else:
+            nodes = list(nodes)
+            details = []
+            for n in nodes:
+                details.extend(self.__anchor_index.get(n.uid, ()))
+            self.__bounds = None
+        self.__grid = None
+        for n in nodes:
+            set_attr(n, 'x', fx(n.x))
+            set_attr(n, 'y', fy(n.y))
+            # Setting the slots directly skips the grid and bounds upkeep already done above, but the positions
+            # must still be sent by the next partial update.
+            if n.graph:
+                _touch(n, 'x')
+                _touch(n, 'y')
+        for d in details:
+            if d.x is not None:
+                d.x = fx(d.x)
+            if d.y is not None:
+                d.y = fy(d.y)
+
+    def unplaced(self):
+        ##
+        # Returns the Node and Detail objects that have been added or marked since the Graph was last drawn, in the
+        # order they were added. draw(incremental=True) places exactly these.
+        #
+        # @return objects: <i>list</i> :: A list of Node and Detail objects.
+        #
+        # @code
+        # print len(g.unplaced()), 'objects to place'
+        # @endcode
+        return self.__unplaced.values()
+
+    def version(self):
+        ##
+        # Returns a number that grows whenever Node or Link objects are added, removed, or re-pointed, or a Link
+        # changes its value or type. Results computed from the Graph's structure can be cached until it changes.
+        #
+        # @return version: <i>int</i> ::
+        #
+        # @code
+        # if g.version() != seen:
+        #     seen = g.version()
+        #     redraw()
+        # @endcode
+        return self.__version
 
     def width(self):
         ##
@@ -551,10 +2545,53 @@ class Graph:
         # @endcode
         return self.max_x()-self.min_x()
 
+##
+# An AsyncGraph is a Graph whose queries are always sent by worker threads. Every method that sends a query returns
+# a Future for the server's response instead of blocking, so one thread can drive many graphs at once.
+# Methods that do not send a query, e.g. add_node(n, update=False), return None.
+#
+class AsyncGraph(Graph):
+    def __init__(self, name, filename, url, username, key, transport=None, workers=4, mode='url', telemetry=None,
+                 executor=None):
+        ##
+        # This is the constructor for the AsyncGraph class. It should not be accessed directly,
+        # but instead through the create_graph_async and load_graph_async functions.
+        # @param name: <i>str</i> :: The displayed name of a Graph.
+        # @param filename: <i>str</i> :: A global unique filename of a Graph.
+        # @param url: <i>str</i> :: The base URL of your Psynth server. e.g. https://psynth.psymphonic.com/
+        # @param username: <i>str</i> :: Your Psynth username
+        # @param key: <i>str</i> :: Your Psynth API key.
+        # @param transport: <i>Transport</i> :: The connection pool to send queries through. A new one is made if omitted.
+        # @param workers: <i>int</i> :: The most queries this Graph keeps in flight at once.
+        # @param mode: <i>str</i> :: How queries are sent: 'url', 'post', or 'auto'. See Graph.mode.
+        # @param telemetry: <i>Telemetry</i> :: An optional psynth.telemetry.Telemetry to record queries with.
+        # @param executor: <i>Executor</i> :: The Executor whose threads send this Graph's queries. If omitted,
+        # the Graph starts workers threads of its own.
+        #
+        # @code
+        # g = load_graph_async('myfile.gt', url, username, key).result()
+        # futures = [g.add_node(Node(name='Node '+str(i))) for i in range(0, 100)]
+        # gather(futures).result()
+        # g.draw().result()
+        # @endcode
+        Graph.__init__(self, name, filename, url, username, key, transport=transport, mode=mode,
+                       telemetry=telemetry)
+        self.workers = max(1, workers)
+        self.executor = executor
+
 ##
 # Nodes are the basic unit in Psynth. They can be connected by Link objects, and Detail objects can be attached to them.
 #
-class Node():
+class Node(object):
+    __slots__ = ('name', 'uid', 'x', 'y', 'shape', 'image', 'radius', 'color', 'created', 'graph', 'dirty',
+                 '_quoted')
+    # Maps each attribute sent by update() to its key in dictionary().
+    _fields = {'name': 'name', 'x': 'x', 'y': 'y', 'shape': 'shape', 'image': 'picture', 'radius': 'radius',
+               'color': 'color'}
+    _key = 'uid'
+    # The attributes that dictionary() quotes, whose quoted values are cached until one of them changes.
+    _quoted_fields = frozenset(['uid', 'name', 'image', 'color'])
+
     def __init__(self, uid=None, name="New Node", x=1.0, y=1.0, shape=6, image="na", radius=24.0, color="dynamic"):
         ##
         # Constructs a Node object.
@@ -572,37 +2609,61 @@ class Node():
         # n = Node(name='My Node', shape=8, radius=33.5)
         # g.add_node(n)
         # @endcode
+        # Fields are set directly; a new object has no Graph for __setattr__ to keep current.
+        set_attr = object.__setattr__
         if not uid:
             uid = str(uuid.uuid4())
         ## <i>str</i> :: The display name of the Node.
-        self.name = urllib.unquote(name)
+        set_attr(self, 'name', urllib.unquote(name))
 
         ## <i>str</i> :: The global unique id of the Node.
-        self.uid = urllib.unquote(uid)
+        set_attr(self, 'uid', urllib.unquote(uid))
 
         ## <i>float</i> :: The x-coordinate of the Node. Assumes a web-standard grid with (0,0) at (top,left)
-        self.x = float(x)
+        set_attr(self, 'x', float(x))
 
         ## <i>float</i> :: The y-coordinate of the Node. Assumes a web-standard grid with (0,0) at (top,left)
-        self.y = float(y)
+        set_attr(self, 'y', float(y))
 
         ## <i>int</i> :: The number of sides of the Node shape. 0 for circle, 1 for image, otherwise n-gon.
-        self.shape = int(shape)
+        set_attr(self, 'shape', int(shape))
 
         ## <i>str</i> :: The URL for an image to display on this Node.
-        self.image = urllib.unquote(image)
+        set_attr(self, 'image', urllib.unquote(image))
 
         ## <i>float</i> :: The radius of the Node
-        self.radius = radius
+        set_attr(self, 'radius', radius)
 
         ## <i>str</i> :: The color of the Node. e.g. '#FF0000'
-        self.color = urllib.unquote(color)
+        set_attr(self, 'color', _intern(urllib.unquote(color)))
 
         ## <i>bool</i> :: Whether or not this Node has been created on the Server.
-        self.created = False
-
-    ## <i>Graph</i> :: The Graph to which this Node belongs.
-    graph = None
+        set_attr(self, 'created', False)
+
+        ## <i>Graph</i> :: The Graph to which this Node belongs.
+        set_attr(self, 'graph', None)
+
+        ## <i>set</i> :: The names of the attributes changed since this Node was last sent to the server, or None.
+        set_attr(self, 'dirty', None)
+        set_attr(self, '_quoted', None)
+
+    def __setattr__(self, name, value):
+        # Keeps the Graph's bounding box and spatial index current when a Node moves or grows,
+        # and records which attributes have changed.
+        graph = getattr(self, 'graph', None)
+        if (name == 'x' or name == 'y') and graph:
+            old = getattr(self, name)
+            object.__setattr__(self, name, value)
+            graph._move_node(self, name, old)
+        elif name == 'radius' and graph:
+            object.__setattr__(self, name, value)
+            graph._resize_node(self)
+        else:
+            object.__setattr__(self, name, value)
+        if name in Node._quoted_fields:
+            object.__setattr__(self, '_quoted', None)
+        if graph and name in Node._fields:
+            _touch(self, name)
 
     def add_detail(self, detail, update=True, callback=None):
         ##
@@ -621,12 +2682,9 @@ class Node():
         if not detail.x:
             detail.x = self.x+self.radius+4
         if not detail.y:
-            num = 0
-            for d in self.graph.detail_list():
-                if d.anchor_uid == self.uid:
-                    num += 1
+            num = self.graph.anchored_detail_count(self.uid)
             detail.y = self.y+self.radius+(20*num)
-        self.graph.add_detail(detail, update=update, callback=callback)
+        return self.graph.add_detail(detail, update=update, callback=callback)
 
     def details(self):
         ##
@@ -639,9 +2697,8 @@ class Node():
         #     print n.details()[d].anchor() == n # True
         # @endcode
         dets = {}
-        for d in self.graph.detail_list():
-            if d.anchor_uid == self.uid:
-                dets[d.uid] = d
+        for d in self.graph.anchored_details(self.uid):
+            dets[d.uid] = d
         return dets
 
     def detail_list(self):
@@ -654,11 +2711,7 @@ class Node():
         # for d in n.detail_list():
         #     print d.anchor() == n # True
         # @endcode
-        dets = []
-        for d in self.graph.detail_list():
-            if d.anchor_uid == self.uid:
-                dets.append(d)
-        return dets
+        return self.graph.anchored_details(self.uid)
 
     def out_links(self):
         ##
@@ -670,11 +2723,7 @@ class Node():
         # for link in n.out_links():
         #     print link.value
         # @endcode
-        links = []
-        for link in self.graph.link_list():
-            if link.origin_uid == self.uid:
-                links.append(link)
-        return links
+        return self.graph.out_links(self.uid)
 
     def in_links(self):
         ##
@@ -686,11 +2735,7 @@ class Node():
         # for link in n.in_links():
         #     print link.value
         # @endcode
-        links = []
-        for link in self.graph.link_list():
-            if link.terminus_uid == self.uid:
-                links.append(link)
-        return links
+        return self.graph.in_links(self.uid)
 
     def all_links(self):
         ##
@@ -702,9 +2747,9 @@ class Node():
         # for link in n.all_links():
         #     print link.value
         # @endcode
-        links = []
-        for link in self.graph.link_list():
-            if link.origin_uid == self.uid or link.terminus_uid == self.uid:
+        links = self.graph.out_links(self.uid)
+        for link in self.graph.in_links(self.uid):
+            if link.origin_uid != self.uid:
                 links.append(link)
         return links
 
@@ -718,11 +2763,7 @@ class Node():
         # for n2 in n.out_neighbors():
         #     print n2.name
         # @endcode
-        neighbors = []
-        for link in self.graph.link_list():
-            if link.origin_uid == self.uid:
-                neighbors.append(link.terminus())
-        return neighbors
+        return [link.terminus() for link in self.graph.out_links(self.uid)]
 
     def in_neighbors(self):
         ##
@@ -734,11 +2775,7 @@ class Node():
         # for n2 in n.in_neighbors():
         #     print n2.name
         # @endcode
-        neighbors = []
-        for link in self.graph.link_list():
-            if link.terminus_uid == self.uid:
-                neighbors.append(link.origin())
-        return neighbors
+        return [link.origin() for link in self.graph.in_links(self.uid)]
 
     def all_neighbors(self):
         ##
@@ -750,11 +2787,9 @@ class Node():
         # for n2 in n.all_neighbors():
         #     print n2.name
         # @endcode
-        neighbors = []
-        for link in self.graph.link_list():
-            if link.terminus_uid == self.uid:
-                neighbors.append(link.origin())
-            elif link.origin_uid == self.uid:
+        neighbors = [link.origin() for link in self.graph.in_links(self.uid)]
+        for link in self.graph.out_links(self.uid):
+            if link.terminus_uid != self.uid:
                 neighbors.append(link.terminus())
         return neighbors
 
@@ -769,14 +2804,19 @@ class Node():
         # q['query'] = 'newnode'
         # g.queue(q)
         # @endcode
-        return {'uid': urllib.quote(self.uid),
-                'name': urllib.quote(self.name),
+        q = self._quoted
+        if q is None:
+            q = (urllib.quote(self.uid), urllib.quote(self.name), urllib.quote(self.image),
+                 urllib.quote(self.color))
+            object.__setattr__(self, '_quoted', q)
+        return {'uid': q[0],
+                'name': q[1],
                 'x': str(self.x),
                 'y': str(self.y),
                 'radius': self.radius,
                 'shape': str(self.shape),
-                'picture': urllib.quote(self.image),
-                'color': urllib.quote(self.color)}
+                'picture': q[2],
+                'color': q[3]}
 
     def update(self, callback=None):
         ##
@@ -789,14 +2829,19 @@ class Node():
         # n.radius += 5
         # n.update()
         # @endcode
-        q = self.dictionary()
-        q['query'] = "updatenode"
-        self.graph.queue(q, callback)
+        return self.graph._update(self, "updatenode", callback)
 
 ##
 # Links connect Node objects to each other. They have a LinkType.  Detail objects can be attached to them.
 #
-class Link():
+class Link(object):
+    __slots__ = ('origin_uid', 'terminus_uid', 'type', 'name', 'value', 'uid', 'created', 'graph', 'dirty', '_quoted')
+    # Maps each attribute sent by update() to its key in dictionary().
+    _fields = {'origin_uid': 'o_uid', 'terminus_uid': 't_uid', 'type': 'rel_type', 'name': 'name', 'value': 'value'}
+    _key = 'uid'
+    # The attributes that dictionary() quotes, whose quoted values are cached until one of them changes.
+    _quoted_fields = frozenset(['uid', 'name', 'type', 'origin_uid', 'terminus_uid'])
+
     def __init__(self, origin_uid, terminus_uid, type, name="Link", value=1, uid=None):
         ##
         # Constructs a Link object.
@@ -812,32 +2857,55 @@ class Link():
         # my_link = Link(origin_node.uid, terminus_node.uid, 'Money', value=60)
         # g.add_link(l)
         # @endcode
+        # Fields are set directly; a new object has no Graph for __setattr__ to keep current.
+        set_attr = object.__setattr__
         if not uid:
             uid = str(uuid.uuid4())
 
         ## <i>str</i> :: The global unique id of the origin node.
-        self.origin_uid = urllib.unquote(origin_uid)
+        set_attr(self, 'origin_uid', urllib.unquote(origin_uid))
 
         ## <i>str</i> :: The global unique id of the terminus node.
-        self.terminus_uid = urllib.unquote(terminus_uid)
+        set_attr(self, 'terminus_uid', urllib.unquote(terminus_uid))
 
         ## <i>str</i> :: The name of the LinkType of this Link
-        self.type = urllib.unquote(type)
+        set_attr(self, 'type', _intern(urllib.unquote(type)))
 
         ## <i>str</i> :: The display name of this Link
-        self.name = urllib.unquote(name)
+        set_attr(self, 'name', urllib.unquote(name))
 
         ## <i>int</i> :: The value of this Link, between 1 and the LinkType.max
-        self.value = int(value)
+        set_attr(self, 'value', int(value))
 
         ## <i>str</i> :: The global unique id of this Link
-        self.uid = urllib.unquote(uid)
+        set_attr(self, 'uid', urllib.unquote(uid))
 
         ## <i>bool</i> :: Whether or not this Link has been created on the server.
-        self.created = False
-
-    ## <i>Graph</i> :: The Graph to which this Link belongs.
-    graph = None
+        set_attr(self, 'created', False)
+
+        ## <i>Graph</i> :: The Graph to which this Link belongs.
+        set_attr(self, 'graph', None)
+
+        ## <i>set</i> :: The names of the attributes changed since this Link was last sent to the server, or None.
+        set_attr(self, 'dirty', None)
+        set_attr(self, '_quoted', None)
+
+    def __setattr__(self, name, value):
+        # Keeps the Graph's Link indexes current when a Link is re-pointed or changes type, and records which
+        # attributes have changed.
+        graph = getattr(self, 'graph', None)
+        if (name == 'origin_uid' or name == 'terminus_uid' or name == 'type') and graph:
+            old = getattr(self, name)
+            object.__setattr__(self, name, value)
+            graph._relink(self, name, old)
+        else:
+            object.__setattr__(self, name, value)
+            if name == 'value' and graph:
+                graph._changed()
+        if name in Link._quoted_fields:
+            object.__setattr__(self, '_quoted', None)
+        if graph and name in Link._fields:
+            _touch(self, name)
 
     def link_type(self):
         ##
@@ -867,12 +2935,9 @@ class Link():
         if not detail.x:
             detail.x = self.center()['x']+10
         if not detail.y:
-            num = 0
-            for d in self.graph.detail_list():
-                if d.anchor_uid == self.uid:
-                    num += 1
+            num = self.graph.anchored_detail_count(self.uid)
             detail.y = self.center()['y']+(20*num)
-        self.graph.add_detail(detail, update=update, callback=callback)
+        return self.graph.add_detail(detail, update=update, callback=callback)
 
     def detail_list(self):
         ##
@@ -884,11 +2949,7 @@ class Link():
         # for d in n.detail_list():
         #     print d.anchor() == n # True
         # @endcode
-        dets = []
-        for d in self.graph.detail_list:
-            if d.anchor_uid == self.uid:
-                dets.append(d)
-        return dets
+        return self.graph.anchored_details(self.uid)
 
     def details(self):
         ##
@@ -901,9 +2962,8 @@ class Link():
         #     print n.details()[d].anchor() == n # True
         # @endcode
         dets = {}
-        for d in self.graph.detail_list:
-            if d.anchor_uid == self.uid:
-                dets[d.uid] = d
+        for d in self.graph.anchored_details(self.uid):
+            dets[d.uid] = d
         return dets
 
     def dictionary(self):
@@ -917,12 +2977,17 @@ class Link():
         # q['query'] = 'newnode'
         # g.queue(q)
         # @endcode
-        return {'uid': urllib.quote(self.uid),
-                'name': urllib.quote(self.name),
+        q = self._quoted
+        if q is None:
+            q = (urllib.quote(self.uid), urllib.quote(self.name), urllib.quote(self.type),
+                 urllib.quote(self.origin_uid), urllib.quote(self.terminus_uid))
+            object.__setattr__(self, '_quoted', q)
+        return {'uid': q[0],
+                'name': q[1],
                 'value': str(self.value),
-                'rel_type': urllib.quote(self.type),
-                'o_uid': urllib.quote(self.origin_uid),
-                't_uid': urllib.quote(self.terminus_uid)}
+                'rel_type': q[2],
+                'o_uid': q[3],
+                't_uid': q[4]}
 
     def origin(self):
         ##
@@ -947,13 +3012,7 @@ class Link():
         #     total_value += l2
         # print total_value
         # @endcode
-        ps = []
-        for link in self.graph.link_list():
-            if link.origin_uid == self.origin_uid and link.terminus_uid == self.terminus_uid:
-                ps.append(link)
-            elif link.origin_uid == self.terminus_uid and link.terminus_uid == self.origin_uid:
-                ps.append(link)
-        return ps
+        return self.graph.links_between(self.origin_uid, self.terminus_uid)
 
     def terminus(self):
         ##
@@ -977,9 +3036,7 @@ class Link():
         # l.name = "New Link Name"
         # l.update()
         # @endcode
-        q = self.dictionary()
-        q['query'] = "updaterel"
-        self.graph.queue(q, callback)
+        return self.graph._update(self, "updaterel", callback)
 
     def center(self):
         ##
@@ -998,7 +3055,14 @@ class Link():
 ##
 # LinkType objects define the parameters of Link objects.
 #
-class LinkType:
+class LinkType(object):
+    __slots__ = ('name', 'icon', 'tile', 'color', 'max', 'sync', 'created', 'graph', 'dirty', '_quoted')
+    # Maps each attribute sent by update() to its key in dictionary().
+    _fields = {'icon': 'ICON', 'tile': 'TILE', 'color': 'COLOR', 'max': 'MAX', 'sync': 'SYNC'}
+    _key = 'NAME'
+    # The attributes that dictionary() quotes, whose quoted values are cached until one of them changes.
+    _quoted_fields = frozenset(['name', 'icon', 'tile', 'color'])
+
     def __init__(self, name='Links', icon='img/link_icon.png', tile='img/link_tile.png', color='dynamic', max=10, sync=True):
         ##
         # Constructs a LinkType object.
@@ -1019,13 +3083,13 @@ class LinkType:
         self.name = urllib.unquote(name)
 
         ## <i>str</i> :: The URL of the image to display as the Icon for this LinkType. Should be 24x21 pixels with a transparent background.
-        self.icon = urllib.unquote_plus(icon)
+        self.icon = _intern(urllib.unquote_plus(icon))
 
         ## <i>str</i> :: The URL of the image to display as the Icon for this LinkType. Should be 100x21 pixels with a transparent background.
-        self.tile = urllib.unquote_plus(tile)
+        self.tile = _intern(urllib.unquote_plus(tile))
 
         ## <i>str</i> :: The color of this LinkType. e.g. "#FF0000"
-        self.color = urllib.unquote(color)
+        self.color = _intern(urllib.unquote(color))
 
         ## <i>int</i> :: The maximum value any Link of this LinkType can possess.
         self.max = int(max)
@@ -1035,8 +3099,19 @@ class LinkType:
         ## <i>bool</i> :: Whether or not this LinkType has been created on the server.
         self.created = False
 
-    ## <i>Graph</i> :: The Graph to which this LinkType belongs.
-    graph = None
+        ## <i>Graph</i> :: The Graph to which this LinkType belongs.
+        self.graph = None
+
+        ## <i>set</i> :: The names of the attributes changed since this LinkType was last sent to the server, or None.
+        self.dirty = None
+
+    def __setattr__(self, name, value):
+        # Records which attributes have changed.
+        object.__setattr__(self, name, value)
+        if name in LinkType._quoted_fields:
+            object.__setattr__(self, '_quoted', None)
+        if name in LinkType._fields and getattr(self, 'graph', None):
+            _touch(self, name)
 
     def dictionary(self):
         ##
@@ -1048,10 +3123,15 @@ class LinkType:
         # q = lt.dicitonary()
         # q['query'] = 'newreltype'
         # @endcode
-        return {'NAME': urllib.quote(self.name),
-                'ICON': urllib.quote_plus(self.icon),
-                'TILE': urllib.quote_plus(self.tile),
-                'COLOR': urllib.quote(self.color),
+        q = self._quoted
+        if q is None:
+            q = (urllib.quote(self.name), urllib.quote_plus(self.icon), urllib.quote_plus(self.tile),
+                 urllib.quote(self.color))
+            object.__setattr__(self, '_quoted', q)
+        return {'NAME': q[0],
+                'ICON': q[1],
+                'TILE': q[2],
+                'COLOR': q[3],
                 'MAX': self.max,
                 'SYNC': self.sync}
 
@@ -1066,9 +3146,7 @@ class LinkType:
         # lt.color = "#FF0000"
         # lt.update()
         # @endcode
-        q = self.dictionary()
-        q['query'] = "updatereltype"
-        self.graph.queue(q, callback)
+        return self.graph._update(self, "updatereltype", callback)
 
     def links(self):
         ##
@@ -1081,16 +3159,21 @@ class LinkType:
         # for link in money_links:
         #     print link.origin().name+"--$"+str(link.value)+"-->"+link.terminus().name
         # @endcode
-        ls = []
-        for link in self.graph.links():
-            if link.type == self.name:
-                ls.append(link)
-        return ls
+        return self.graph.links_of_type(self.name)
 
 ##
 # Detail objects contain links or text, and can be attached to Node objects and Link objects.
 #
-class Detail:
+class Detail(object):
+    __slots__ = ('anchor_uid', 'anchor_type', 'content', 'x', 'y', 'type', 'name', 'uid', 'created', 'graph', 'dirty',
+                 '_quoted')
+    # Maps each attribute sent by update() to its key in dictionary().
+    _fields = {'anchor_uid': 'anchor_uid', 'anchor_type': 'anchor_type', 'content': 'content', 'x': 'x', 'y': 'y',
+               'type': 'type', 'name': 'name'}
+    _key = 'uid'
+    # The attributes that dictionary() quotes, whose quoted values are cached until one of them changes.
+    _quoted_fields = frozenset(['anchor_uid', 'uid', 'name', 'content'])
+
     def __init__(self, content, anchor_uid=None, anchor_type=None, x=None, y=None, type='comment', name=None, uid=None):
         ##
         # Constructs a Detail object.
@@ -1108,48 +3191,69 @@ class Detail:
         # d = Detail("http://psymphonic.com/", type="link")
         # n.add_detail(d)
         # @endcode
+        # Fields are set directly; a new object has no Graph for __setattr__ to keep current.
+        set_attr = object.__setattr__
         if not uid:
             uid = str(uuid.uuid4())
         if anchor_uid:
             anchor_uid = urllib.unquote(anchor_uid)
 
         ## <i>str</i> :: The global unique identifier of the object this Detail is anchored to.
-        self.anchor_uid = anchor_uid
+        set_attr(self, 'anchor_uid', anchor_uid)
 
         ## <i>str</i> :: The type of object this Detail is anchored to.
-        self.anchor_type = anchor_type
+        set_attr(self, 'anchor_type', _intern(anchor_type))
 
         ## <i>str</i> :: The content of this Detail.
-        self.content = urllib.unquote_plus(content)
+        set_attr(self, 'content', urllib.unquote_plus(content))
 
         if x:
             x = float(x)
         ## <i>float</i> :: The x-coordinate of the Detail.
-        self.x = x
+        set_attr(self, 'x', x)
 
         if y:
             y = float(y)
         ## <i>float</i> :: The y-coordinate of the Detail.
-        self.y = y
+        set_attr(self, 'y', y)
 
         ## <i>str</i> :: The type of this detail. 'link', 'comment', 'image', 'video'
-        self.type = type
+        set_attr(self, 'type', _intern(type))
 
         if name:
             name = urllib.unquote(name)
         else:
             name = ' '
         ## <i>str</i> :: The name of this detail.  Currently not used on the front end.
-        self.name = name
+        set_attr(self, 'name', name)
 
         ## <i>str</i> :: The global unique identifier of this Detail
-        self.uid = urllib.unquote(uid)
+        set_attr(self, 'uid', urllib.unquote(uid))
 
         ## <i>bool</i> :: Whether or not this Detail has been created on the server.
-        self.created = False
-
-    ## <i>Graph</i> :: The Graph to which this Detail belongs.
-    graph = None
+        set_attr(self, 'created', False)
+
+        ## <i>Graph</i> :: The Graph to which this Detail belongs.
+        set_attr(self, 'graph', None)
+
+        ## <i>set</i> :: The names of the attributes changed since this Detail was last sent to the server, or None.
+        set_attr(self, 'dirty', None)
+        set_attr(self, '_quoted', None)
+
+    def __setattr__(self, name, value):
+        # Keeps the Graph's anchor index current when a Detail is moved to another anchor, and records which
+        # attributes have changed.
+        graph = getattr(self, 'graph', None)
+        if name == 'anchor_uid' and graph:
+            old = getattr(self, name)
+            object.__setattr__(self, name, value)
+            graph._reanchor(self, old)
+        else:
+            object.__setattr__(self, name, value)
+        if name in Detail._quoted_fields:
+            object.__setattr__(self, '_quoted', None)
+        if graph and name in Detail._fields:
+            _touch(self, name)
 
     def anchor(self):
         ##
@@ -1177,11 +3281,16 @@ class Detail:
         # q['query'] = "newdetail"
         # g.queue(q)
         # @endcode
-        return {'anchor_uid': urllib.quote(self.anchor_uid),
+        q = self._quoted
+        if q is None:
+            q = (urllib.quote(self.anchor_uid), urllib.quote(self.uid), urllib.quote(self.name),
+                 urllib.quote_plus(self.content))
+            object.__setattr__(self, '_quoted', q)
+        return {'anchor_uid': q[0],
                 'anchor_type': self.anchor_type,
-                'uid': urllib.quote(self.uid),
-                'name': urllib.quote(self.name),
-                'content': urllib.quote_plus(self.content),
+                'uid': q[1],
+                'name': q[2],
+                'content': q[3],
                 'type': self.type,
                 'x': str(self.x),
                 'y': str(self.y)}
@@ -1196,12 +3305,46 @@ class Detail:
         # d.content = "http://en.wikipedia.org/wiki/Christopher_Alexander"
         # d.update()
         # @endcode
-        q = self.dictionary()
-        q['query'] = "updatedetail"
-        self.graph.queue(q, callback)
+        return self.graph._update(self, "updatedetail", callback)
+
+
+def _pair(uid1, uid2):
+    # Returns the key of an unordered pair of Node uids in the Graph's pair index. Mostly for internal use.
+    if uid1 <= uid2:
+        return uid1, uid2
+    return uid2, uid1
+
+
+def _touch(obj, name):
+    # Records a changed attribute of a Node, Link, LinkType, or Detail. Mostly for internal use.
+    if obj.dirty is None:
+        obj.dirty = set()
+    obj.dirty.add(name)
 
 
-def create_graph(name, url, username, key):
+def _settle(obj, names):
+    # Forgets changes to attributes whose values just came from the server. Mostly for internal use.
+    if obj.dirty:
+        obj.dirty.difference_update(names)
+        if not obj.dirty:
+            obj.dirty = None
+
+
+def _merge(old, new):
+    # Copies the attributes of a freshly loaded object onto the existing one, except attributes changed locally
+    # and not yet sent. Returns the names of the attributes copied. Mostly for internal use.
+    dirty = old.dirty or ()
+    changed = []
+    for name in old._fields:
+        value = getattr(new, name)
+        if name not in dirty and getattr(old, name) != value:
+            setattr(old, name, value)
+            changed.append(name)
+    _settle(old, changed)
+    return changed
+
+
+def create_graph(name, url, username, key, transport=None, graph_class=Graph, mode='url', telemetry=None):
     ##
     # Creates a new Graph that you can access through Psynth.
     #
@@ -1209,6 +3352,10 @@ def create_graph(name, url, username, key):
     # @param url: <i>str</i> :: The base URL for your Psynth server. e.g. https://psynth.psymphonic.com
     # @param username: <i>str</i> :: Your Psynth username
     # @param key: <i>str</i> :: Your Psynth API key.
+    # @param transport: <i>Transport</i> :: An optional connection pool to share with other Graph objects.
+    # @param graph_class: <i>class</i> :: The class of Graph to construct, e.g. AsyncGraph.
+    # @param mode: <i>str</i> :: How queries are sent: 'url', 'post', or 'auto'. See Graph.mode.
+    # @param telemetry: <i>Telemetry</i> :: An optional psynth.telemetry.Telemetry to record queries with.
     # @return graph: <i>Graph</i> ::
     #
     # @code
@@ -1219,13 +3366,16 @@ def create_graph(name, url, username, key):
     #     key='myapikey'
     # )
     # @endcode
-    g = Graph(name=name,
-              url=url,
-              username=username,
-              key=key,
-              filename='')
-    c = requests.get(g.prep({'query': 'createmap',
-                             'name': g.name}), verify=False)
+    g = graph_class(name=name,
+                    url=url,
+                    username=username,
+                    key=key,
+                    filename='',
+                    transport=transport,
+                    mode=mode,
+                    telemetry=telemetry)
+    c = g._fetch({'query': 'createmap',
+                  'name': g.name})
     if c.status_code == 200:
         cr = c.json()
         g.filename = cr['filename']
@@ -1236,7 +3386,8 @@ def create_graph(name, url, username, key):
         print c.url+"    "+str(c.status_code)
 
 
-def load_graph(filename, url, username, key):
+def load_graph(filename, url, username, key, transport=None, graph_class=Graph, callback=None, mode='url',
+               cache=None, telemetry=None):
     ##
     # Loads a Graph from the server.
     #
@@ -1244,6 +3395,15 @@ def load_graph(filename, url, username, key):
     # # @param url: <i>str</i> :: The base URL for your Psynth server. e.g. https://psynth.psymphonic.com
     # # @param username: <i>str</i> :: Your Psynth username
     # # @param key: <i>str</i> :: Your Psynth API key.
+    # # @param transport: <i>Transport</i> :: An optional connection pool to share with other Graph objects.
+    # # @param graph_class: <i>class</i> :: The class of Graph to construct, e.g. AsyncGraph.
+    # # @param callback: <i>function</i> :: An optional function performed on each LinkType, Node, Link, and Detail
+    # # as soon as it has been parsed and added to the Graph.
+    # # @param mode: <i>str</i> :: How queries are sent: 'url', 'post', or 'auto'. See Graph.mode.
+    # # @param cache: <i>SnapshotCache</i> :: An optional psynth.cache.SnapshotCache. A fresh snapshot saved with the
+    # # same username and key is loaded without asking the server; any other is revalidated by ETag; a downloaded
+    # # Graph is saved as a new snapshot.
+    # # @param telemetry: <i>Telemetry</i> :: An optional psynth.telemetry.Telemetry to record queries with.
     # # @return graph: <i>Graph</i> ::
     #
     # @code
@@ -1254,60 +3414,329 @@ def load_graph(filename, url, username, key):
     #     key='myapikey'
     # )
     # @endcode
-    g = Graph(name='',
-              url=url,
-              username=username,
-              key=key,
-              filename=filename)
-    c = requests.get(g.prep({'query': 'getwholegraph'}), verify=False)
-    if c.status_code == 200:
-        cr = c.json()
-        g.name = cr['name']
-        lts = cr['rel_types']
-        ns = cr['nodes']
-        ls = cr['rels']
-        ds = cr['details']
-        for t in lts:
-            lt = LinkType(name=t['NAME'],
-                          icon=t['ICON'],
-                          tile=t['TILE'],
-                          color=t['COLOR'],
-                          max=t['MAX'])
-            lt.created = True
-            g.add_link_type(lt, update=False)
-        for n in ns:
-            nn = Node(uid=n['UID'],
-                      name=n['NAME'],
-                      x=n['X'],
-                      y=n['Y'],
-                      shape=n['SHAPE'],
-                      radius=n['RADIUS'],
-                      color=n['COLOR'],
-                      image=n['PICTURE'])
-            nn.created = True
-            g.add_node(nn, update=False)
-        for link in ls:
-            ll = Link(name=link['NAME'],
-                      type=link['TYPE'],
-                      value=link['VALUE'],
-                      origin_uid=link['ORIGIN'],
-                      terminus_uid=link['TERMINUS'],
-                      uid=link['UID'])
-            ll.created = True
-            g.add_link(ll, update=False)
-        for d in ds:
-            dd = Detail(anchor_type=d['ANCHOR_TYPE'],
-                        anchor_uid=d['ANCHOR_UID'],
-                        name=d['NAME'],
-                        type=d['TYPE'],
-                        content=d['CONTENT'],
-                        uid=d['UID'],
-                        x=d['X'],
-                        y=d['Y'])
-            dd.created = True
-            g.add_detail(dd, update=False)
+    g = graph_class(name='',
+                    url=url,
+                    username=username,
+                    key=key,
+                    filename=filename,
+                    transport=transport,
+                    mode=mode,
+                    telemetry=telemetry)
+    snapshot = cache.lookup(url, filename, username, key) if cache else None
+    writer = None
+    etag = snapshot.etag if snapshot else None
+    if snapshot and snapshot.fresh():
+        sections = _built(snapshot.items())
+    else:
+        headers = None
+        if snapshot and snapshot.etag:
+            headers = {'If-None-Match': snapshot.etag}
+        c = g._fetch({'query': 'getwholegraph'}, stream=True, headers=headers)
+        if c.status_code == 304 and snapshot:
+            cache.touch(snapshot)
+            sections = _built(snapshot.items())
+        elif c.status_code == 200:
+            etag = c.headers.get('ETag')
+            writer = cache.writer(url, filename, etag, username, key) if cache else None
+            sections = _graph_sections(c, writer)
+        else:
+            sections = None
+    if sections is not None:
+        adders = {'rel_types': g.add_link_type,
+                  'nodes': g.add_node,
+                  'rels': g.add_link,
+                  'details': g.add_detail}
+        for section, obj in sections:
+            if section == 'name':
+                g.name = obj
+            elif section in adders:
+                adders[section](obj, update=False)
+                if callback:
+                    callback(obj)
+        if writer:
+            writer.commit()
+        g._synced(etag, cache)
+        # The server has already laid out everything it sent.
+        g.mark_placed()
         return g
     elif c.status_code == 406:
         print c.url+"    "+c.json()
     else:
-        print c.url+"    "+str(c.status_code)
\ No newline at end of file
+        print c.url+"    "+str(c.status_code)
+
+
+def iter_graph(filename, url, username, key, transport=None, mode='url', telemetry=None):
+    ##
+    # Streams the objects of a Graph from the server without keeping them, in the order the server sends them.
+    # Memory use stays bounded no matter how large the Graph is. The yielded objects belong to no Graph.
+    #
+    # @param filename: <i>str</i> :: The global unique filename of the Graph to read.
+    # @param url: <i>str</i> :: The base URL for your Psynth server. e.g. https://psynth.psymphonic.com
+    # @param username: <i>str</i> :: Your Psynth username
+    # @param key: <i>str</i> :: Your Psynth API key.
+    # @param transport: <i>Transport</i> :: An optional connection pool to share with other Graph objects.
+    # @param mode: <i>str</i> :: How queries are sent: 'url', 'post', or 'auto'. See Graph.mode.
+    # @param telemetry: <i>Telemetry</i> :: An optional psynth.telemetry.Telemetry to record queries with.
+    # @return objects: <i>generator</i> :: LinkType, Node, Link, and Detail objects.
+    #
+    # @code
+    # total = 0
+    # for obj in iter_graph('myfile.gt', url, username, key):
+    #     if isinstance(obj, Link):
+    #         total += obj.value
+    # @endcode
+    g = Graph(name='',
+              url=url,
+              username=username,
+              key=key,
+              filename=filename,
+              transport=transport,
+              mode=mode,
+              telemetry=telemetry)
+    try:
+        c = g._fetch({'query': 'getwholegraph'}, stream=True)
+        if c.status_code == 200:
+            for section, obj in _graph_sections(c):
+                if section != 'name':
+                    yield obj
+        elif c.status_code == 406:
+            raise SyntaxError(c.url+"    "+c.json())
+        else:
+            raise SyntaxError(c.url+"    "+str(c.status_code))
+    finally:
+        g.close(wait=False)
+
+
+def _graph_sections(response, writer=None):
+    ##
+    # Parses a 'getwholegraph' response as it downloads, yielding (section, object) pairs: ('name', str) once,
+    # then a LinkType, Node, Link, or Detail for every item of the 'rel_types', 'nodes', 'rels', and 'details'
+    # sections. Mostly for internal use.
+    #
+    # @param response: <i>requests.Response</i> :: A streamed response.
+    # @param writer: <i>SnapshotWriter</i> :: An optional writer to record every parsed value for a snapshot.
+    # @return sections: <i>generator</i> ::
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')('replace')
+    chunks = (decoder.decode(chunk) for chunk in response.iter_content(65536))
+    items = _JSONStream(chunks).members()
+    if writer:
+        items = _recorded(items, writer)
+    return _built(items)
+
+
+def _recorded(items, writer):
+    ##
+    # Passes (section, value) pairs through, recording each with a SnapshotWriter. The snapshot is discarded if
+    # the response cannot be read to the end. Mostly for internal use.
+    try:
+        for section, value in items:
+            writer.add(section, value)
+            yield section, value
+    except BaseException:
+        writer.discard()
+        raise
+
+
+def _built(items):
+    ##
+    # Turns (section, value) pairs from a 'getwholegraph' response or a snapshot into (section, object) pairs.
+    # Mostly for internal use.
+    builders = {'rel_types': _link_type_from,
+                'nodes': _node_from,
+                'rels': _link_from,
+                'details': _detail_from}
+    for section, value in items:
+        if section in builders:
+            obj = builders[section](value)
+            obj.created = True
+            yield section, obj
+        elif section == 'name':
+            yield section, value
+
+
+def _link_type_from(t):
+    return LinkType(name=t['NAME'],
+                    icon=t['ICON'],
+                    tile=t['TILE'],
+                    color=t['COLOR'],
+                    max=t['MAX'])
+
+
+def _node_from(n):
+    return Node(uid=n['UID'],
+                name=n['NAME'],
+                x=n['X'],
+                y=n['Y'],
+                shape=n['SHAPE'],
+                radius=n['RADIUS'],
+                color=n['COLOR'],
+                image=n['PICTURE'])
+
+
+def _link_from(link):
+    return Link(name=link['NAME'],
+                type=link['TYPE'],
+                value=link['VALUE'],
+                origin_uid=link['ORIGIN'],
+                terminus_uid=link['TERMINUS'],
+                uid=link['UID'])
+
+
+def _detail_from(d):
+    return Detail(anchor_type=d['ANCHOR_TYPE'],
+                  anchor_uid=d['ANCHOR_UID'],
+                  name=d['NAME'],
+                  type=d['TYPE'],
+                  content=d['CONTENT'],
+                  uid=d['UID'],
+                  x=d['X'],
+                  y=d['Y'])
+
+
+##
+# An incremental reader for a JSON object whose members are arrays or single values.
+# Only one array item is decoded at a time, so the whole document is never held in memory. Mostly for internal use.
+#
+class _JSONStream(object):
+    def __init__(self, chunks):
+        self.__chunks = iter(chunks)
+        self.__buf = u''
+        self.__pos = 0
+        self.__decoder = json.JSONDecoder()
+
+    def __more(self):
+        # Reads at least as many characters as are left unparsed, so a value spread over many chunks costs
+        # linear time to join rather than one copy of the buffer per chunk.
+        want = max(1, len(self.__buf)-self.__pos)
+        parts = [self.__buf[self.__pos:]]
+        got = 0
+        for chunk in self.__chunks:
+            if chunk:
+                parts.append(chunk)
+                got += len(chunk)
+                if got >= want:
+                    break
+        if not got:
+            return False
+        self.__buf = u''.join(parts)
+        self.__pos = 0
+        return True
+
+    def __peek(self):
+        while True:
+            buf = self.__buf
+            pos = self.__pos
+            while pos < len(buf) and buf[pos] in u' \t\r\n':
+                pos += 1
+            self.__pos = pos
+            if pos < len(buf):
+                return buf[pos]
+            if not self.__more():
+                raise ValueError('Unexpected end of JSON stream.')
+
+    def __next(self):
+        c = self.__peek()
+        self.__pos += 1
+        return c
+
+    def __value(self):
+        # Strings, objects, and arrays end on their own closing character. A number or literal cut short by the
+        # end of a chunk still decodes, e.g. '1.' as 1, so it is only trusted once the delimiter after it has
+        # arrived or the stream has ended.
+        closed = self.__peek() in u'"{['
+        while True:
+            try:
+                value, end = self.__decoder.raw_decode(self.__buf, self.__pos)
+                if closed or (end < len(self.__buf) and self.__buf[end] in u' \t\r\n,:]}') or not self.__more():
+                    self.__pos = end
+                    return value
+            except ValueError:
+                if not self.__more():
+                    raise
+
+    def members(self):
+        ##
+        # Yields (key, value) for each single-valued member and (key, item) for each item of an array member.
+        #
+        # @return members: <i>generator</i> ::
+        if self.__next() != u'{':
+            raise ValueError('Expected a JSON object.')
+        if self.__peek() == u'}':
+            return
+        while True:
+            key = self.__value()
+            if self.__next() != u':':
+                raise ValueError('Expected a colon after '+repr(key)+'.')
+            if self.__peek() == u'[':
+                self.__pos += 1
+                if self.__peek() == u']':
+                    self.__pos += 1
+                else:
+                    while True:
+                        yield key, self.__value()
+                        c = self.__next()
+                        if c == u']':
+                            break
+                        elif c != u',':
+                            raise ValueError('Expected a comma or a closing bracket in '+repr(key)+'.')
+            else:
+                yield key, self.__value()
+            c = self.__next()
+            if c == u'}':
+                return
+            elif c != u',':
+                raise ValueError('Expected a comma or a closing brace.')
+
+
+def create_graph_async(name, url, username, key, transport=None, workers=4, executor=None, **options):
+    ##
+    # Creates a new Graph without blocking the calling thread.
+    # The Graph is created on an Executor thread, and its queries are later sent by the same Executor, so many
+    # Graphs can be driven at once with a bounded number of threads.
+    #
+    # @param name: <i>str</i> :: The name of the Graph to create.
+    # @param url: <i>str</i> :: The base URL for your Psynth server. e.g. https://psynth.psymphonic.com
+    # @param username: <i>str</i> :: Your Psynth username
+    # @param key: <i>str</i> :: Your Psynth API key.
+    # @param transport: <i>Transport</i> :: The connection pool to send queries through. default_transport() if
+    # omitted.
+    # @param workers: <i>int</i> :: The most queries the new AsyncGraph keeps in flight at once.
+    # @param executor: <i>Executor</i> :: The Executor to run on. default_executor() if omitted.
+    # @param options: :: Any other keyword arguments of create_graph, e.g. mode or telemetry.
+    # @return future: <i>Future</i> :: A Future for the new AsyncGraph.
+    #
+    # @code
+    # f = create_graph_async('my graph', 'https://psynth.psymphonic.com/', 'me@company.com', 'myapikey')
+    # g = f.result()
+    # @endcode
+    executor = executor or default_executor()
+    graph_class = functools.partial(AsyncGraph, workers=workers, executor=executor)
+    return executor.submit(create_graph, name, url, username, key, transport=transport or default_transport(),
+                           graph_class=graph_class, **options)
+
+
+def load_graph_async(filename, url, username, key, transport=None, workers=4, executor=None, **options):
+    ##
+    # Loads a Graph from the server without blocking the calling thread.
+    # The Graph is loaded on an Executor thread, and its queries are later sent by the same Executor, so many
+    # Graphs can be driven at once with a bounded number of threads.
+    #
+    # @param filename: <i>str</i> :: The global unique filename of the Graph to load.
+    # @param url: <i>str</i> :: The base URL for your Psynth server. e.g. https://psynth.psymphonic.com
+    # @param username: <i>str</i> :: Your Psynth username
+    # @param key: <i>str</i> :: Your Psynth API key.
+    # @param transport: <i>Transport</i> :: The connection pool to send queries through. default_transport() if
+    # omitted.
+    # @param workers: <i>int</i> :: The most queries the loaded AsyncGraph keeps in flight at once.
+    # @param executor: <i>Executor</i> :: The Executor to run on. default_executor() if omitted.
+    # @param options: :: Any other keyword arguments of load_graph, e.g. callback, mode, cache, or telemetry.
+    # @return future: <i>Future</i> :: A Future for the loaded AsyncGraph.
+    #
+    # @code
+    # futures = [load_graph_async(f, url, username, key, cache=cache) for f in filenames]
+    # graphs = gather(futures).result()
+    # @endcode
+    executor = executor or default_executor()
+    graph_class = functools.partial(AsyncGraph, workers=workers, executor=executor)
+    return executor.submit(load_graph, filename, url, username, key, transport=transport or default_transport(),
+                           graph_class=graph_class, **options)
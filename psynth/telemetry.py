@@ -0,0 +1,190 @@
+#coding=utf-8
+from __future__ import absolute_import
+__author__ = 'psymphonic'
+import bisect
+import threading
+import time
+from collections import deque
+## @package psynth.telemetry
+#  Records what a Graph's queries cost: counts, latency, bytes, errors, and queue depth, per type of query.
+#  Pass a Telemetry to create_graph or load_graph, or set Graph.telemetry. A Graph without one records nothing.
+
+## <i>tuple</i> :: The upper bounds, in milliseconds, of the latency histogram buckets. A last bucket holds the rest.
+latency_buckets = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000, 30000)
+
+
+##
+# A Telemetry collects measurements of the queries one or more Graph objects send.
+# Subclass it, or give Graph.telemetry any object with the same record and sample methods, to send measurements
+# somewhere else.
+#
+class Telemetry(object):
+    def __init__(self, sample_interval=1.0, max_samples=3600):
+        ##
+        # Constructs a Telemetry object.
+        #
+        # @param sample_interval: <i>float</i> :: The fewest seconds between two queue depth samples.
+        # @param max_samples: <i>int</i> :: The most queue depth samples to keep. The oldest go first.
+        #
+        # @code
+        # t = Telemetry()
+        # g = load_graph('myfile.gt', url, username, key, telemetry=t)
+        # ...
+        # print g.telemetry_report()
+        # @endcode
+
+        ## <i>float</i> :: The fewest seconds between two queue depth samples.
+        self.sample_interval = sample_interval
+
+        ## <i>list</i> :: Functions called with a dictionary for every query sent. See record().
+        self.hooks = []
+
+        self.__lock = threading.Lock()
+        self.__stats = {}
+        self.__samples = deque(maxlen=max_samples)
+        self.__last_sample = 0
+
+    def add_hook(self, hook):
+        ##
+        # Adds a function to call for every query sent, e.g. to forward measurements to a metrics system.
+        # Hooks are called on the thread that sent the query, so they should return quickly.
+        #
+        # @param hook: <i>function</i> :: A function taking the event dictionary described in record().
+        #
+        # @code
+        # t.add_hook(lambda e: statsd.timing('psynth.'+e['query'], e['seconds']*1000))
+        # @endcode
+        self.hooks.append(hook)
+
+    def record(self, query, seconds, sent, received, status=None, error=None):
+        ##
+        # Records one query. Called by Graph for every request it makes. Mostly for internal use.
+        #
+        # @param query: <i>str</i> :: The type of query, e.g. 'newnode'.
+        # @param seconds: <i>float</i> :: The time until the response headers arrived, or until the request failed.
+        # @param sent: <i>int</i> :: The bytes of URL and body sent.
+        # @param received: <i>int</i> :: The bytes of response body, or None if unknown, e.g. for a streamed
+        # response without a Content-Length.
+        # @param status: <i>int</i> :: The HTTP status code, or None if the request failed.
+        # @param error: <i>str</i> :: The name of the exception the request failed with, or None.
+        failed = error is not None or (status is not None and status >= 400)
+        bucket = bisect.bisect_left(latency_buckets, seconds*1000)
+        with self.__lock:
+            s = self.__stats.get(query)
+            if s is None:
+                s = self.__stats[query] = {'count': 0, 'errors': 0, 'seconds': 0.0, 'max_seconds': 0.0,
+                                           'sent': 0, 'received': 0, 'latency': [0]*(len(latency_buckets)+1)}
+            s['count'] += 1
+            s['seconds'] += seconds
+            if seconds > s['max_seconds']:
+                s['max_seconds'] = seconds
+            s['sent'] += sent
+            if received:
+                s['received'] += received
+            s['latency'][bucket] += 1
+            if failed:
+                s['errors'] += 1
+        if self.hooks:
+            event = {'query': query, 'seconds': seconds, 'sent': sent, 'received': received, 'status': status,
+                     'error': error}
+            for hook in self.hooks:
+                hook(event)
+
+    def sample(self, depth):
+        ##
+        # Records the depth of a query queue, at most once every sample_interval seconds. Called by Graph as
+        # queries are enqueued. Mostly for internal use.
+        #
+        # @param depth: <i>int</i> :: The number of queries waiting.
+        now = time.time()
+        if now-self.__last_sample < self.sample_interval:
+            return
+        with self.__lock:
+            self.__last_sample = now
+            self.__samples.append((now, depth))
+
+    def depths(self):
+        ##
+        # Returns the queue depth samples.
+        #
+        # @return samples: <i>list</i> :: (seconds since the epoch, depth) tuples, oldest first.
+        #
+        # @code
+        # peak = max(d for t, d in telemetry.depths())
+        # @endcode
+        with self.__lock:
+            return list(self.__samples)
+
+    def summary(self):
+        ##
+        # Returns the measurements so far, per type of query.
+        #
+        # @return summary: <i>dict</i> :: A dictionary keyed by query type. Each value has 'count', 'errors',
+        # 'seconds' (total), 'max_seconds', 'sent' and 'received' bytes, 'latency' (counts per bucket of
+        # latency_buckets, plus one for slower queries), and estimated 'p50', 'p95', and 'p99' latency in seconds.
+        #
+        # @code
+        # s = telemetry.summary()
+        # print s['batchnodes']['p95']
+        # @endcode
+        with self.__lock:
+            stats = dict((q, dict(s, latency=list(s['latency']))) for q, s in self.__stats.iteritems())
+        for s in stats.itervalues():
+            for p in (50, 95, 99):
+                s['p%d' % p] = _percentile(s['latency'], p/100.0, s['max_seconds'])
+        return stats
+
+    def report(self):
+        ##
+        # Returns a table of the measurements so far, one line per type of query, most total time first.
+        #
+        # @return report: <i>str</i> ::
+        #
+        # @code
+        # print telemetry.report()
+        # @endcode
+        stats = self.summary()
+        lines = ['%-16s %7s %6s %9s %9s %9s %9s %11s %11s' % ('query', 'count', 'errors', 'total s', 'p50 ms',
+                                                             'p95 ms', 'max ms', 'sent', 'received')]
+        total = {'count': 0, 'errors': 0, 'seconds': 0.0, 'sent': 0, 'received': 0}
+        for q in sorted(stats, key=lambda q: -stats[q]['seconds']):
+            s = stats[q]
+            lines.append('%-16s %7d %6d %9.3f %9.1f %9.1f %9.1f %11d %11d' % (
+                q, s['count'], s['errors'], s['seconds'], s['p50']*1000, s['p95']*1000, s['max_seconds']*1000,
+                s['sent'], s['received']))
+            for k in total:
+                total[k] += s[k]
+        lines.append('%-16s %7d %6d %9.3f %9s %9s %9s %11d %11d' % (
+            'all', total['count'], total['errors'], total['seconds'], '', '', '', total['sent'], total['received']))
+        samples = self.depths()
+        if samples:
+            lines.append('queue depth: %d samples over %.1fs, peak %d, last %d' % (
+                len(samples), samples[-1][0]-samples[0][0], max(d for t, d in samples), samples[-1][1]))
+        return '\n'.join(lines)
+
+    def reset(self):
+        ##
+        # Forgets every measurement.
+        #
+        # @code
+        # telemetry.reset()
+        # @endcode
+        with self.__lock:
+            self.__stats.clear()
+            self.__samples.clear()
+            self.__last_sample = 0
+
+
+def _percentile(counts, fraction, ceiling):
+    # Estimates a latency percentile, in seconds, as the upper bound of the histogram bucket it falls in.
+    total = sum(counts)
+    if not total:
+        return 0.0
+    seen = 0
+    for i, c in enumerate(counts):
+        seen += c
+        if seen >= fraction*total:
+            if i < len(latency_buckets):
+                return min(latency_buckets[i]/1000.0, ceiling)
+            return ceiling
+    return ceiling
@@ -0,0 +1,46 @@
+#coding=utf-8
+from __future__ import absolute_import
+__author__ = 'psymphonic'
+# Run from the repository root with: python -m unittest discover tests
+import gc
+import unittest
+import weakref
+from psynth.psynth import Graph, Link, Node
+from psynth import analytics
+
+
+def offline_graph(count):
+    # A Graph of count Node objects in a line, built without a server.
+    g = Graph('offline', 'offline.gt', 'http://127.0.0.1:1/', 'me', 'key')
+    nodes = [Node(name='n%d' % i) for i in range(count)]
+    for n in nodes:
+        g.add_node(n, update=False)
+    for i in range(count-1):
+        g.add_link(Link(nodes[i].uid, nodes[i+1].uid, 'next', value=i+1), update=False)
+    return g
+
+
+class AnalyticsTest(unittest.TestCase):
+    def test_analysed_graph_can_be_collected(self):
+        g = offline_graph(10)
+        self.assertEqual(sum(analytics.degree(g).values()), 18)
+        self.assertEqual(len(analytics.components(g)[0]), 10)
+        ref = weakref.ref(g)
+        del g
+        gc.collect()
+        self.assertIsNone(ref())
+        self.assertEqual(len(analytics._cache), 0)
+
+    def test_conversion_is_reused_until_the_graph_changes(self):
+        g = offline_graph(4)
+        m = analytics.matrices(g)
+        self.assertIs(analytics.matrices(g), m)
+        g.add_node(Node(name='alone'), update=False)
+        m = analytics.matrices(g)
+        self.assertEqual(len(m.uids), 5)
+        self.assertEqual([len(c) for c in analytics.components(g)], [4, 1])
+        self.assertTrue(all(isinstance(n, Node) for c in analytics.components(g) for n in c))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+#coding=utf-8
+from __future__ import absolute_import
+__author__ = 'psymphonic'
+# Run from the repository root with: python -m unittest discover tests
+import unittest
+from collections import deque
+from psynth import psynth
+from psynth.psynth import Link, Node, Transport, create_graph
+from psynth.fakeserver import FakeServer
+
+
+class RecordingTransport(Transport):
+    # A Transport that keeps every URL it is asked to GET.
+    def __init__(self):
+        Transport.__init__(self)
+        self.urls = []
+
+    def get(self, url, stream=False, headers=None):
+        self.urls.append(url)
+        return Transport.get(self, url, stream=stream, headers=headers)
+
+
+class BatchTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(seed=1).start()
+        self.server.queries = deque()
+        self.limits = psynth.max_url_length, psynth.max_batch_size
+
+    def tearDown(self):
+        psynth.max_url_length, psynth.max_batch_size = self.limits
+        self.server.stop()
+
+    def batches(self, query):
+        return [q for q in self.server.queries if q['query'] == query]
+
+    def test_batches_stay_under_the_url_limit(self):
+        psynth.max_url_length = 2000
+        t = RecordingTransport()
+        g = create_graph('urls', self.server.url, 'me', 'key', transport=t)
+        nodes = [Node(name='node %d' % i, x=i, y=-i) for i in range(120)]
+        seen = []
+        g.add_nodes(nodes, item_callback=lambda node, r: seen.append((node, r, node.created)))
+        sent = [url for url in t.urls if 'batchnodes' in url]
+        self.assertGreater(len(sent), 1)
+        self.assertTrue(all(len(url) <= psynth.max_url_length for url in sent))
+        batched = [n['uid'] for q in self.batches('batchnodes') for n in q['nodes']]
+        self.assertEqual(batched, [n.uid for n in nodes])
+        self.assertEqual(sorted(self.server.graphs[g.filename]['nodes']), sorted(n.uid for n in nodes))
+        self.assertEqual([s[0] for s in seen], nodes)
+        self.assertTrue(all(r == 'ok' and created for node, r, created in seen))
+
+    def test_batches_stay_under_the_size_limit(self):
+        psynth.max_batch_size = 7
+        g = create_graph('sizes', self.server.url, 'me', 'key', mode='post')
+        nodes = [Node(name='node %d' % i) for i in range(20)]
+        g.add_nodes(nodes)
+        links = [Link(nodes[i].uid, nodes[i+1].uid, 'next') for i in range(19)]
+        responses, items = [], []
+        g.add_links(links, callback=responses.append, item_callback=lambda link, r: items.append(link))
+        self.assertEqual([len(q['nodes']) for q in self.batches('batchnodes')], [7, 7, 6])
+        self.assertEqual([len(q['rels']) for q in self.batches('batchrels')], [7, 7, 5])
+        self.assertEqual(responses, ['ok']*3)
+        self.assertEqual(items, links)
+        self.assertFalse(any(l.dirty for l in links))
+        self.assertEqual(len(self.server.graphs[g.filename]['rels']), 19)
+
+    def test_small_lists_go_in_one_batch(self):
+        g = create_graph('single', self.server.url, 'me', 'key')
+        g.add_nodes([Node(name='node %d' % i) for i in range(30)])
+        self.assertEqual([len(q['nodes']) for q in self.batches('batchnodes')], [30])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,96 @@
+#coding=utf-8
+from __future__ import absolute_import
+__author__ = 'psymphonic'
+# Run from the repository root with: python -m unittest discover tests
+import os
+import shutil
+import tempfile
+import unittest
+from psynth import cache as snapshots
+from psynth.cache import SnapshotCache
+from psynth.fakeserver import FakeServer
+from psynth.psynth import Node, create_graph, load_graph
+
+URL = 'http://psynth.example/'
+
+
+class SnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.cache = SnapshotCache(self.directory, max_age=3600)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def save(self, values, username='me', key='key', name=u'Gr\xe4ph'):
+        writer = self.cache.writer(URL, 'g.gt', '"v1"', username, key)
+        writer.add('name', name)
+        for section, value in values:
+            writer.add(section, value)
+        writer.commit()
+
+    def values(self):
+        rows = [('rel_types', {'NAME': 'next', 'MAX': 10})]
+        rows += [('nodes', {'UID': 'n%d' % i, 'NAME': u'n\xf6de %d' % i, 'X': i*1.5}) for i in range(50)]
+        # A value with a field the others lack.
+        rows.append(('nodes', {'UID': 'odd', 'NAME': 'odd', 'X': 0.0, 'COLOR': '#FF0000'}))
+        rows += [('rels', {'UID': 'r%d' % i, 'ORIGIN': 'n%d' % i, 'TERMINUS': 'n%d' % (i+1)}) for i in range(49)]
+        rows.append(('details', {'UID': 'd', 'CONTENT': u'\u2603', 'ANCHOR_UID': 'n0'}))
+        return rows
+
+    def test_values_read_back_in_order(self):
+        saved = snapshots.block_rows
+        snapshots.block_rows = 16
+        try:
+            self.save(self.values())
+        finally:
+            snapshots.block_rows = saved
+        s = self.cache.lookup(URL, 'g.gt', 'me', 'key')
+        self.assertTrue(s.fresh())
+        self.assertEqual(s.etag, '"v1"')
+        items = list(s.items())
+        self.assertEqual(items[0], ('name', u'Gr\xe4ph'))
+        expected = [(section, dict((k, value.get(k)) for k in value)) for section, value in self.values()]
+        read = [(section, dict((k, v) for k, v in value.items() if v is not None)) for section, value in items[1:]]
+        self.assertEqual(read, expected)
+
+    def test_snapshots_are_kept_per_user(self):
+        self.save(self.values())
+        self.assertIsNone(self.cache.lookup(URL, 'g.gt', 'someone else', 'key'))
+        s = self.cache.lookup(URL, 'g.gt', 'me', 'another key')
+        self.assertFalse(s.fresh())
+        self.assertTrue(self.cache.lookup(URL, 'g.gt', 'me', 'key').fresh())
+
+    def test_corrupt_files_are_dropped(self):
+        self.save(self.values())
+        path = self.cache.lookup(URL, 'g.gt', 'me', 'key').path
+        with open(path, 'rb') as f:
+            data = f.read()
+        for broken in (data[:len(data)//2], 'garbage', data[:-1]+'\xff', ''):
+            with open(path, 'wb') as f:
+                f.write(broken)
+            self.assertIsNone(self.cache.lookup(URL, 'g.gt', 'me', 'key'))
+            self.assertFalse(os.path.exists(path))
+
+    def test_discarded_writer_leaves_nothing(self):
+        writer = self.cache.writer(URL, 'g.gt', None, 'me', 'key')
+        for section, value in self.values():
+            writer.add(section, value)
+        writer.discard()
+        self.assertEqual(os.listdir(self.directory), [])
+
+    def test_load_graph_uses_a_fresh_snapshot_only_for_its_owner(self):
+        with FakeServer() as server:
+            g = create_graph('cached', server.url, 'me', 'key')
+            g.add_node(Node(name='cafe'))
+            load_graph(g.filename, server.url, 'me', 'key', cache=self.cache)
+            self.assertEqual(server.counts['getwholegraph'], 1)
+            h = load_graph(g.filename, server.url, 'me', 'key', cache=self.cache)
+            self.assertEqual(server.counts['getwholegraph'], 1)
+            self.assertEqual([n.name for n in h.node_list()], ['cafe'])
+            load_graph(g.filename, server.url, 'other', 'key', cache=self.cache)
+            self.assertEqual(server.counts['getwholegraph'], 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,171 @@
+#coding=utf-8
+from __future__ import absolute_import
+__author__ = 'psymphonic'
+# Run from the repository root with: python -m unittest discover tests
+import unittest
+from collections import deque
+from psynth.psynth import AsyncGraph, Detail, Link, Node, create_graph, iter_graph, load_graph
+from psynth.fakeserver import FakeServer
+
+
+class FakeServerTest(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeServer(seed=1).start()
+        self.server.queries = deque()
+        self.url = self.server.url
+
+    def tearDown(self):
+        self.server.stop()
+
+    def chain(self, g, count):
+        # Adds count Node objects joined in a line, with a Detail on every Link, and returns them.
+        nodes = [Node(name='n%d' % i, x=i*10, y=i*20) for i in range(count)]
+        links = [Link(nodes[i].uid, nodes[i+1].uid, 'next', value=i+1) for i in range(count-1)]
+        details = [Detail('note %d' % i) for i in range(count-1)]
+        for n in nodes:
+            g.add_node(n)
+        for link, d in zip(links, details):
+            g.add_link(link)
+            link.add_detail(d)
+        return nodes, links, details
+
+    def saved(self, filename, section):
+        return self.server.graphs[filename][section]
+
+    def test_streaming_load(self):
+        g = create_graph('stream', self.url, 'me', 'key')
+        nodes, links, details = self.chain(g, 200)
+        seen = []
+        h = load_graph(g.filename, self.url, 'me', 'key', callback=seen.append)
+        self.assertEqual(sorted(n.uid for n in h.node_list()), sorted(n.uid for n in nodes))
+        self.assertEqual(sorted(l.uid for l in h.link_list()), sorted(l.uid for l in links))
+        self.assertEqual(len(h.detail_list()), len(details))
+        self.assertEqual(len(seen), len(nodes)+len(links)+len(details))
+        self.assertEqual(h.node(nodes[7].uid).x, 70.0)
+        self.assertEqual(h.link(links[3].uid).value, 4)
+        streamed = list(iter_graph(g.filename, self.url, 'me', 'key'))
+        self.assertEqual([o.uid for o in streamed if isinstance(o, Node)], [n.uid for n in nodes])
+        self.assertTrue(all(o.graph is None for o in streamed))
+
+    def test_workers_keep_dependent_queries_in_order(self):
+        self.server.latency = 0.001
+        self.server.jitter = 0.004
+        g = create_graph('ordered', self.url, 'me', 'key', graph_class=AsyncGraph)
+        self.chain(g, 60)
+        g.join()
+        created = set()
+        for q in self.server.queries:
+            if q['query'] == 'newnode':
+                created.add(q['uid'])
+            elif q['query'] == 'newrel':
+                self.assertIn(q['o_uid'], created)
+                self.assertIn(q['t_uid'], created)
+                created.add(q['uid'])
+            elif q['query'] == 'newdetail':
+                self.assertIn(q['anchor_uid'], created)
+        self.assertEqual(len(self.saved(g.filename, 'details')), 59)
+        g.close()
+
+    def test_workers_drop_queries_that_depend_on_a_failed_one(self):
+        g = create_graph('failed', self.url, 'me', 'key', graph_class=AsyncGraph)
+        self.server.latency = 0.01
+        self.server.fail_next(1)
+        a, b = Node(name='a'), Node(name='b')
+        first = g.add_node(a)
+        link = Link(a.uid, a.uid, 'loop')
+        linked = g.add_link(link)
+        noted = link.add_detail(Detail('on the link'))
+        for f in (first, linked, noted):
+            self.assertRaises(SyntaxError, f.result, 5)
+        self.assertRaises(SyntaxError, g.join)
+        self.assertEqual(g.add_node(b).result(5), 'ok')
+        self.assertEqual(list(self.saved(g.filename, 'nodes')), [b.uid])
+        self.assertEqual(len(self.saved(g.filename, 'rels')), 0)
+        self.assertEqual(len(self.saved(g.filename, 'details')), 0)
+        self.assertEqual([q['query'] for q in self.server.queries], ['createmap', 'newnode'])
+        g.close()
+
+    def test_refresh_applies_the_server_diff(self):
+        g = create_graph('refresh', self.url, 'me', 'key')
+        nodes, links, details = self.chain(g, 5)
+        h = load_graph(g.filename, self.url, 'me', 'key')
+        kept = h.node(nodes[0].uid)
+        self.assertEqual(h.refresh(), {'created': [], 'updated': [], 'removed': []})
+
+        g.remove_link(links[3], cascade=True)
+        g.remove_node(nodes[4])
+        nodes[1].name = 'renamed'
+        nodes[1].update()
+        extra = Node(name='extra')
+        g.add_node(extra)
+
+        changes = h.refresh()
+        self.assertEqual([o.uid for o in changes['created']], [extra.uid])
+        self.assertEqual([o.uid for o in changes['updated']], [nodes[1].uid])
+        self.assertEqual(sorted(o.uid for o in changes['removed']),
+                         sorted([nodes[4].uid, links[3].uid, details[3].uid]))
+        self.assertEqual(h.node(nodes[1].uid).name, 'renamed')
+        self.assertIs(h.node(nodes[0].uid), kept)
+        self.assertEqual(len(h.out_links(nodes[3].uid)), 0)
+        self.assertEqual(self.server.counts['getwholegraph'], 3)
+
+    def test_cascade_removes_links_and_details(self):
+        g = create_graph('cascade', self.url, 'me', 'key')
+        nodes, links, details = self.chain(g, 4)
+        nodes[1].add_detail(Detail('on a node'))
+        g.remove_node(nodes[1], cascade=True)
+        self.assertEqual(sorted(self.saved(g.filename, 'nodes')), sorted(n.uid for n in nodes if n is not nodes[1]))
+        self.assertEqual(list(self.saved(g.filename, 'rels')), [links[2].uid])
+        self.assertEqual(list(self.saved(g.filename, 'details')), [details[2].uid])
+        self.assertEqual([l.uid for l in g.link_list()], [links[2].uid])
+        self.assertEqual([d.uid for d in g.detail_list()], [details[2].uid])
+        order = [q['query'] for q in self.server.queries if q['query'].startswith('del')]
+        self.assertEqual(order, sorted(order, key=['deldetail', 'delrel', 'delnode'].index))
+
+    def test_auto_mode_falls_back_to_urls(self):
+        self.server.accept_post = False
+        g = create_graph('fallback', self.url, 'me', 'key', mode='auto')
+        self.chain(g, 10)
+        self.assertEqual(len(self.saved(g.filename, 'nodes')), 10)
+        self.assertEqual(len(self.saved(g.filename, 'rels')), 9)
+        self.assertFalse(g._posting())
+
+        self.server.accept_post = True
+        h = create_graph('post', self.url, 'me', 'key', mode='auto')
+        self.chain(h, 3)
+        self.assertTrue(h._posting())
+        self.assertEqual(len(self.saved(h.filename, 'nodes')), 3)
+
+    def test_auto_mode_falls_back_to_plain_bodies(self):
+        self.server.accept_gzip = False
+        g = create_graph('plain', self.url, 'me', 'key', mode='auto')
+        self.chain(g, 2)
+        for count in (300, 200):
+            g.add_nodes([Node(name='batched %d' % i) for i in range(count)])
+        self.assertEqual(len(self.saved(g.filename, 'nodes')), 502)
+        self.assertTrue(g._posting())
+        self.assertEqual(self.server.counts['batchnodes'], 2)
+
+    def test_partial_updates_send_only_changes(self):
+        g = create_graph('partial', self.url, 'me', 'key')
+        g.partial_updates = True
+        nodes, links, details = self.chain(g, 3)
+        nodes[0].name = 'first'
+        nodes[0].update()
+        sent = self.server.queries[-1]
+        self.assertEqual(sorted(k for k in sent if k not in ('user', 'key', 'filename')), ['name', 'query', 'uid'])
+        self.assertEqual(self.saved(g.filename, 'nodes')[nodes[0].uid]['NAME'], 'first')
+
+        g.translate(5, -5)
+        for n in nodes:
+            n.update()
+        for n in nodes:
+            record = self.saved(g.filename, 'nodes')[n.uid]
+            self.assertEqual((record['X'], record['Y']), (n.x, n.y))
+        sent = self.server.queries[-1]
+        self.assertEqual(sorted(k for k in sent if k not in ('user', 'key', 'filename')), ['query', 'uid', 'x', 'y'])
+        self.assertEqual(self.saved(g.filename, 'nodes')[nodes[2].uid]['NAME'], 'n2')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,145 @@
+#coding=utf-8
+from __future__ import absolute_import
+__author__ = 'psymphonic'
+# Run from the repository root with: python -m unittest discover tests
+import random
+import unittest
+from psynth.psynth import Graph, Node
+
+
+def offline_graph():
+    # A Graph that is never sent to a server; every change is made with update=False.
+    return Graph('offline', 'offline.gt', 'http://127.0.0.1:1/', 'me', 'key')
+
+
+class CloseTest(unittest.TestCase):
+    def test_close_forgets_unplaced_objects(self):
+        g = offline_graph()
+        g.add_node(Node(name='new'), update=False)
+        self.assertEqual(len(g.unplaced()), 1)
+        g.close()
+        self.assertEqual(g.unplaced(), [])
+
+
+class SpatialTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(3)
+        self.g = offline_graph()
+        # Two clusters and a few far-off stragglers, so the grid has both dense and empty regions.
+        for i in range(400):
+            cx, cy = self.rng.choice([(0, 0), (5000, -2000)])
+            n = Node(name='n%d' % i, x=cx+self.rng.gauss(0, 300), y=cy+self.rng.gauss(0, 300))
+            self.g.add_node(n, update=False)
+        for i in range(5):
+            self.g.add_node(Node(name='far%d' % i, x=self.rng.uniform(-1e5, 1e5), y=self.rng.uniform(-1e5, 1e5)),
+                            update=False)
+
+    def box(self, x0, y0, x1, y1):
+        return sorted(n.uid for n in self.g.node_list() if x0 <= n.x <= x1 and y0 <= n.y <= y1)
+
+    def distances(self, nodes, x, y):
+        return [(n.x-x)**2+(n.y-y)**2 for n in nodes]
+
+    def check(self):
+        for i in range(50):
+            x0, x1 = sorted(self.rng.uniform(-2000, 7000) for _ in range(2))
+            y0, y1 = sorted(self.rng.uniform(-4000, 2000) for _ in range(2))
+            self.assertEqual(sorted(n.uid for n in self.g.nodes_in_box(x0, y0, x1, y1)), self.box(x0, y0, x1, y1))
+            x, y = self.rng.uniform(-3e4, 3e4), self.rng.uniform(-3e4, 3e4)
+            for k in (1, 4, 30):
+                found = self.g.nearest(x, y, k=k)
+                brute = sorted(self.g.node_list(), key=lambda n: (n.x-x)**2+(n.y-y)**2)[:k]
+                self.assertEqual(self.distances(found, x, y), self.distances(brute, x, y))
+
+    def test_queries_match_brute_force(self):
+        self.check()
+        n = self.g.node_list()[0]
+        self.assertEqual(self.g.nodes_in_box(n.x, n.y, n.x, n.y), [n])
+        self.assertEqual(len(self.g.nearest(0, 0, k=1000)), len(self.g.node_list()))
+
+    def test_queries_follow_changes(self):
+        self.check()
+        nodes = self.g.node_list()
+        for n in nodes[:60]:
+            n.x += self.rng.uniform(-3000, 3000)
+            n.y += self.rng.uniform(-3000, 3000)
+        for n in nodes[60:90]:
+            self.g.remove_node(n, update=False)
+        self.g.translate(250, -75, nodes=nodes[100:150])
+        self.check()
+        self.g.scale(0.5)
+        self.check()
+
+    def test_empty_graph(self):
+        g = offline_graph()
+        self.assertEqual(g.nodes_in_box(-1, -1, 1, 1), [])
+        self.assertEqual(g.nearest(0, 0, k=3), [])
+
+
+class BoundsTest(unittest.TestCase):
+    def setUp(self):
+        self.rng = random.Random(7)
+        self.g = offline_graph()
+        for i in range(50):
+            self.g.add_node(Node(name='n%d' % i, x=self.rng.uniform(-500, 500), y=self.rng.uniform(-500, 500)),
+                            update=False)
+
+    def assertBounds(self):
+        nodes = self.g.node_list()
+        expected = {'min_x': min(n.x for n in nodes), 'max_x': max(n.x for n in nodes),
+                    'min_y': min(n.y for n in nodes), 'max_y': max(n.y for n in nodes)}
+        box = self.g.bounding_box()
+        for key in expected:
+            self.assertAlmostEqual(box[key], expected[key], msg=key)
+
+    def edge(self, attr, pick):
+        return pick(self.g.node_list(), key=lambda n: getattr(n, attr))
+
+    def test_moves(self):
+        self.assertBounds()
+        self.edge('x', max).x = 0
+        self.assertBounds()
+        self.edge('y', min).y = -2000
+        self.assertBounds()
+        self.edge('x', min).x += 1
+        self.assertBounds()
+        for i in range(200):
+            n = self.rng.choice(self.g.node_list())
+            setattr(n, self.rng.choice('xy'), self.rng.uniform(-800, 800))
+            self.assertBounds()
+
+    def test_adds_and_removes(self):
+        self.assertBounds()
+        self.g.add_node(Node(name='outside', x=900, y=-900), update=False)
+        self.assertBounds()
+        for attr, pick in (('x', max), ('y', min), ('x', min), ('y', max)):
+            self.g.remove_node(self.edge(attr, pick), update=False)
+            self.assertBounds()
+        self.g.remove_node(self.g.node_list()[10], update=False)
+        self.assertBounds()
+
+    def test_translate_and_scale(self):
+        self.assertBounds()
+        self.g.translate(120, -30)
+        self.assertBounds()
+        self.g.scale(2.5)
+        self.assertBounds()
+        self.g.scale(-1, 0, 0)
+        self.assertBounds()
+        self.g.translate(1000, 0, nodes=[self.edge('x', max)])
+        self.assertBounds()
+        self.g.scale(0.1, nodes=[self.edge('y', min), self.edge('y', max)])
+        self.assertBounds()
+
+    def test_empty_graph(self):
+        g = offline_graph()
+        self.assertIsNone(g.bounding_box())
+        n = Node(name='only', x=3, y=4)
+        g.add_node(n, update=False)
+        self.assertEqual(g.bounding_box(), {'min_x': 3, 'max_x': 3, 'min_y': 4, 'max_y': 4})
+        g.remove_node(n, update=False)
+        self.assertIsNone(g.bounding_box())
+
+
+if __name__ == '__main__':
+    unittest.main()
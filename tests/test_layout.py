@@ -0,0 +1,45 @@
+#coding=utf-8
+from __future__ import absolute_import
+__author__ = 'psymphonic'
+# Run from the repository root with: python -m unittest discover tests
+import unittest
+import numpy as np
+from psynth import layout
+
+
+def exact_push(pos, k):
+    # The push on every point from every other point, summed pair by pair.
+    d = pos[:, None, :]-pos[None, :, :]
+    d2 = (d**2).sum(axis=2)
+    w = k*k/np.maximum(d2, 1e-9)
+    np.fill_diagonal(w, 0)
+    return (d*w[:, :, None]).sum(axis=1)
+
+
+class RepulsionTest(unittest.TestCase):
+    def clustered(self, n, seed):
+        rng = np.random.RandomState(seed)
+        centers = rng.uniform(0, np.sqrt(n)*100, (5, 2))
+        return centers[rng.randint(0, len(centers), n)]+rng.normal(0, 300, (n, 2))
+
+    def test_grid_push_is_close_to_the_exact_sum(self):
+        for seed in range(3):
+            pos = self.clustered(1500, seed)
+            exact = exact_push(pos, 100.0)
+            approx = layout._repulsion(pos, 100.0, 1, None)
+            error = np.sqrt(((approx-exact)**2).sum(axis=1))/np.sqrt((exact**2).sum(axis=1))
+            self.assertLess(np.median(error), 0.01)
+            self.assertLess(np.percentile(error, 90), 0.02)
+            self.assertLess(error.max(), 0.25)
+
+    def test_small_graphs_are_exact(self):
+        pos = self.clustered(60, 4)
+        np.testing.assert_allclose(layout._repulsion(pos, 100.0, 1, None), exact_push(pos, 100.0), rtol=1e-6)
+
+    def test_split_among_jobs_gives_the_same_push(self):
+        pos = self.clustered(800, 5)
+        np.testing.assert_allclose(layout._repulsion(pos, 100.0, 3, None), layout._repulsion(pos, 100.0, 1, None))
+
+
+if __name__ == '__main__':
+    unittest.main()
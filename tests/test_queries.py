@@ -0,0 +1,90 @@
+#coding=utf-8
+from __future__ import absolute_import
+__author__ = 'psymphonic'
+# Run from the repository root with: python -m unittest discover tests
+import unittest
+from psynth.psynth import Graph, Link, Node, create_graph
+from psynth.fakeserver import FakeServer
+
+
+def build(g, update):
+    # a -> b -> c -> d is the cheap way to d, a -> e -> d the short one; f stands alone.
+    nodes = dict((name, Node(name=name)) for name in 'abcdef')
+    for name in 'abcdef':
+        g.add_node(nodes[name], update=update)
+    links = {}
+    for ends, value in (('ab', 1), ('bc', 1), ('cd', 1), ('ae', 5), ('ed', 1)):
+        links[ends] = Link(nodes[ends[0]].uid, nodes[ends[1]].uid, 'next', value=value)
+        g.add_link(links[ends], update=update)
+    return nodes, links
+
+
+class LocalQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.g = Graph('offline', 'offline.gt', 'http://127.0.0.1:1/', 'me', 'key')
+        self.nodes, self.links = build(self.g, False)
+
+    def names(self, nodes):
+        if nodes is None:
+            return None
+        return ''.join(n.name for n in nodes)
+
+    def path(self, origin, terminus, **kwargs):
+        return self.names(self.g.shortest_path(self.nodes[origin], self.nodes[terminus], **kwargs))
+
+    def test_shortest_path(self):
+        self.assertEqual(self.path('a', 'd'), 'aed')
+        self.assertEqual(self.path('a', 'd', weighted=True), 'abcd')
+        self.assertEqual(self.path('d', 'a'), 'dea')
+        self.assertEqual(self.path('d', 'a', weighted=True), 'dcba')
+        self.assertIsNone(self.path('d', 'a', directed=True))
+        self.assertEqual(self.path('b', 'd', directed=True), 'bcd')
+        self.assertIsNone(self.path('a', 'f'))
+        self.assertIsNone(self.path('a', 'f', weighted=True))
+        self.assertEqual(self.path('c', 'c'), 'c')
+        seen = []
+        self.g.shortest_path(self.nodes['a'], self.nodes['c'], callback=seen.append)
+        self.assertEqual([self.names(p) for p in seen], ['abc'])
+
+    def test_shortest_path_rejects_negative_values(self):
+        self.links['bc'].value = -1
+        self.assertRaises(ValueError, self.g.shortest_path, self.nodes['a'], self.nodes['d'], weighted=True)
+
+    def test_expand_selection(self):
+        expand = lambda names, **kwargs: self.names(self.g.expand_selection([self.nodes[n] for n in names], **kwargs))
+        self.assertEqual(expand('a', hops=0), 'a')
+        self.assertEqual(expand('a'), 'abe')
+        self.assertEqual(expand('a', hops=2), 'abecd')
+        self.assertEqual(expand('d', hops=10), 'dceba')
+        self.assertEqual(expand('fc'), 'fcdb')
+        self.assertEqual(expand(''), '')
+
+    def test_interconnections(self):
+        between = lambda names: sorted(l.uid for l in self.g.interconnections(self.nodes[n] for n in names))
+        uids = lambda *ends: sorted(self.links[e].uid for e in ends)
+        self.assertEqual(between('abc'), uids('ab', 'bc'))
+        self.assertEqual(between('abcdef'), uids('ab', 'bc', 'cd', 'ae', 'ed'))
+        self.assertEqual(between('adf'), [])
+        self.assertEqual(between('a'), [])
+        self.g.remove_link(self.links['bc'], update=False)
+        self.assertEqual(between('abc'), uids('ab'))
+
+
+class RemoteQueryTest(unittest.TestCase):
+    def test_server_agrees_with_local_answers(self):
+        with FakeServer(seed=1) as server:
+            g = create_graph('queries', server.url, 'me', 'key')
+            nodes, links = build(g, True)
+            a, c, d = nodes['a'], nodes['c'], nodes['d']
+            responses = []
+            g.shortest_path(a, d, remote=True, callback=responses.append)
+            g.expand_selection([a, c], remote=True, callback=responses.append)
+            g.interconnections([a, c, d], remote=True, callback=responses.append)
+            path, expanded, between = [r['uids'] for r in responses]
+            self.assertEqual(path, [n.uid for n in g.shortest_path(a, d)])
+            self.assertEqual(sorted(expanded), sorted(n.uid for n in g.expand_selection([a, c])))
+            self.assertEqual(between, [l.uid for l in g.interconnections([a, c, d])])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,49 @@
+__author__ = 'psymphonic'
+import unittest
+
+import simplejson as json
+
+from psynth.psynth import _JSONStream
+
+# Run from the repository root with: python -m unittest discover tests
+
+
+def chunked(text, size, pulled):
+    # Yields text in chunks of size characters, counting the chunks handed out in pulled[0].
+    for i in range(0, len(text), size):
+        pulled[0] += 1
+        yield unicode(text[i:i+size])
+
+
+class JSONStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.doc = {'name': 'graph', 'rel_types': [],
+                    'nodes': [{'UID': str(i), 'NAME': 'Node '+str(i), 'X': i*1.5, 'Y': -i} for i in range(2000)],
+                    'count': 12345, 'done': True, 'details': []}
+        self.text = json.dumps(self.doc)
+
+    def test_yields_before_the_stream_is_used_up(self):
+        for size in (1, 7, 100):
+            pulled = [0]
+            members = _JSONStream(chunked(self.text, size, pulled)).members()
+            for key, value in members:
+                if key == 'nodes':
+                    break
+            self.assertLess(pulled[0], len(self.text)/size/10, 'chunk size %d' % size)
+
+    def test_values_survive_any_chunking(self):
+        for size in (1, 3, 64, 65536):
+            members = list(_JSONStream(chunked(self.text, size, [0])).members())
+            self.assertEqual([v for k, v in members if k == 'nodes'], self.doc['nodes'])
+            singles = dict((k, v) for k, v in members if k in ('name', 'count', 'done'))
+            self.assertEqual(singles, {'name': 'graph', 'count': 12345, 'done': True})
+
+    def test_numbers_split_across_chunks(self):
+        text = u'{"a": [12345.678, -9e10, 1, true, null]}'
+        for size in range(1, 8):
+            values = [v for k, v in _JSONStream(chunked(text, size, [0])).members()]
+            self.assertEqual(values, [12345.678, -9e10, 1, True, None])
+
+
+if __name__ == '__main__':
+    unittest.main()
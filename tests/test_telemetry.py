@@ -0,0 +1,98 @@
+#coding=utf-8
+from __future__ import absolute_import
+__author__ = 'psymphonic'
+# Run from the repository root with: python -m unittest discover tests
+import unittest
+from psynth import telemetry as metrics
+from psynth.telemetry import Telemetry
+from psynth.fakeserver import FakeServer
+from psynth.psynth import Node, create_graph
+
+
+class TelemetryTest(unittest.TestCase):
+    def setUp(self):
+        self.t = Telemetry(sample_interval=0)
+
+    def test_counters(self):
+        self.t.record('newnode', 0.004, 100, 2)
+        self.t.record('newnode', 0.030, 120, None)
+        self.t.record('newnode', 0.002, 90, 0, status=500)
+        self.t.record('delnode', 1.5, 80, None, error='ConnectionError')
+        s = self.t.summary()
+        self.assertEqual(sorted(s), ['delnode', 'newnode'])
+        n = s['newnode']
+        self.assertEqual((n['count'], n['errors'], n['sent'], n['received']), (3, 1, 310, 2))
+        self.assertAlmostEqual(n['seconds'], 0.036)
+        self.assertEqual(n['max_seconds'], 0.030)
+        latency = [0]*(len(metrics.latency_buckets)+1)
+        latency[metrics.latency_buckets.index(2)] = 1
+        latency[metrics.latency_buckets.index(5)] = 1
+        latency[metrics.latency_buckets.index(50)] = 1
+        self.assertEqual(n['latency'], latency)
+        self.assertEqual((n['p50'], n['p95'], n['p99']), (0.005, 0.030, 0.030))
+        d = s['delnode']
+        self.assertEqual((d['count'], d['errors'], d['received']), (1, 1, 0))
+        self.assertEqual(d['p50'], 1.5)
+
+    def test_summary_is_a_copy(self):
+        self.t.record('newnode', 0.001, 10, 10)
+        self.t.summary()['newnode']['latency'][0] = 99
+        self.assertEqual(self.t.summary()['newnode']['latency'][0], 1)
+
+    def test_hooks_see_every_query(self):
+        events = []
+        self.t.add_hook(events.append)
+        self.t.record('newnode', 0.01, 10, 2, status=200)
+        self.t.record('newrel', 0.5, 20, None, error='Timeout')
+        self.assertEqual(events, [
+            {'query': 'newnode', 'seconds': 0.01, 'sent': 10, 'received': 2, 'status': 200, 'error': None},
+            {'query': 'newrel', 'seconds': 0.5, 'sent': 20, 'received': None, 'status': None, 'error': 'Timeout'}])
+
+    def test_queue_depth_samples(self):
+        for depth in range(10):
+            self.t.sample(depth)
+        self.assertEqual([d for t, d in self.t.depths()], range(10))
+        short = Telemetry(sample_interval=0, max_samples=3)
+        for depth in range(10):
+            short.sample(depth)
+        self.assertEqual([d for t, d in short.depths()], [7, 8, 9])
+        slow = Telemetry(sample_interval=3600)
+        for depth in range(10):
+            slow.sample(depth)
+        self.assertEqual([d for t, d in slow.depths()], [0])
+
+    def test_report_and_reset(self):
+        self.t.record('newnode', 0.01, 10, 2)
+        self.t.record('getwholegraph', 0.5, 30, 4000)
+        self.t.sample(4)
+        lines = self.t.report().split('\n')
+        self.assertEqual([line.split()[0] for line in lines[1:4]], ['getwholegraph', 'newnode', 'all'])
+        self.assertEqual(lines[3].split()[1:3], ['2', '0'])
+        self.assertEqual(lines[3].split()[-2:], ['40', '4002'])
+        self.assertTrue(lines[4].startswith('queue depth: 1 samples'))
+        self.t.reset()
+        self.assertEqual(self.t.summary(), {})
+        self.assertEqual(self.t.depths(), [])
+
+    def test_graph_records_its_queries(self):
+        with FakeServer(seed=1) as server:
+            t = Telemetry(sample_interval=0)
+            g = create_graph('measured', server.url, 'me', 'key', telemetry=t)
+            for i in range(3):
+                g.add_node(Node(name='n%d' % i))
+            g.add_nodes([Node(name='b%d' % i) for i in range(5)])
+            server.fail_next(1, 500)
+            self.assertRaises(Exception, g.add_node, Node(name='failed'))
+            s = t.summary()
+            self.assertEqual(dict((q, (v['count'], v['errors'])) for q, v in s.items()),
+                             {'createmap': (1, 0), 'newnode': (4, 1), 'batchnodes': (1, 0)})
+            self.assertTrue(all(v['sent'] > 0 and v['received'] > 0 for v in s.values()))
+            self.assertIn('newnode', g.telemetry_report())
+            g.telemetry = None
+            g.add_node(Node(name='unmeasured'))
+            self.assertEqual(t.summary()['newnode']['count'], 4)
+            self.assertIsNone(g.telemetry_report())
+
+
+if __name__ == '__main__':
+    unittest.main()